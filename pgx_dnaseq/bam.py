@@ -0,0 +1,592 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from . import ProgramError
+from .bgzf import BgzfReader, LRUCache
+from .tabix import reg_to_bins
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["BamFile", "ReadBatch", "find_bai", "read_bai", "compute_depth",
+           "compute_depths"]
+
+
+# The fixed length part of an alignment record
+_core_dtype = np.dtype([
+    ("block_size", "<i4"), ("ref_id", "<i4"), ("pos", "<i4"),
+    ("l_read_name", "u1"), ("mapq", "u1"), ("bin", "<u2"),
+    ("n_cigar_op", "<u2"), ("flag", "<u2"), ("l_seq", "<i4"),
+    ("next_ref_id", "<i4"), ("next_pos", "<i4"), ("tlen", "<i4"),
+])
+
+# The CIGAR operations (M, I, D, N, S, H, P, = and X) consuming the reference,
+# the query, and aligning a base of the query on the reference
+_consumes_ref = np.array([1, 0, 1, 1, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 0],
+                         dtype=bool)
+_consumes_query = np.array([1, 1, 0, 0, 1, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 0],
+                           dtype=bool)
+_aligned = np.array([1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 0],
+                    dtype=bool)
+
+# The reads skipped by default (unmapped, secondary, QC failed and duplicated,
+# as samtools depth)
+_default_exclude_flags = 0x704
+
+# The size of the windows of the linear index (16 kbp)
+_linear_shift = 14
+
+# The pseudo-bin (containing the statistics of a reference)
+_pseudo_bin = 37450
+
+# The default number of records decoded at once
+_batch_size = 100000
+
+# The default number of decompressed blocks kept in memory (the blocks at the
+# boundary of two queried regions are read once)
+_max_cached_blocks = 16
+
+# The maximal number of bases whose quality is checked at once (the arrays of
+# the bases of a batch are computed by chunks of aligned blocks)
+_max_bases = 1 << 20
+
+
+# A batch of decoded alignment records (the arrays of the CIGAR operations are
+# indexed using ``cigar_index``, the operations of record ``i`` being in
+# ``cigar_index[i]:cigar_index[i + 1]``)
+ReadBatch = namedtuple("ReadBatch", [
+    "ref_id", "pos", "end", "mapq", "flag", "tlen", "cigar_index",
+    "cigar_ops", "cigar_lens", "qual_start", "data",
+])
+
+
+class BamFile(object):
+    """A BAM file (with its index, ``.bai``, for the region queries).
+
+    :param filename: the name of the BAM file
+    :param batch_size: the number of records decoded at once
+    :param max_cached_blocks: the number of decompressed blocks kept in
+                              memory
+
+    :type filename: string
+    :type batch_size: int
+    :type max_cached_blocks: int
+
+    """
+    def __init__(self, filename, batch_size=_batch_size,
+                 max_cached_blocks=_max_cached_blocks):
+        """Initializes a BamFile instance."""
+        self.filename = filename
+        self._batch_size = batch_size
+        self._reader = BgzfReader(filename, LRUCache(max_cached_blocks))
+
+        # The header (the references and their length)
+        self.header, self.references, self.lengths, self._data_voffset = \
+            self._read_header()
+        self._ref_ids = {name: i for i, name in enumerate(self.references)}
+
+        # The index (if any)
+        self._index = None
+        index = find_bai(filename)
+        if index is not None:
+            self._index = read_bai(index)
+
+    def fetch(self, contig=None, start=None, end=None):
+        """Gets the records overlapping a region, by batches.
+
+        :param contig: the contig of the region (all the records if None)
+        :param start: the start of the region (0-based, inclusive)
+        :param end: the end of the region (0-based, exclusive)
+
+        :type contig: string
+        :type start: int
+        :type end: int
+
+        :returns: the batches of records
+        :rtype: generator
+
+        The batches might contain records close to (but outside of) the
+        region, since they are read by blocks.
+
+        """
+        if contig is None:
+            yield from self._iter_batches(self._data_voffset)
+            return
+
+        if self._index is None:
+            m = "{}: no index (.bai)".format(self.filename)
+            raise ProgramError(m)
+        if contig not in self._ref_ids:
+            m = "{}: {}: no such reference".format(self.filename, contig)
+            raise ProgramError(m)
+
+        ref_id = self._ref_ids[contig]
+        if ref_id >= len(self._index):
+            return
+        bins, linear = self._index[ref_id]
+
+        # The region
+        start = 0 if start is None else max(start, 0)
+        end = self.lengths[contig] if end is None else end
+        if end <= start:
+            return
+
+        # The smallest offset of a record overlapping the region
+        min_offset = 0
+        if len(linear) > 0:
+            min_offset = linear[min(start >> _linear_shift, len(linear) - 1)]
+
+        # The chunks of the bins overlapping the region (merged)
+        chunks = sorted(
+            chunk for bin_number in reg_to_bins(start, end)
+            for chunk in bins.get(bin_number, ()) if chunk[1] > min_offset
+        )
+        merged = []
+        for chunk_beg, chunk_end in chunks:
+            chunk_beg = max(chunk_beg, min_offset)
+            if merged and chunk_beg <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], chunk_end)
+                continue
+            merged.append([chunk_beg, chunk_end])
+
+        for chunk_beg, chunk_end in merged:
+            yield from self._iter_batches(chunk_beg, chunk_end)
+
+    def depth(self, contig, start, end, min_mapq=0, min_baseq=0,
+              exclude_flags=_default_exclude_flags):
+        """Computes the depth of each base of a region.
+
+        :param contig: the contig of the region
+        :param start: the start of the region (0-based, inclusive)
+        :param end: the end of the region (0-based, exclusive)
+        :param min_mapq: the minimal mapping quality of the reads
+        :param min_baseq: the minimal base quality
+        :param exclude_flags: the flags of the reads to skip
+
+        :type contig: string
+        :type start: int
+        :type end: int
+        :type min_mapq: int
+        :type min_baseq: int
+        :type exclude_flags: int
+
+        :returns: the depth of each base of the region
+        :rtype: numpy.ndarray
+
+        """
+        return self.depths(contig, start, end, [(min_mapq, min_baseq)],
+                           exclude_flags=exclude_flags)[0]
+
+    def depths(self, contig, start, end, thresholds,
+               exclude_flags=_default_exclude_flags):
+        """Computes the depth of each base of a region for many thresholds.
+
+        :param contig: the contig of the region
+        :param start: the start of the region (0-based, inclusive)
+        :param end: the end of the region (0-based, exclusive)
+        :param thresholds: the minimal mapping and base qualities
+        :param exclude_flags: the flags of the reads to skip
+
+        :type contig: string
+        :type start: int
+        :type end: int
+        :type thresholds: list
+        :type exclude_flags: int
+
+        :returns: the depth of each base of the region (thresholds x bases)
+        :rtype: numpy.ndarray
+
+        The region is read only once, whatever the number of thresholds.
+
+        """
+        return compute_depths(
+            self.fetch(contig, start, end), self._ref_ids[contig], start, end,
+            thresholds, exclude_flags=exclude_flags,
+        )
+
+    def close(self):
+        """Closes the file."""
+        self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _read_header(self):
+        """Reads the header (and the virtual offset of the first record)."""
+        buffer = bytearray()
+        blocks = []
+        coffset = 0
+
+        def _read(size):
+            """Reads blocks until the buffer contains enough data."""
+            nonlocal coffset
+            while len(buffer) < size:
+                data, next_coffset = self._reader.read_block(coffset)
+                if not data and next_coffset == coffset:
+                    m = "{}: truncated BAM header".format(self.filename)
+                    raise ProgramError(m)
+                blocks.append((len(buffer), coffset))
+                buffer.extend(data)
+                coffset = next_coffset
+
+        _read(8)
+        if buffer[:4] != b"BAM\1":
+            m = "{}: not a BAM file".format(self.filename)
+            raise ProgramError(m)
+        l_text = struct.unpack_from("<i", buffer, 4)[0]
+        _read(12 + l_text)
+        header = buffer[8:8 + l_text].rstrip(b"\0").decode()
+        n_ref = struct.unpack_from("<i", buffer, 8 + l_text)[0]
+
+        # The references
+        pos = 12 + l_text
+        references, lengths = [], {}
+        for i in range(n_ref):
+            _read(pos + 4)
+            l_name = struct.unpack_from("<i", buffer, pos)[0]
+            _read(pos + 8 + l_name)
+            name = buffer[pos + 4:pos + 3 + l_name].decode()
+            references.append(name)
+            lengths[name] = struct.unpack_from("<i", buffer,
+                                               pos + 4 + l_name)[0]
+            pos += 8 + l_name
+
+        # The virtual offset of the first record
+        if pos == len(buffer):
+            voffset = coffset << 16
+        else:
+            block_start, block_coffset = [
+                block for block in blocks if block[0] <= pos
+            ][-1]
+            voffset = (block_coffset << 16) | (pos - block_start)
+
+        return header, references, lengths, voffset
+
+    def _iter_batches(self, voffset_beg, voffset_end=None):
+        """Reads the records between two virtual offsets, by batches."""
+        end_coffset = None
+        if voffset_end is not None:
+            end_coffset = voffset_end >> 16
+
+        coffset = voffset_beg >> 16
+        buffer = bytearray()
+        pos = voffset_beg & 0xffff
+
+        # The position of the end in the buffer (once it is loaded)
+        end_pos = None
+        eof = False
+        offsets = []
+        while True:
+            # Loading the next block
+            if not eof:
+                if (end_coffset is not None and end_pos is None and
+                        coffset >= end_coffset):
+                    end_pos = len(buffer)
+                    if coffset == end_coffset:
+                        end_pos += voffset_end & 0xffff
+
+                data, next_coffset = self._reader.read_block(coffset)
+                if not data and next_coffset == coffset:
+                    eof = True
+                buffer.extend(data)
+                coffset = next_coffset
+
+            # The complete records
+            limit = len(buffer) if end_pos is None else end_pos
+            while pos < limit and pos + 4 <= len(buffer):
+                size = struct.unpack_from("<i", buffer, pos)[0]
+                if pos + 4 + size > len(buffer):
+                    break
+                offsets.append(pos)
+                pos += 4 + size
+
+            done = eof or (end_pos is not None and pos >= end_pos)
+            if offsets and (done or len(offsets) >= self._batch_size):
+                yield _decode_records(bytes(buffer[:pos]), offsets)
+
+                # Removing the decoded records from the buffer
+                del buffer[:pos]
+                if end_pos is not None:
+                    end_pos -= pos
+                pos = 0
+                offsets = []
+
+            if done:
+                return
+
+
+def find_bai(filename):
+    """Finds the index of a BAM file.
+
+    :param filename: the name of the BAM file
+
+    :type filename: string
+
+    :returns: the name of the index (``X.bam.bai``, or ``X.bai``), or None if
+              there is none
+    :rtype: string
+
+    """
+    for index in ("{}.bai".format(filename),
+                  "{}.bai".format(os.path.splitext(filename)[0])):
+        if os.path.isfile(index):
+            return index
+    return None
+
+
+def read_bai(filename):
+    """Reads a BAM index.
+
+    :param filename: the name of the index (``.bai``)
+
+    :type filename: string
+
+    :returns: the bins (a dict of chunks) and the linear index of each
+              reference
+    :rtype: list
+
+    """
+    with open(filename, "rb") as i_file:
+        data = i_file.read()
+
+    if data[:4] != b"BAI\1":
+        m = "{}: not a BAM index".format(filename)
+        raise ProgramError(m)
+
+    n_ref = struct.unpack_from("<i", data, 4)[0]
+    offset = 8
+
+    index = []
+    for i in range(n_ref):
+        # The binning index
+        bins = {}
+        n_bin = struct.unpack_from("<i", data, offset)[0]
+        offset += 4
+        for j in range(n_bin):
+            bin_number, n_chunk = struct.unpack_from("<Ii", data, offset)
+            offset += 8
+            chunks = struct.unpack_from("<{}Q".format(n_chunk * 2), data,
+                                        offset)
+            offset += 16 * n_chunk
+            if bin_number != _pseudo_bin:
+                bins[bin_number] = list(zip(chunks[::2], chunks[1::2]))
+
+        # The linear index
+        n_intv = struct.unpack_from("<i", data, offset)[0]
+        offset += 4
+        linear = np.frombuffer(data, dtype="<u8", count=n_intv,
+                               offset=offset)
+        offset += 8 * n_intv
+
+        index.append((bins, [int(voffset) for voffset in linear]))
+
+    return index
+
+
+def compute_depth(batches, ref_id, start, end, min_mapq=0, min_baseq=0,
+                  exclude_flags=_default_exclude_flags):
+    """Computes the depth of each base of a region from batches of records.
+
+    :param batches: the batches of records (:py:class:`ReadBatch`)
+    :param ref_id: the reference of the region
+    :param start: the start of the region (0-based, inclusive)
+    :param end: the end of the region (0-based, exclusive)
+    :param min_mapq: the minimal mapping quality of the reads
+    :param min_baseq: the minimal base quality
+    :param exclude_flags: the flags of the reads to skip
+
+    :type batches: iterable
+    :type ref_id: int
+    :type start: int
+    :type end: int
+    :type min_mapq: int
+    :type min_baseq: int
+    :type exclude_flags: int
+
+    :returns: the depth of each base of the region
+    :rtype: numpy.ndarray
+
+    As ``samtools depth``, only the aligned bases (``M``, ``=`` and ``X``)
+    are counted (not the deletions).
+
+    """
+    return compute_depths(batches, ref_id, start, end,
+                          [(min_mapq, min_baseq)],
+                          exclude_flags=exclude_flags)[0]
+
+
+def compute_depths(batches, ref_id, start, end, thresholds,
+                   exclude_flags=_default_exclude_flags):
+    """Computes the depth of a region for many quality thresholds.
+
+    :param batches: the batches of records (:py:class:`ReadBatch`)
+    :param ref_id: the reference of the region
+    :param start: the start of the region (0-based, inclusive)
+    :param end: the end of the region (0-based, exclusive)
+    :param thresholds: the minimal mapping and base qualities (pairs)
+    :param exclude_flags: the flags of the reads to skip
+
+    :type batches: iterable
+    :type ref_id: int
+    :type start: int
+    :type end: int
+    :type thresholds: list
+    :type exclude_flags: int
+
+    :returns: the depth of each base of the region (thresholds x bases)
+    :rtype: numpy.ndarray
+
+    Without base quality threshold, the aligned blocks are added as
+    intervals (using a difference array); otherwise, the quality of each
+    base is checked. The CIGAR operations (and the bases) of each batch are
+    computed once for all the thresholds. The bases are computed by chunks of
+    aligned blocks (of about ``_max_bases`` bases), so that the memory usage
+    doesn't depend on the length of the reads of a batch.
+
+    """
+    length = end - start
+    depths = np.zeros((len(thresholds), length), dtype=np.int64)
+    min_mapq = min(mapq for mapq, baseq in thresholds)
+    need_bases = any(baseq > 0 for mapq, baseq in thresholds)
+
+    for batch in batches:
+        # The reads that might be kept
+        candidates = ((batch.ref_id == ref_id) &
+                      ((batch.flag & exclude_flags) == 0) &
+                      (batch.mapq >= min_mapq) &
+                      (batch.pos < end) & (batch.end > start))
+        if not candidates.any():
+            continue
+
+        # The record of each CIGAR operation, and the start of each
+        # operation on the reference and on the query
+        nb_ops = np.diff(batch.cigar_index)
+        op_record = np.repeat(np.arange(len(nb_ops)), nb_ops)
+        ops, lens = batch.cigar_ops, batch.cigar_lens
+        op_ref_start = (batch.pos[op_record] +
+                        _offsets_in_record(lens * _consumes_ref[ops],
+                                           batch.cigar_index, op_record))
+
+        # The aligned blocks of the candidate reads
+        blocks = np.flatnonzero(_aligned[ops] & candidates[op_record])
+        block_record = op_record[blocks]
+
+        for i, (mapq, baseq) in enumerate(thresholds):
+            if baseq > 0:
+                continue
+
+            # The intervals (clipped to the region)
+            kept = batch.mapq >= mapq
+            kept_blocks = blocks[kept[block_record]]
+            block_start = np.clip(op_ref_start[kept_blocks] - start, 0,
+                                  length)
+            block_end = np.clip(
+                op_ref_start[kept_blocks] + lens[kept_blocks] - start, 0,
+                length,
+            )
+            diff = (np.bincount(block_start, minlength=length + 1) -
+                    np.bincount(block_end, minlength=length + 1))
+            depths[i] += np.cumsum(diff[:length])
+
+        if (not need_bases) or (len(blocks) == 0):
+            continue
+
+        # The chunks of aligned blocks (of about _max_bases bases)
+        op_query_start = _offsets_in_record(
+            lens * _consumes_query[ops], batch.cigar_index, op_record,
+        )
+        block_last = np.cumsum(lens[blocks])
+        bounds = np.searchsorted(
+            block_last, np.arange(_max_bases, block_last[-1], _max_bases),
+        )
+        bounds = np.unique(np.concatenate(([0], bounds, [len(blocks)])))
+
+        for chunk_start, chunk_end in zip(bounds[:-1], bounds[1:]):
+            # The position (on the reference) and the quality of each base
+            chunk = blocks[chunk_start:chunk_end]
+            base_block = np.repeat(np.arange(len(chunk)), lens[chunk])
+            block_first = np.cumsum(lens[chunk]) - lens[chunk]
+            within = np.arange(len(base_block)) - block_first[base_block]
+            base_op = chunk[base_block]
+            base_ref = op_ref_start[base_op] + within
+            base_record = op_record[base_op]
+            base_qual = batch.data[batch.qual_start[base_record] +
+                                   op_query_start[base_op] + within]
+            in_region = (base_ref >= start) & (base_ref < end)
+
+            for i, (mapq, baseq) in enumerate(thresholds):
+                if baseq <= 0:
+                    continue
+
+                # The good quality bases in the region
+                kept = batch.mapq >= mapq
+                counted = (in_region & kept[base_record] &
+                           (base_qual >= baseq))
+                depths[i] += np.bincount(base_ref[counted] - start,
+                                         minlength=length)
+
+    return depths
+
+
+def _offsets_in_record(values, cigar_index, op_record):
+    """Computes the cumulative sum of the preceding operations in a record."""
+    cumul = np.cumsum(values) - values
+    record_first = np.append(cumul, 0)[cigar_index[:-1]]
+    return cumul - record_first[op_record]
+
+
+def _decode_records(buffer, offsets):
+    """Decodes alignment records (vectorized)."""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.array(offsets, dtype=np.int64)
+
+    # The fixed length part of the records
+    core = data[offsets[:, np.newaxis] + np.arange(_core_dtype.itemsize)]
+    core = core.view(_core_dtype).ravel()
+
+    # The CIGAR operations
+    nb_ops = core["n_cigar_op"].astype(np.int64)
+    cigar_index = np.append(0, np.cumsum(nb_ops))
+    cigar_start = offsets + _core_dtype.itemsize + core["l_read_name"]
+    op_record = np.repeat(np.arange(len(offsets)), nb_ops)
+    op_pos = (cigar_start[op_record] +
+              4 * (np.arange(cigar_index[-1]) - cigar_index[op_record]))
+    cigar = data[op_pos[:, np.newaxis] + np.arange(4)].view("<u4").ravel()
+    cigar_ops = (cigar & 0xf).astype(np.int64)
+    cigar_lens = (cigar >> 4).astype(np.int64)
+
+    # The end of the records on the reference
+    pos = core["pos"].astype(np.int64)
+    ref_lens = np.bincount(op_record,
+                           weights=cigar_lens * _consumes_ref[cigar_ops],
+                           minlength=len(offsets)).astype(np.int64)
+    end = pos + np.maximum(ref_lens, 1)
+
+    # The start of the base qualities
+    qual_start = cigar_start + 4 * nb_ops + (core["l_seq"] + 1) // 2
+
+    return ReadBatch(
+        ref_id=core["ref_id"], pos=pos, end=end, mapq=core["mapq"],
+        flag=core["flag"], tlen=core["tlen"], cigar_index=cigar_index,
+        cigar_ops=cigar_ops, cigar_lens=cigar_lens, qual_start=qual_start,
+        data=data,
+    )
@@ -0,0 +1,448 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import hashlib
+from zipfile import BadZipFile
+
+import numpy as np
+
+from . import ProgramError
+from .utils import atomic_output
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["read_bed", "read_fai", "pad_regions", "write_bed",
+           "get_padded_bed", "file_checksum", "BedIndex", "index_regions",
+           "get_bed_index"]
+
+
+# The version of the cached indexes (the cache is rebuilt if it changes)
+_index_version = 1
+
+
+def read_bed(filename):
+    """Reads the regions of a BED file.
+
+    :param filename: the name of the BED file
+
+    :type filename: string
+
+    :returns: the regions (chromosome, start, end) in the file order
+    :rtype: list
+
+    The header lines (``track``, ``browser`` and comments) are skipped.
+
+    """
+    regions = []
+    with open(filename, "r") as i_file:
+        for i, line in enumerate(i_file):
+            row = line.rstrip("\r\n").split("\t")
+            if (row == [""]) or row[0].startswith(("#", "track", "browser")):
+                continue
+
+            try:
+                regions.append((row[0], int(row[1]), int(row[2])))
+            except (IndexError, ValueError):
+                m = "{}: line {}: invalid region".format(filename, i + 1)
+                raise ProgramError(m)
+
+    return regions
+
+
+def read_fai(filename):
+    """Reads the length of the chromosomes from a FASTA index.
+
+    :param filename: the name of the FASTA index (``.fai``)
+
+    :type filename: string
+
+    :returns: the length of each chromosome (in the reference order)
+    :rtype: dict
+
+    """
+    lengths = {}
+    with open(filename, "r") as i_file:
+        for line in i_file:
+            row = line.rstrip("\n").split("\t")
+            lengths[row[0]] = int(row[1])
+
+    return lengths
+
+
+def pad_regions(regions, padding, lengths=None):
+    """Pads regions (clipping them to the chromosome boundaries).
+
+    :param regions: the regions (chromosome, start, end)
+    :param padding: the number of bases to add on each side
+    :param lengths: the length of each chromosome (from the reference)
+
+    :type regions: list
+    :type padding: int
+    :type lengths: dict
+
+    :returns: the padded regions (those on chromosomes absent from the
+              reference are dropped)
+    :rtype: list
+
+    """
+    padded = []
+    for chrom, start, end in regions:
+        start = max(start - padding, 0)
+        end = end + padding
+        if lengths is not None:
+            if chrom not in lengths:
+                continue
+            end = min(end, lengths[chrom])
+        padded.append((chrom, start, end))
+
+    return padded
+
+
+def write_bed(regions, filename):
+    """Writes regions in a BED file.
+
+    :param regions: the regions (chromosome, start, end)
+    :param filename: the name of the BED file
+
+    :type regions: list
+    :type filename: string
+
+    The file is replaced once written (using :py:func:`atomic_output`).
+
+    """
+    with atomic_output(filename, mode="w") as o_file:
+        for region in regions:
+            print(*region, sep="\t", file=o_file)
+
+
+def get_padded_bed(filename, padding, out_dir, reference=None):
+    """Gets a padded and merged version of a BED file (cached).
+
+    :param filename: the name of the BED file
+    :param padding: the number of bases to add on each side of the regions
+    :param out_dir: the directory where the padded BED file is cached
+    :param reference: the reference (FASTA) with its index (``.fai``)
+
+    :type filename: string
+    :type padding: int
+    :type out_dir: string
+    :type reference: string
+
+    :returns: the name of the padded BED file
+    :rtype: string
+
+    The padded file is only created if it doesn't exist, or if it is older
+    than the BED file (or the reference index).
+
+    """
+    if not os.path.isfile(filename):
+        m = "{}: no such file".format(filename)
+        raise ProgramError(m)
+
+    # The reference index (to clip the regions)
+    fai = None
+    if reference is not None:
+        fai = "{}.fai".format(reference)
+        if not os.path.isfile(fai):
+            m = "{}: no such file".format(fai)
+            raise ProgramError(m)
+
+    # The name of the cached file
+    name = os.path.splitext(os.path.basename(filename))[0]
+    padded_filename = os.path.join(
+        out_dir, "{}.padded_{}.bed".format(name, padding),
+    )
+
+    # Is the cached file up to date?
+    if os.path.isfile(padded_filename):
+        padded_mtime = os.path.getmtime(padded_filename)
+        sources = [filename] if fai is None else [filename, fai]
+        if all(os.path.getmtime(i) <= padded_mtime for i in sources):
+            return padded_filename
+
+    # Padding and merging the regions
+    lengths = None
+    chromosomes = None
+    if fai is not None:
+        lengths = read_fai(fai)
+        chromosomes = list(lengths.keys())
+    regions = pad_regions(read_bed(filename), padding, lengths)
+    regions = index_regions(regions, chromosomes).regions()
+
+    # Saving the regions
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+    write_bed(regions, padded_filename)
+
+    return padded_filename
+
+
+def file_checksum(filename):
+    """Computes the MD5 checksum of a file.
+
+    :param filename: the name of the file
+
+    :type filename: string
+
+    :returns: the checksum (hexadecimal)
+    :rtype: string
+
+    """
+    md5 = hashlib.md5()
+    with open(filename, "rb") as i_file:
+        for chunk in iter(lambda: i_file.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class BedIndex(object):
+    """An index of sorted and merged regions (binary searches in arrays).
+
+    :param contigs: the name of the contigs (in order)
+    :param starts: the start of the regions (0-based, sorted by contig)
+    :param ends: the end of the regions (exclusive)
+    :param offsets: the index of the first region of each contig (and the
+                    number of regions at the end)
+    :param nb_overlaps: the number of regions that were overlapping a
+                        previous region (before the merge)
+
+    :type contigs: list
+    :type starts: numpy.ndarray
+    :type ends: numpy.ndarray
+    :type offsets: numpy.ndarray
+    :type nb_overlaps: int
+
+    Since the regions of a contig are merged, both their starts and their ends
+    are sorted.
+
+    """
+    def __init__(self, contigs, starts, ends, offsets, nb_overlaps=0):
+        """Initialize a BedIndex instance."""
+        self.contigs = [str(contig) for contig in contigs]
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nb_overlaps = nb_overlaps
+
+        # The number of targeted bases
+        self.nb_bases = int(np.sum(self.ends - self.starts))
+
+        # The regions of each contig
+        self._bounds = {
+            contig: (int(self.offsets[i]), int(self.offsets[i + 1]))
+            for i, contig in enumerate(self.contigs)
+        }
+
+    def __len__(self):
+        return len(self.starts)
+
+    def regions(self):
+        """Returns the regions (contig, start, end) of the index."""
+        regions = []
+        for contig in self.contigs:
+            beg, end = self._bounds[contig]
+            regions.extend(
+                (contig, int(start), int(stop)) for start, stop in
+                zip(self.starts[beg:end], self.ends[beg:end])
+            )
+        return regions
+
+    def contains(self, contig, positions):
+        """Checks if positions are in the regions.
+
+        :param contig: the contig
+        :param positions: the positions (0-based)
+
+        :type contig: string
+        :type positions: int or numpy.ndarray
+
+        :returns: whether each position is in a region
+        :rtype: bool or numpy.ndarray
+
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        beg, end = self._bounds.get(contig, (0, 0))
+        if beg == end:
+            return np.zeros_like(positions, dtype=bool)
+
+        # The last region starting at or before each position
+        i = np.searchsorted(self.starts[beg:end], positions, side="right") - 1
+        return (i >= 0) & (positions < self.ends[beg:end][np.maximum(i, 0)])
+
+    def fetch(self, contig, start, end):
+        """Gets the regions overlapping an interval.
+
+        :param contig: the contig
+        :param start: the start of the interval (0-based)
+        :param end: the end of the interval (exclusive)
+
+        :type contig: string
+        :type start: int
+        :type end: int
+
+        :returns: the overlapping regions (contig, start, end)
+        :rtype: list
+
+        """
+        beg, stop = self._bounds.get(contig, (0, 0))
+
+        # The first region ending after the start, and the first one starting
+        # at or after the end
+        first = beg + np.searchsorted(self.ends[beg:stop], start, side="right")
+        last = beg + np.searchsorted(self.starts[beg:stop], end, side="left")
+
+        return [(contig, int(region_start), int(region_end))
+                for region_start, region_end in
+                zip(self.starts[first:last], self.ends[first:last])]
+
+    def save(self, filename, checksum):
+        """Saves the index (NumPy ``.npz``) with the checksum of its source.
+
+        :param filename: the name of the file
+        :param checksum: the checksum of the source BED file
+
+        :type filename: string
+        :type checksum: string
+
+        The file is replaced once written (using :py:func:`atomic_output`).
+
+        """
+        with atomic_output(filename, suffix=".npz") as o_file:
+            np.savez(o_file, version=_index_version, checksum=checksum,
+                     contigs=np.array(self.contigs, dtype=str),
+                     starts=self.starts, ends=self.ends, offsets=self.offsets,
+                     nb_overlaps=self.nb_overlaps)
+
+
+def index_regions(regions, chromosomes=None):
+    """Sorts, merges and indexes regions.
+
+    :param regions: the regions (chromosome, start, end)
+    :param chromosomes: the contig order (the order of appearance if None)
+
+    :type regions: list
+    :type chromosomes: list
+
+    :returns: the index of the regions
+    :rtype: :py:class:`BedIndex`
+
+    The contigs absent from ``chromosomes`` follow the others (in their order
+    of appearance). Overlapping (or adjacent) regions are merged.
+
+    """
+    if len(regions) == 0:
+        return BedIndex([], [], [], [0])
+
+    names, starts, ends = zip(*regions)
+    starts = np.array(starts, dtype=np.int64)
+    ends = np.array(ends, dtype=np.int64)
+
+    # The contig of each region (in their order of appearance, or in the
+    # given order)
+    contigs, first, codes = np.unique(np.array(names), return_index=True,
+                                      return_inverse=True)
+    order = np.argsort(first)
+    if chromosomes is not None:
+        chrom_order = {chrom: i for i, chrom in enumerate(chromosomes)}
+        order = np.array(sorted(
+            order, key=lambda i: chrom_order.get(contigs[i], len(chrom_order)),
+        ), dtype=np.int64)
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+    contigs = contigs[order]
+    codes = ranks[codes.ravel()]
+
+    # Sorting the regions by contig and start
+    order = np.lexsort((ends, starts, codes))
+    codes, starts, ends = codes[order], starts[order], ends[order]
+
+    # The highest end seen so far on each contig (shifting the contigs, so
+    # that the running maximum never goes from a contig to the next)
+    shift = codes * (int(ends.max()) + 1)
+    max_ends = np.maximum.accumulate(ends + shift) - shift
+
+    # A region starts a new merged region if it is on another contig, or if
+    # it starts after all the previous ones
+    same_contig = codes[1:] == codes[:-1]
+    nb_overlaps = int(np.count_nonzero(same_contig &
+                                       (starts[1:] < max_ends[:-1])))
+    new_region = np.flatnonzero(np.concatenate((
+        [True], ~same_contig | (starts[1:] > max_ends[:-1]),
+    )))
+
+    # Merging
+    merged_codes = codes[new_region]
+    merged_starts = starts[new_region]
+    merged_ends = np.maximum.reduceat(ends, new_region)
+    offsets = np.searchsorted(merged_codes, np.arange(len(contigs) + 1))
+
+    return BedIndex(contigs, merged_starts, merged_ends, offsets,
+                    nb_overlaps=nb_overlaps)
+
+
+def get_bed_index(filename, cache_dir=None):
+    """Gets the index of a BED file (cached).
+
+    :param filename: the name of the BED file
+    :param cache_dir: the directory where the index is cached (e.g. the
+                      output directory of the run, the index is not cached
+                      if None)
+
+    :type filename: string
+    :type cache_dir: string
+
+    :returns: the index of the (merged) regions of the BED file
+    :rtype: :py:class:`BedIndex`
+
+    The cached index (``.index.npz``) is only used if it was computed from a
+    file with the same checksum. If it cannot be saved (e.g. read-only
+    directory), the index is simply not cached.
+
+    """
+    if not os.path.isfile(filename):
+        m = "{}: no such file".format(filename)
+        raise ProgramError(m)
+    checksum = file_checksum(filename)
+
+    # The name of the cached file
+    cache = None
+    if cache_dir is not None:
+        cache = os.path.join(
+            cache_dir, "{}.index.npz".format(os.path.basename(filename)),
+        )
+
+    # Is the cached index up to date?
+    if (cache is not None) and os.path.isfile(cache):
+        try:
+            with np.load(cache, allow_pickle=False) as data:
+                if ((int(data["version"]) == _index_version)
+                        and (str(data["checksum"]) == checksum)):
+                    return BedIndex(data["contigs"], data["starts"],
+                                    data["ends"], data["offsets"],
+                                    nb_overlaps=int(data["nb_overlaps"]))
+        except (OSError, ValueError, KeyError, BadZipFile):
+            pass
+
+    # Indexing the regions
+    index = index_regions(read_bed(filename))
+
+    # Saving the index
+    if cache is not None:
+        try:
+            index.save(cache, checksum)
+        except OSError:
+            pass
+
+    return index
@@ -0,0 +1,271 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+
+from . import ProgramError
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["BgzfWriter", "BgzfReader", "LRUCache"]
+
+
+# The maximal size of the uncompressed data of a block (the same as htslib,
+# so that a block never exceeds 64 KiB once compressed)
+_max_block_size = 0xff00
+
+# The header of a block (with the BC extra subfield containing its size)
+_block_header = struct.Struct("<4BI2BH2BHH")
+
+# The magic number of a block (with the extra field flag)
+_block_magic = b"\x1f\x8b\x08\x04"
+
+# The end of file marker (an empty block)
+_eof_block = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+
+
+class BgzfWriter(object):
+    """Writes a BGZF (blocked GNU zip format) file.
+
+    :param filename: the name of the file
+    :param compress_level: the compression level of the blocks
+
+    :type filename: string
+    :type compress_level: int
+
+    BGZF files can be read as normal gzip files (e.g. using :py:mod:`gzip`),
+    and can be indexed (e.g. by ``tabix``) using the virtual offsets returned
+    by :py:meth:`tell`.
+
+    """
+    def __init__(self, filename, compress_level=6):
+        """Initializes a BgzfWriter instance."""
+        self._handle = open(filename, "wb")
+        self._compress_level = compress_level
+        self._buffer = bytearray()
+
+    def write(self, data):
+        """Writes data (bytes) to the file."""
+        self._buffer.extend(data)
+        while len(self._buffer) >= _max_block_size:
+            self._write_block(bytes(self._buffer[:_max_block_size]))
+            del self._buffer[:_max_block_size]
+
+    def tell(self):
+        """Returns the virtual offset of the current position.
+
+        The virtual offset is the position of the current block in the
+        compressed file (shifted by 16 bits) combined with the position in
+        the uncompressed block.
+
+        """
+        return (self._handle.tell() << 16) | len(self._buffer)
+
+    def flush(self):
+        """Writes the buffered data in a block."""
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._handle.flush()
+
+    def close(self):
+        """Writes the remaining data and the end of file marker."""
+        if self._handle.closed:
+            return
+        self.flush()
+        self._handle.write(_eof_block)
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write_block(self, data):
+        """Compresses and writes a block."""
+        compressor = zlib.compressobj(self._compress_level, zlib.DEFLATED,
+                                      -15)
+        compressed = compressor.compress(data) + compressor.flush()
+
+        # The size of the block (minus one), including the header (18 bytes)
+        # and the footer (8 bytes)
+        block_size = len(compressed) + 25
+
+        self._handle.write(_block_header.pack(
+            31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size,
+        ))
+        self._handle.write(compressed)
+        self._handle.write(struct.pack(
+            "<II", zlib.crc32(data) & 0xffffffff, len(data),
+        ))
+
+
+class BgzfReader(object):
+    """Reads a BGZF (blocked GNU zip format) file by virtual offsets.
+
+    :param filename: the name of the file
+    :param block_cache: a cache for the decompressed blocks (a mapping, which
+                        might be shared between readers)
+
+    :type filename: string
+    :type block_cache: dict
+
+    """
+    def __init__(self, filename, block_cache=None):
+        """Initializes a BgzfReader instance."""
+        self.filename = filename
+        self._handle = open(filename, "rb")
+        self._block_cache = block_cache
+
+    def read_block(self, coffset):
+        """Reads (and decompresses) the block at a position of the file.
+
+        :param coffset: the position of the block in the compressed file
+
+        :type coffset: int
+
+        :returns: the data of the block and the position of the next block
+        :rtype: tuple
+
+        An empty block is returned at the end of the file.
+
+        """
+        key = (self.filename, coffset)
+        if self._block_cache is not None:
+            block = self._block_cache.get(key, None)
+            if block is not None:
+                return block
+
+        # The header of the block
+        self._handle.seek(coffset)
+        header = self._handle.read(_block_header.size)
+        if len(header) == 0:
+            return b"", coffset
+        if ((len(header) != _block_header.size)
+                or (header[:4] != _block_magic)
+                or (header[12:14] != b"BC")):
+            m = "{}: not a BGZF file".format(self.filename)
+            raise ProgramError(m)
+        block_size = struct.unpack("<H", header[16:])[0] + 1
+
+        # The compressed data (without the footer)
+        data = self._handle.read(block_size - _block_header.size)
+        data = zlib.decompress(data[:-8], -15)
+
+        block = (data, coffset + block_size)
+        if self._block_cache is not None:
+            self._block_cache[key] = block
+        return block
+
+    def iter_lines(self, voffset):
+        """Reads the lines starting at a virtual offset.
+
+        :param voffset: the virtual offset of the first line
+
+        :type voffset: int
+
+        :returns: the virtual offset and the content of each line
+        :rtype: generator
+
+        """
+        coffset, pos = voffset >> 16, voffset & 0xffff
+        data, next_coffset = self.read_block(coffset)
+
+        pending = b""
+        line_voffset = voffset
+        while data:
+            end = data.find(b"\n", pos)
+
+            # The line continues in the next block
+            if end == -1:
+                pending += data[pos:]
+                coffset, pos = next_coffset, 0
+                data, next_coffset = self.read_block(coffset)
+                continue
+
+            line = pending + data[pos:end + 1]
+            pending = b""
+            yield line_voffset, line
+
+            # The next line (which might start at the next block)
+            pos = end + 1
+            if pos == len(data):
+                coffset, pos = next_coffset, 0
+                data, next_coffset = self.read_block(coffset)
+            line_voffset = (coffset << 16) | pos
+
+        if pending:
+            yield line_voffset, pending
+
+    def close(self):
+        """Closes the file."""
+        self._handle.close()
+
+
+class LRUCache(object):
+    """A (thread safe) cache keeping the least recently used items.
+
+    :param max_size: the maximal number of items
+    :param on_evict: a function called with each evicted item
+
+    :type max_size: int
+    :type on_evict: function
+
+    """
+    def __init__(self, max_size, on_evict=None):
+        """Initializes a LRUCache instance."""
+        self._max_size = max_size
+        self._on_evict = on_evict
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Gets an item (marking it as the most recently used)."""
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def __setitem__(self, key, value):
+        """Adds an item (evicting the least recently used ones)."""
+        evicted = []
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_size:
+                evicted.append(self._items.popitem(last=False)[1])
+
+        if self._on_evict is not None:
+            for item in evicted:
+                self._on_evict(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        """Removes all the items."""
+        with self._lock:
+            evicted = list(self._items.values())
+            self._items.clear()
+
+        if self._on_evict is not None:
+            for item in evicted:
+                self._on_evict(item)
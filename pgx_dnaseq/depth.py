@@ -0,0 +1,170 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import json
+import struct
+
+import numpy as np
+
+from . import ProgramError
+from .utils import atomic_output
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["write_depth", "read_depth", "merge_depth"]
+
+
+# The magic number and the version of the format
+_magic = b"PGXDEPTH"
+_version = 1
+
+# The histograms start on a multiple of 64 bytes (so that they can be memory
+# mapped efficiently)
+_alignment = 64
+
+
+def write_depth(filename, histograms, samples, thresholds, nb_bases,
+                bed_checksum, max_depth):
+    """Writes depth histograms in a (binary) depth file.
+
+    :param filename: the name of the depth file
+    :param histograms: the histograms (thresholds x samples x depths)
+    :param samples: the name of the samples
+    :param thresholds: the mapping and base quality thresholds (pairs)
+    :param nb_bases: the number of targeted bases
+    :param bed_checksum: the checksum of the BED file of the targets
+    :param max_depth: the maximal depth (the last bin)
+
+    :type filename: string
+    :type histograms: numpy.ndarray
+    :type samples: list
+    :type thresholds: list
+    :type nb_bases: int
+    :type bed_checksum: string
+    :type max_depth: int
+
+    The file starts with a magic number, the version of the format and the
+    length of the metadata (JSON). The histograms follow (little endian 64
+    bits counts, aligned on 64 bytes). The file is replaced once written
+    (using :py:func:`atomic_output`).
+
+    """
+    histograms = np.asarray(histograms, dtype="<i8")
+    shape = (len(thresholds), len(samples), max_depth + 1)
+    if histograms.shape != shape:
+        m = "{}: invalid histograms shape {}".format(filename,
+                                                     histograms.shape)
+        raise ProgramError(m)
+
+    metadata = json.dumps({
+        "samples": list(samples),
+        "thresholds": [[int(mapq), int(baseq)] for mapq, baseq in thresholds],
+        "nb_bases": int(nb_bases),
+        "bed_checksum": bed_checksum,
+        "max_depth": int(max_depth),
+    }).encode()
+
+    # The padding (so that the histograms are aligned)
+    header_size = len(_magic) + 12 + len(metadata)
+    padding = -header_size % _alignment
+
+    with atomic_output(filename) as o_file:
+        o_file.write(_magic)
+        o_file.write(struct.pack("<IQ", _version, len(metadata) + padding))
+        o_file.write(metadata)
+        o_file.write(b" " * padding)
+        o_file.write(histograms.tobytes())
+
+
+def read_depth(filename, mmap=True):
+    """Reads a depth file.
+
+    :param filename: the name of the depth file
+    :param mmap: whether to memory map the histograms (instead of reading
+                 them)
+
+    :type filename: string
+    :type mmap: bool
+
+    :returns: the metadata and the histograms (thresholds x samples x
+              depths)
+    :rtype: tuple
+
+    """
+    with open(filename, "rb") as i_file:
+        header = i_file.read(len(_magic) + 12)
+        if (len(header) != len(_magic) + 12) or (not
+                                                 header.startswith(_magic)):
+            m = "{}: not a depth file".format(filename)
+            raise ProgramError(m)
+        version, metadata_size = struct.unpack("<IQ", header[len(_magic):])
+        if version != _version:
+            m = "{}: unsupported version {}".format(filename, version)
+            raise ProgramError(m)
+        metadata = json.loads(i_file.read(metadata_size).decode())
+
+    # The histograms
+    metadata["thresholds"] = [tuple(t) for t in metadata["thresholds"]]
+    shape = (len(metadata["thresholds"]), len(metadata["samples"]),
+             metadata["max_depth"] + 1)
+    offset = len(_magic) + 12 + metadata_size
+    if mmap:
+        histograms = np.memmap(filename, dtype="<i8", mode="r",
+                               offset=offset, shape=shape)
+    else:
+        histograms = np.fromfile(filename, dtype="<i8",
+                                 count=int(np.prod(shape)), offset=offset)
+        histograms = histograms.reshape(shape)
+
+    return metadata, histograms
+
+
+def merge_depth(filenames):
+    """Merges the samples of many depth files.
+
+    :param filenames: the names of the depth files
+
+    :type filenames: list
+
+    :returns: the metadata and the histograms (thresholds x samples x
+              depths) of all the samples
+    :rtype: tuple
+
+    The files need to have the same targets (BED checksum), the same
+    thresholds and the same maximal depth (the last bin of a histogram
+    counts the bases at the maximal depth, or higher).
+
+    """
+    metadata = None
+    all_histograms = []
+    for filename in filenames:
+        file_metadata, histograms = read_depth(filename)
+
+        if metadata is None:
+            metadata = dict(file_metadata, samples=[])
+        for key in ("bed_checksum", "thresholds", "nb_bases", "max_depth"):
+            if file_metadata[key] != metadata[key]:
+                m = "{}: {}: not the same as the other files".format(
+                    filename, key,
+                )
+                raise ProgramError(m)
+
+        metadata["samples"].extend(file_metadata["samples"])
+        all_histograms.append(histograms)
+
+    if metadata is None:
+        m = "no depth file"
+        raise ProgramError(m)
+
+    return metadata, np.concatenate(all_histograms, axis=1)
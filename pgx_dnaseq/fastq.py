@@ -0,0 +1,194 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import gzip
+import shutil
+from itertools import islice
+from subprocess import Popen, PIPE
+
+from . import ProgramError
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["split_paired_fastq", "concatenate_gzip"]
+
+
+def split_paired_fastq(filenames, out_filenames, block_size=10000,
+                       compress_level=1):
+    """Splits paired FASTQ files into read-pair synchronised chunks.
+
+    :param filenames: the (paired) FASTQ files to split
+    :param out_filenames: the name of the files for each chunk (one list per
+                          chunk, containing one file per input file)
+    :param block_size: the number of reads written at once in a chunk
+    :param compress_level: the compression level of the chunks
+
+    :type filenames: list
+    :type out_filenames: list
+    :type block_size: int
+    :type compress_level: int
+
+    :returns: the number of chunks that were written (the remaining chunks
+              are empty and are deleted)
+
+    The input files are decompressed in parallel (one process per file, using
+    ``pigz`` or ``gzip`` if available) and the blocks of reads are written in
+    turns to each chunk (which are compressed in parallel as well).
+
+    """
+    for chunk_filenames in out_filenames:
+        if len(chunk_filenames) != len(filenames):
+            m = "{}: invalid number of chunks".format(chunk_filenames)
+            raise ProgramError(m)
+
+    readers = []
+    writers = []
+    nb_blocks = 0
+    try:
+        # Opening the input files
+        for filename in filenames:
+            readers.append(_open_reader(filename))
+
+        # Opening the output files
+        for chunk_filenames in out_filenames:
+            writers.append([])
+            for filename in chunk_filenames:
+                writers[-1].append(_open_writer(filename, compress_level))
+
+        while True:
+            # Reading a block of reads from each of the input files
+            blocks = [list(islice(stream, block_size * 4))
+                      for proc, stream in readers]
+
+            # Checking the end of the files
+            nb_lines = {len(block) for block in blocks}
+            if nb_lines == {0}:
+                break
+            if (len(nb_lines) != 1) or (nb_lines.pop() % 4 != 0):
+                m = "{}: files are not synchronised".format(
+                    ", ".join(filenames),
+                )
+                raise ProgramError(m)
+
+            # Checking that the blocks start with the same read
+            if len({_get_read_name(block[0]) for block in blocks}) != 1:
+                m = "{}: files are not synchronised".format(
+                    ", ".join(filenames),
+                )
+                raise ProgramError(m)
+
+            # Writing the blocks in the current chunk
+            for (proc, stream), block in zip(writers[nb_blocks % len(writers)],
+                                             blocks):
+                stream.write(b"".join(block))
+            nb_blocks += 1
+
+    finally:
+        # All the files are closed (and all the processes are waited for)
+        # before checking their status
+        failed = [_close(proc, stream) for proc, stream in readers]
+        for chunk_writers in writers:
+            failed.extend(_close(proc, stream)
+                          for proc, stream in chunk_writers)
+
+    # The failed processes (only reached if nothing else went wrong, so
+    # that the original error is not hidden)
+    failed = [command for command in failed if command is not None]
+    if failed:
+        m = "{}: process failed".format(", ".join(failed))
+        raise ProgramError(m)
+
+    # Deleting the empty chunks
+    nb_written = min(nb_blocks, len(out_filenames))
+    for chunk_filenames in out_filenames[nb_written:]:
+        for filename in chunk_filenames:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    return nb_written
+
+
+def concatenate_gzip(filenames, output):
+    """Concatenates gzip files without decompressing them.
+
+    :param filenames: the gzip files to concatenate
+    :param output: the name of the output file
+
+    :type filenames: list
+    :type output: string
+
+    A file made of multiple gzip members is a valid gzip file, so the
+    compressed chunks are simply copied one after the other.
+
+    """
+    with open(output, "wb") as o_file:
+        for filename in filenames:
+            with open(filename, "rb") as i_file:
+                shutil.copyfileobj(i_file, o_file)
+
+
+def _get_read_name(line):
+    """Gets the name of a read (without the pair information)."""
+    name = line.split(maxsplit=1)[0]
+    if name.endswith(b"/1") or name.endswith(b"/2"):
+        name = name[:-2]
+    return name
+
+
+def _open_reader(filename):
+    """Opens a (compressed) FASTQ file, decompressing in a subprocess."""
+    if not filename.endswith(".gz"):
+        return None, open(filename, "rb")
+
+    # Trying to decompress in another process
+    decompressor = shutil.which("pigz") or shutil.which("gzip")
+    if decompressor is None:
+        return None, gzip.open(filename, "rb")
+
+    proc = Popen([decompressor, "-dc", filename], stdout=PIPE)
+    return proc, proc.stdout
+
+
+def _open_writer(filename, compress_level):
+    """Opens a (compressed) FASTQ file, compressing in a subprocess."""
+    if not filename.endswith(".gz"):
+        return None, open(filename, "wb")
+
+    # Trying to compress in another process
+    compressor = shutil.which("gzip")
+    if compressor is None:
+        return None, gzip.open(filename, "wb", compresslevel=compress_level)
+
+    with open(filename, "wb") as o_file:
+        proc = Popen([compressor, "-c", "-{}".format(compress_level)],
+                     stdin=PIPE, stdout=o_file)
+    return proc, proc.stdin
+
+
+def _close(proc, stream):
+    """Closes a stream and waits for its process (if any).
+
+    :returns: the command of the process if it failed (None otherwise)
+
+    """
+    try:
+        stream.close()
+    except BrokenPipeError:
+        # The process is already dead (its status is checked below)
+        pass
+
+    if (proc is not None) and (proc.wait() != 0):
+        return " ".join(proc.args)
+    return None
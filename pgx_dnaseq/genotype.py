@@ -0,0 +1,376 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import re
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from . import ProgramError
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["read_sites", "write_sites_bed", "pileup_sites",
+           "compute_likelihoods", "call_genotypes", "write_genotypes"]
+
+
+# The CIGAR operations
+_cigar_re = re.compile(r"(\d+)([MIDNSHP=X])")
+
+# The code of each base (A, C, G and T, the others being 4)
+_base_codes = np.full(256, 4, dtype=np.int8)
+for _i, _base in enumerate(b"ACGT"):
+    _base_codes[_base] = _i
+    _base_codes[ord(chr(_base).lower())] = _i
+
+# The maximal number of alleles of a site (and its number of genotypes)
+_max_alleles = 4
+_genotypes = [(j, k) for k in range(_max_alleles) for j in range(k + 1)]
+
+# The maximal PL and GQ values
+_max_pl = 9999
+_max_gq = 99
+
+
+def read_sites(filename):
+    """Reads the sites to genotype (a VCF file, or its first five columns).
+
+    :param filename: the name of the file
+
+    :type filename: string
+
+    :returns: the sites (contig, position, ID, REF and the list of ALT)
+    :rtype: list
+
+    Only the single nucleotide sites (with at most three alternative alleles)
+    are genotyped; the others are reported without a genotype.
+
+    """
+    sites = []
+    with open(filename, "r") as i_file:
+        for i, line in enumerate(i_file):
+            if line.startswith("#") or not line.strip():
+                continue
+            row = line.rstrip("\r\n").split("\t")
+            try:
+                sites.append((row[0], int(row[1]), row[2], row[3].upper(),
+                              row[4].upper().split(",")))
+            except (IndexError, ValueError):
+                m = "{}: line {}: invalid site".format(filename, i + 1)
+                raise ProgramError(m)
+
+    return sites
+
+
+def write_sites_bed(sites, filename):
+    """Writes the positions of the sites in a BED file.
+
+    :param sites: the sites (as returned by :py:func:`read_sites`)
+    :param filename: the name of the BED file
+
+    :type sites: list
+    :type filename: string
+
+    """
+    with open(filename, "w") as o_file:
+        for contig, pos, name, ref, alts in sites:
+            print(contig, pos - 1, pos - 1 + len(ref), sep="\t", file=o_file)
+
+
+def pileup_sites(reads, sites, min_base_quality=13):
+    """Gets the bases (and their quality) of the reads at each site.
+
+    :param reads: the reads (SAM records, as strings)
+    :param sites: the sites (as returned by :py:func:`read_sites`)
+    :param min_base_quality: the minimal base quality
+
+    :type reads: iterable
+    :type sites: list
+    :type min_base_quality: int
+
+    :returns: the site index, the base code and the base quality of each
+              observation
+    :rtype: tuple
+
+    A fragment is observed once at a site: when the two mates of a pair
+    overlap a site, only the base of the highest quality is kept (the first
+    one, if they have the same quality).
+
+    """
+    # The (sorted) positions of the sites on each contig
+    positions = {}
+    for i, (contig, pos, name, ref, alts) in enumerate(sites):
+        positions.setdefault(contig, []).append((pos, i))
+    for contig in positions:
+        positions[contig].sort()
+    starts = {
+        contig: [pos for pos, i in contig_sites]
+        for contig, contig_sites in positions.items()
+    }
+
+    site_indexes = []
+    bases = []
+    qualities = []
+    read_names = []
+    read_ids = {}
+    for read in reads:
+        fields = read.split("\t", 11)
+        contig_starts = starts.get(fields[2], None)
+        if contig_starts is None or fields[5] == "*":
+            continue
+
+        # The CIGAR operations and the reference end of the read
+        start = int(fields[3])
+        cigar = [(int(length), op) for length, op in
+                 _cigar_re.findall(fields[5])]
+        end = start - 1 + sum(length for length, op in cigar
+                              if op in "MDN=X")
+
+        # The sites covered by the read
+        first = bisect_left(contig_starts, start)
+        last = bisect_right(contig_starts, end)
+        if first == last:
+            continue
+        covered = positions[fields[2]][first:last]
+
+        # Walking along the alignment to find the bases at the sites
+        read_id = read_ids.setdefault(fields[0], len(read_ids))
+        seq, qual = fields[9], fields[10]
+        ref_pos, read_pos = start, 0
+        site = 0
+        for length, op in cigar:
+            if site == len(covered):
+                break
+
+            if op in "M=X":
+                while (site < len(covered) and
+                       covered[site][0] < ref_pos + length):
+                    offset = read_pos + covered[site][0] - ref_pos
+                    site_indexes.append(covered[site][1])
+                    bases.append(seq[offset])
+                    qualities.append(qual[offset] if qual != "*" else "I")
+                    read_names.append(read_id)
+                    site += 1
+                ref_pos += length
+                read_pos += length
+
+            elif op in "DN":
+                # The sites in a deletion are not observed
+                while (site < len(covered) and
+                       covered[site][0] < ref_pos + length):
+                    site += 1
+                ref_pos += length
+
+            elif op in "IS":
+                read_pos += length
+
+    # The observations (vectorized)
+    site_indexes = np.array(site_indexes, dtype=np.int64)
+    bases = _base_codes[np.frombuffer("".join(bases).encode(),
+                                      dtype=np.uint8)]
+    qualities = (np.frombuffer("".join(qualities).encode(), dtype=np.uint8)
+                 .astype(np.int64) - 33)
+
+    read_names = np.array(read_names, dtype=np.int64)
+
+    # Keeping the good quality bases
+    kept = np.flatnonzero((qualities >= min_base_quality) & (bases < 4))
+
+    # Keeping the best base of each read name at each site (the sort is
+    # stable, so the first mate wins the ties)
+    order = np.lexsort((-qualities[kept], read_names[kept],
+                        site_indexes[kept]))
+    kept = kept[order]
+    first = np.ones(len(kept), dtype=bool)
+    first[1:] = ((site_indexes[kept[1:]] != site_indexes[kept[:-1]]) |
+                 (read_names[kept[1:]] != read_names[kept[:-1]]))
+    kept = np.sort(kept[first])
+
+    return site_indexes[kept], bases[kept], qualities[kept]
+
+
+def compute_likelihoods(site_indexes, bases, qualities, sites):
+    """Computes the genotype likelihoods (log10) of the sites.
+
+    :param site_indexes: the site index of each observation
+    :param bases: the base code of each observation
+    :param qualities: the base quality of each observation
+    :param sites: the sites (as returned by :py:func:`read_sites`)
+
+    :type site_indexes: numpy.ndarray
+    :type bases: numpy.ndarray
+    :type qualities: numpy.ndarray
+    :type sites: list
+
+    :returns: the likelihoods (sites x genotypes, NaN for the genotypes
+              absent from a site), the depth and the allelic depths (sites x
+              alleles)
+    :rtype: tuple
+
+    The genotypes are in the VCF order (0/0, 0/1, 1/1, 0/2, ...). The
+    probability of each base given an allele is ``1 - e`` if they are the
+    same, and ``e / 3`` otherwise (``e`` being the error rate given by the
+    base quality).
+
+    """
+    nb_sites = len(sites)
+
+    # The base of each allele of the sites (-1 if there is no such allele)
+    alleles = np.full((nb_sites, _max_alleles), -1, dtype=np.int8)
+    for i, (contig, pos, name, ref, alts) in enumerate(sites):
+        if _is_genotyped(ref, alts):
+            codes = [_base_codes[ord(base)] for base in [ref] + alts]
+            alleles[i, :len(codes)] = codes
+    nb_alleles = (alleles >= 0).sum(axis=1)
+
+    # The probability of each base given each allele of its site
+    error = 10 ** (-qualities / 10)
+    obs_alleles = alleles[site_indexes]
+    same = obs_alleles == bases[:, np.newaxis]
+    probs = np.where(same, 1 - error[:, np.newaxis], error[:, np.newaxis] / 3)
+
+    # The likelihood of each genotype (summed over the observations)
+    likelihoods = np.full((nb_sites, len(_genotypes)), np.nan)
+    for g, (j, k) in enumerate(_genotypes):
+        log_probs = np.log10((probs[:, j] + probs[:, k]) / 2)
+        likelihoods[:, g] = np.bincount(site_indexes, weights=log_probs,
+                                        minlength=nb_sites)
+        likelihoods[nb_alleles <= k, g] = np.nan
+
+    # The depth and the allelic depths
+    depth = np.bincount(site_indexes, minlength=nb_sites)
+    allele_depths = np.stack([
+        np.bincount(site_indexes, weights=same[:, j], minlength=nb_sites)
+        for j in range(_max_alleles)
+    ], axis=1).astype(np.int64)
+
+    return likelihoods, depth, allele_depths
+
+
+def call_genotypes(likelihoods):
+    """Calls the genotypes from their likelihoods.
+
+    :param likelihoods: the likelihoods (sites x genotypes)
+
+    :type likelihoods: numpy.ndarray
+
+    :returns: the best genotype, the phred-scaled likelihoods (PL) and the
+              genotype quality (GQ) of each site
+    :rtype: tuple
+
+    """
+    valid = ~np.isnan(likelihoods)
+    filled = np.where(valid, likelihoods, -np.inf)
+
+    # The best genotype (the sites without a genotype give 0)
+    best = np.argmax(filled, axis=1)
+    best_likelihood = filled[np.arange(len(filled)), best]
+    best_likelihood[~np.isfinite(best_likelihood)] = 0
+
+    # The phred-scaled likelihoods (relative to the best genotype)
+    pl = np.rint(-10 * (filled - best_likelihood[:, np.newaxis]))
+    pl = np.minimum(np.where(valid, pl, _max_pl), _max_pl).astype(np.int64)
+
+    # The genotype quality (the second smallest PL)
+    gq = np.minimum(np.sort(pl, axis=1)[:, 1], _max_gq)
+
+    return best, pl, gq
+
+
+def write_genotypes(sites, sample, depth, allele_depths, best, pl, gq,
+                    o_file, source="pgx_dnaseq"):
+    """Writes the genotypes of the sites (a compact single sample VCF).
+
+    :param sites: the sites (as returned by :py:func:`read_sites`)
+    :param sample: the name of the sample
+    :param depth: the depth of each site
+    :param allele_depths: the allelic depths of each site
+    :param best: the best genotype of each site
+    :param pl: the phred-scaled likelihoods of each site
+    :param gq: the genotype quality of each site
+    :param o_file: the output file
+    :param source: the source of the file
+
+    :type sites: list
+    :type sample: string
+    :type depth: numpy.ndarray
+    :type allele_depths: numpy.ndarray
+    :type best: numpy.ndarray
+    :type pl: numpy.ndarray
+    :type gq: numpy.ndarray
+    :type o_file: file
+    :type source: string
+
+    """
+    # The header (with the contigs in the order of the sites)
+    contigs = []
+    for contig, pos, name, ref, alts in sites:
+        if contig not in contigs:
+            contigs.append(contig)
+    print("##fileformat=VCFv4.2", file=o_file)
+    print("##source={}".format(source), file=o_file)
+    for contig in contigs:
+        print("##contig=<ID={}>".format(contig), file=o_file)
+    print('##INFO=<ID=DP,Number=1,Type=Integer,Description="Read depth">',
+          file=o_file)
+    print('##FILTER=<ID=NotSNV,Description="Not a single nucleotide site '
+          '(not genotyped)">', file=o_file)
+    print('##FILTER=<ID=NoCoverage,Description="No read at the site">',
+          file=o_file)
+    for line in ('##FORMAT=<ID=GT,Number=1,Type=String,Description='
+                 '"Genotype">',
+                 '##FORMAT=<ID=AD,Number=R,Type=Integer,Description='
+                 '"Allelic depths">',
+                 '##FORMAT=<ID=DP,Number=1,Type=Integer,Description='
+                 '"Read depth">',
+                 '##FORMAT=<ID=GQ,Number=1,Type=Integer,Description='
+                 '"Genotype quality">',
+                 '##FORMAT=<ID=PL,Number=G,Type=Integer,Description='
+                 '"Phred-scaled genotype likelihoods">'):
+        print(line, file=o_file)
+    print("#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+          "FORMAT", sample, sep="\t", file=o_file)
+
+    for i, (contig, pos, name, ref, alts) in enumerate(sites):
+        nb_alleles = len(alts) + 1
+        qual, filters, genotype = ".", "PASS", "./.:.:.:.:."
+
+        if not _is_genotyped(ref, alts):
+            filters = "NotSNV"
+
+        elif depth[i] == 0:
+            filters = "NoCoverage"
+            genotype = "./.:{}:0:.:.".format(",".join(["0"] * nb_alleles))
+
+        else:
+            nb_genotypes = nb_alleles * (nb_alleles + 1) // 2
+            j, k = _genotypes[best[i]]
+            qual = pl[i, 0] if best[i] != 0 else 0
+            genotype = "{}/{}:{}:{}:{}:{}".format(
+                j, k,
+                ",".join(str(ad) for ad in allele_depths[i, :nb_alleles]),
+                depth[i], gq[i],
+                ",".join(str(value) for value in pl[i, :nb_genotypes]),
+            )
+
+        print(contig, pos, name, ref, ",".join(alts), qual, filters,
+              "DP={}".format(depth[i]), "GT:AD:DP:GQ:PL", genotype,
+              sep="\t", file=o_file)
+
+
+def _is_genotyped(ref, alts):
+    """Checks if a site can be genotyped (single nucleotides only)."""
+    alleles = [ref] + alts
+    return (len(alleles) <= _max_alleles and
+            all(len(allele) == 1 and allele in "ACGT" for allele in alleles))
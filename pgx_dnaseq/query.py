@@ -0,0 +1,438 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import re
+import gzip
+import struct
+import threading
+from glob import glob
+from tempfile import TemporaryFile
+from subprocess import Popen, PIPE
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import ProgramError
+from .bed import read_bed
+from .bgzf import BgzfReader, LRUCache
+from .tabix import reg_to_bins
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["TabixFile", "parse_region", "read_regions", "find_step_files",
+           "query_vcf", "query_bam", "query_files"]
+
+
+# The size of the windows of the linear index (16 kbp)
+_linear_shift = 14
+
+# A region (chr:start-end, or chr:pos, or chr)
+_region_re = re.compile(r"^([^:]+)(?::(\d+)(?:-(\d+))?)?$")
+
+# The END field of the INFO column (for structural variants)
+_info_end_re = re.compile(rb"(?:^|;)END=(\d+)")
+
+# The CIGAR operations consuming the reference
+_cigar_re = re.compile(r"(\d+)([MDN=X])")
+
+# The default maximal number of open files and cached blocks
+_max_open_files = 16
+_max_cached_blocks = 256
+
+
+class TabixFile(object):
+    """A bgzipped VCF file indexed by tabix (``.tbi``).
+
+    :param filename: the name of the bgzipped VCF file
+    :param block_cache: a cache for the decompressed blocks (shared between
+                        the files)
+
+    :type filename: string
+    :type block_cache: :py:class:`LRUCache`
+
+    """
+    def __init__(self, filename, block_cache=None):
+        """Initializes a TabixFile instance."""
+        index = "{}.tbi".format(filename)
+        if not os.path.isfile(index):
+            m = "{}: no index (.tbi)".format(filename)
+            raise ProgramError(m)
+
+        self.filename = filename
+        self._index = _read_tabix_index(index)
+        self._reader = BgzfReader(filename, block_cache)
+
+    def fetch(self, contig, start=None, end=None):
+        """Gets the records overlapping a region.
+
+        :param contig: the contig of the region
+        :param start: the start of the region (1-based, inclusive)
+        :param end: the end of the region (1-based, inclusive)
+
+        :type contig: string
+        :type start: int
+        :type end: int
+
+        :returns: the records (lines, without the line feed)
+        :rtype: list
+
+        """
+        if contig not in self._index:
+            return []
+        bins, linear = self._index[contig]
+
+        # The region (0-based, half-open)
+        beg = 0 if start is None else max(start - 1, 0)
+        end = (1 << 29) if end is None else end
+
+        # The smallest offset of a record overlapping the region
+        min_offset = 0
+        if linear:
+            min_offset = linear[min(beg >> _linear_shift, len(linear) - 1)]
+
+        # The chunks of the bins overlapping the region (merged)
+        chunks = sorted(
+            chunk for bin_number in reg_to_bins(beg, end)
+            for chunk in bins.get(bin_number, ()) if chunk[1] > min_offset
+        )
+        merged = []
+        for chunk_beg, chunk_end in chunks:
+            chunk_beg = max(chunk_beg, min_offset)
+            if merged and chunk_beg <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], chunk_end)
+                continue
+            merged.append([chunk_beg, chunk_end])
+
+        # Reading the records of each chunk
+        records = []
+        b_contig = contig.encode()
+        for chunk_beg, chunk_end in merged:
+            for voffset, line in self._reader.iter_lines(chunk_beg):
+                if voffset >= chunk_end:
+                    break
+                fields = line.split(b"\t", 8)
+                if fields[0] != b_contig:
+                    continue
+
+                # The region of the record
+                record_beg = int(fields[1]) - 1
+                if record_beg >= end:
+                    break
+                record_end = record_beg + len(fields[3])
+                if len(fields) > 7:
+                    info_end = _info_end_re.search(fields[7])
+                    if info_end is not None:
+                        record_end = max(record_end, int(info_end.group(1)))
+
+                if max(record_end, record_beg + 1) > beg:
+                    records.append(line.rstrip(b"\r\n").decode())
+
+        return records
+
+    def close(self):
+        """Closes the file."""
+        self._reader.close()
+
+
+def parse_region(region):
+    """Parses a region (``chr:start-end``, ``chr:pos`` or ``chr``).
+
+    :param region: the region
+
+    :type region: string
+
+    :returns: the contig, the start and the end of the region (1-based,
+              inclusive, None if not specified)
+    :rtype: tuple
+
+    """
+    match = _region_re.match(region.strip().replace(",", ""))
+    if match is None:
+        m = "{}: invalid region".format(region)
+        raise ProgramError(m)
+
+    contig, start, end = match.groups()
+    if start is not None:
+        start = int(start)
+        end = start if end is None else int(end)
+        if end < start:
+            m = "{}: invalid region".format(region)
+            raise ProgramError(m)
+
+    return contig, start, end
+
+
+def read_regions(filename):
+    """Reads regions from a BED file, or from a file of regions.
+
+    :param filename: the name of the file (a BED file if its extension is
+                     ``.bed``, otherwise one ``chr:start-end`` per line)
+
+    :type filename: string
+
+    :returns: the regions (contig, start, end), 1-based and inclusive
+    :rtype: list
+
+    """
+    if filename.endswith(".bed"):
+        return [(contig, start + 1, end)
+                for contig, start, end in read_bed(filename)]
+
+    with open(filename, "r") as i_file:
+        return [parse_region(line) for line in i_file
+                if line.strip() and not line.startswith("#")]
+
+
+def find_step_files(out_dir="output", step=None, extension=None):
+    """Finds the files of a pipeline step.
+
+    :param out_dir: the output directory of the pipeline
+    :param step: the step (its number or its directory name), the last step
+                 with matching files if None
+    :param extension: the extension of the files (``.vcf.gz`` if None, or
+                      ``.bam``)
+
+    :type out_dir: string
+    :type step: string
+    :type extension: string
+
+    :returns: the files of the step
+    :rtype: list
+
+    """
+    if extension is None:
+        extension = ".vcf.gz"
+
+    # The step directories (in the pipeline order)
+    steps = sorted(
+        name for name in os.listdir(out_dir)
+        if re.match(r"^\d+_", name) and
+        os.path.isdir(os.path.join(out_dir, name))
+    )
+    if step is not None:
+        steps = [
+            name for name in steps
+            if (name == step) or (name.split("_", 1)[0].lstrip("0") ==
+                                  str(step).lstrip("0"))
+        ]
+        if not steps:
+            m = "{}: no such step in {}".format(step, out_dir)
+            raise ProgramError(m)
+
+    # The last step with matching files
+    for name in reversed(steps):
+        filenames = sorted(glob(os.path.join(out_dir, name,
+                                             "*{}".format(extension))))
+        if filenames:
+            return filenames
+
+    m = "{}: no '{}' file".format(step if step is not None else out_dir,
+                                  extension)
+    raise ProgramError(m)
+
+
+def query_vcf(filename, regions, handle_cache=None, block_cache=None):
+    """Gets the records of a bgzipped VCF file overlapping regions.
+
+    :param filename: the name of the bgzipped (and indexed) VCF file
+    :param regions: the regions (contig, start, end), 1-based and inclusive
+    :param handle_cache: a cache of open files
+    :param block_cache: a cache of decompressed blocks
+
+    :type filename: string
+    :type regions: list
+    :type handle_cache: :py:class:`LRUCache`
+    :type block_cache: :py:class:`LRUCache`
+
+    :returns: the records of each region (in the order of the regions)
+    :rtype: list
+
+    """
+    vcf = None
+    if handle_cache is not None:
+        vcf = handle_cache.get(filename, None)
+    if vcf is None:
+        vcf = TabixFile(filename, block_cache)
+        if handle_cache is not None:
+            handle_cache[filename] = vcf
+
+    try:
+        return [vcf.fetch(*region) for region in regions]
+    finally:
+        if handle_cache is None:
+            vcf.close()
+
+
+def query_bam(filename, regions, samtools="samtools"):
+    """Gets the reads of an indexed BAM file overlapping regions.
+
+    :param filename: the name of the BAM file (with its index)
+    :param regions: the regions (contig, start, end), 1-based and inclusive
+    :param samtools: the samtools executable
+
+    :type filename: string
+    :type regions: list
+    :type samtools: string
+
+    :returns: the reads (SAM records) of each region (in the order of the
+              regions)
+    :rtype: list
+
+    The reads of all the regions are read in a single ``samtools view``
+    (using the multi-region iterator, so that each read is read once), then
+    assigned to the regions they overlap.
+
+    """
+    results = [[] for region in regions]
+    if not regions:
+        return results
+
+    # The regions on each contig
+    by_contig = {}
+    for i, (contig, start, end) in enumerate(regions):
+        by_contig.setdefault(contig, []).append((
+            1 if start is None else start,
+            (1 << 29) if end is None else end,
+            i,
+        ))
+
+    command = [samtools, "view", "-M", filename]
+    for contig, start, end in regions:
+        if start is None:
+            command.append(contig)
+        else:
+            command.append("{}:{}-{}".format(contig, start, end))
+
+    # The STDERR goes in a temporary file (a full STDERR pipe would block
+    # samtools while the STDOUT is read)
+    with TemporaryFile(mode="w+") as stderr_file:
+        try:
+            proc = Popen(command, stdout=PIPE, stderr=stderr_file,
+                         universal_newlines=True)
+        except FileNotFoundError:
+            m = "{}: cannot launch".format(samtools)
+            raise ProgramError(m)
+
+        for line in proc.stdout:
+            fields = line.split("\t", 6)
+            read_start = int(fields[3])
+            read_end = read_start + _reference_length(fields[5]) - 1
+            for start, end, i in by_contig.get(fields[2], ()):
+                if read_start <= end and read_end >= start:
+                    results[i].append(line.rstrip("\n"))
+
+        if proc.wait() != 0:
+            stderr_file.seek(0)
+            m = "{}: {}".format(filename, stderr_file.read().strip())
+            raise ProgramError(m)
+
+    return results
+
+
+def query_files(filenames, regions, nb_threads=1, samtools="samtools",
+                max_open_files=_max_open_files,
+                max_cached_blocks=_max_cached_blocks):
+    """Gets the records overlapping regions for many files (concurrently).
+
+    :param filenames: the bgzipped VCF files (``.vcf.gz``) or BAM files
+    :param regions: the regions (contig, start, end), 1-based and inclusive
+    :param nb_threads: the number of files queried at the same time
+    :param samtools: the samtools executable (for the BAM files)
+    :param max_open_files: the maximal number of open VCF files (per thread)
+    :param max_cached_blocks: the maximal number of cached blocks
+
+    :type filenames: list
+    :type regions: list
+    :type nb_threads: int
+    :type samtools: string
+    :type max_open_files: int
+    :type max_cached_blocks: int
+
+    :returns: the records of each region for each file
+    :rtype: OrderedDict
+
+    """
+    # The cache of decompressed blocks is shared, but each thread keeps its
+    # own open files (since a file handle can't be shared)
+    block_cache = LRUCache(max_cached_blocks)
+    handle_caches = []
+    local = threading.local()
+
+    def _query(filename):
+        if filename.endswith(".bam"):
+            return query_bam(filename, regions, samtools)
+
+        if not hasattr(local, "handle_cache"):
+            local.handle_cache = LRUCache(max_open_files,
+                                          on_evict=TabixFile.close)
+            handle_caches.append(local.handle_cache)
+        return query_vcf(filename, regions, local.handle_cache, block_cache)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(nb_threads, 1)) as executor:
+            results = executor.map(_query, filenames)
+            return OrderedDict(zip(filenames, results))
+
+    finally:
+        for handle_cache in handle_caches:
+            handle_cache.clear()
+
+
+def _reference_length(cigar):
+    """Computes the number of reference bases covered by a CIGAR string."""
+    if cigar == "*":
+        return 1
+    return sum(int(length) for length, op in _cigar_re.findall(cigar)) or 1
+
+
+def _read_tabix_index(filename):
+    """Reads a tabix index (the bins and the linear index of each contig)."""
+    with gzip.open(filename, "rb") as i_file:
+        data = i_file.read()
+
+    if data[:4] != b"TBI\1":
+        m = "{}: not a tabix index".format(filename)
+        raise ProgramError(m)
+
+    # The header
+    header = struct.unpack_from("<8i", data, 4)
+    nb_ref, l_nm = header[0], header[7]
+    offset = 36
+    names = data[offset:offset + l_nm].split(b"\0")[:nb_ref]
+    offset += l_nm
+
+    index = {}
+    for name in names:
+        # The binning index
+        bins = {}
+        nb_bins = struct.unpack_from("<i", data, offset)[0]
+        offset += 4
+        for i in range(nb_bins):
+            bin_number, nb_chunks = struct.unpack_from("<Ii", data, offset)
+            offset += 8
+            chunks = struct.unpack_from("<{}Q".format(nb_chunks * 2), data,
+                                        offset)
+            offset += 16 * nb_chunks
+            bins[bin_number] = list(zip(chunks[::2], chunks[1::2]))
+
+        # The linear index
+        nb_intervals = struct.unpack_from("<i", data, offset)[0]
+        offset += 4
+        linear = struct.unpack_from("<{}Q".format(nb_intervals), data,
+                                    offset)
+        offset += 8 * nb_intervals
+
+        index[name.decode()] = (bins, linear)
+
+    return index
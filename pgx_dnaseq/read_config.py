@@ -28,6 +28,10 @@ for module_name in tools.__all__:
                                                          tool_name))
 
 
+# The section containing the options of the whole pipeline
+_pipeline_section = "pipeline"
+
+
 def read_config_file(filename):
     """Reads a configuration file."""
     # Creating the configuration file parser (we want to read as string, so
@@ -53,8 +57,9 @@ def get_pipeline_steps(filename):
     # Will contain tuples (which tools to run with its their options)
     steps = []
 
-    # Reading the configuration file
+    # Reading the configuration file (the pipeline options aren't a step)
     pipeline = read_config_file(filename)
+    pipeline.pop(_pipeline_section, None)
 
     # The keys should be steps number
     step_number = None
@@ -90,3 +95,8 @@ def get_pipeline_steps(filename):
 
     # Returning the steps
     return steps
+
+
+def get_pipeline_options(filename):
+    """Gets the options of the whole pipeline (the 'pipeline' section)."""
+    return read_config_file(filename).get(_pipeline_section, {})
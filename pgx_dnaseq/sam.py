@@ -0,0 +1,202 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import struct
+import shutil
+from collections import Counter
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["concatenate_sam", "count_flags", "format_flagstat",
+           "get_read_group"]
+
+
+def concatenate_sam(filenames, output):
+    """Concatenates SAM files, keeping only the header of the first one.
+
+    :param filenames: the SAM files to concatenate
+    :param output: the name of the output SAM file
+
+    :type filenames: list
+    :type output: string
+
+    """
+    with open(output, "wb") as o_file:
+        for i, filename in enumerate(filenames):
+            with open(filename, "rb") as i_file:
+                # Skipping the header (except for the first file)
+                for line in i_file:
+                    if (not line.startswith(b"@")) or (i == 0):
+                        o_file.write(line)
+                    if not line.startswith(b"@"):
+                        break
+
+                # Copying the alignments
+                shutil.copyfileobj(i_file, o_file)
+
+
+def get_read_group(options):
+    """Gets the read group fields of a sample (as AddRG sets them).
+
+    :param options: the tool options (containing ``read_group_id``,
+                    ``sample_id`` and the AddRG options)
+
+    :type options: dict
+
+    :returns: the list of (tag, value) of the read group (starting with ID)
+    :rtype: list
+
+    """
+    # The platform unit is lane specific
+    rgpu = options["rgpu"]
+    if "lane" in options:
+        rgpu = "{}.{}".format(rgpu, options["lane"])
+
+    return [("ID", options["read_group_id"]), ("SM", options["sample_id"]),
+            ("PL", options["rgpl"]), ("PU", rgpu), ("LB", options["rglb"]),
+            ("DS", options["rgds"]), ("CN", options["rgcn"])]
+
+
+def count_flags(lines, counts=None):
+    """Counts the alignments of a SAM stream (for the flag statistics).
+
+    :param lines: the lines of the SAM file (as bytes)
+    :param counts: the counts to update (a new one is created if None)
+
+    :type lines: iterable
+    :type counts: collections.Counter
+
+    :returns: the counts for each distinct (flag, mate on a different
+              reference, mapping quality) combinations.
+    :rtype: collections.Counter
+
+    Only the number of distinct combinations are kept (which is small), so
+    that the statistics can be computed once the stream is over.
+
+    """
+    if counts is None:
+        counts = Counter()
+
+    # The header lines are skipped
+    counts.update(_get_flag_key(line.split(b"\t", 7))
+                  for line in lines
+                  if not (line.startswith(b"@") or line.isspace()))
+
+    return counts
+
+
+def format_flagstat(counts):
+    """Formats the flag statistics as ``samtools flagstat`` does.
+
+    :param counts: the counts (from :py:func:`count_flags`)
+
+    :type counts: collections.Counter
+
+    :returns: the report (identical to the one of ``samtools flagstat``)
+    :rtype: str
+
+    """
+    # The statistics (QC-passed and QC-failed reads)
+    names = ("reads", "secondary", "supp", "dup", "mapped", "pair_all",
+             "read1", "read2", "pair_good", "pair_map", "sgltn", "diffchr",
+             "diffhigh")
+    stats = {name: [0, 0] for name in names}
+
+    for (flag, diff_chr, mapq), nb in counts.items():
+        flag = int(flag)
+        w = 1 if flag & 0x200 else 0
+        stats["reads"][w] += nb
+
+        if flag & 0x100:
+            stats["secondary"][w] += nb
+        elif flag & 0x800:
+            stats["supp"][w] += nb
+        elif flag & 0x1:
+            stats["pair_all"][w] += nb
+            if (flag & 0x2) and not (flag & 0x4):
+                stats["pair_good"][w] += nb
+            if flag & 0x40:
+                stats["read1"][w] += nb
+            if flag & 0x80:
+                stats["read2"][w] += nb
+            if (flag & 0x8) and not (flag & 0x4):
+                stats["sgltn"][w] += nb
+            if not (flag & 0x4) and not (flag & 0x8):
+                stats["pair_map"][w] += nb
+                if diff_chr:
+                    stats["diffchr"][w] += nb
+                    if int(mapq) >= 5:
+                        stats["diffhigh"][w] += nb
+
+        if not (flag & 0x4):
+            stats["mapped"][w] += nb
+        if flag & 0x400:
+            stats["dup"][w] += nb
+
+    # The report
+    lines = [
+        "{} + {} in total (QC-passed reads + QC-failed reads)".format(
+            *stats["reads"]
+        ),
+        "{} + {} secondary".format(*stats["secondary"]),
+        "{} + {} supplementary".format(*stats["supp"]),
+        "{} + {} duplicates".format(*stats["dup"]),
+        "{} + {} mapped ({} : {})".format(
+            *(stats["mapped"] + _percents(stats["mapped"], stats["reads"]))
+        ),
+        "{} + {} paired in sequencing".format(*stats["pair_all"]),
+        "{} + {} read1".format(*stats["read1"]),
+        "{} + {} read2".format(*stats["read2"]),
+        "{} + {} properly paired ({} : {})".format(
+            *(stats["pair_good"] + _percents(stats["pair_good"],
+                                             stats["pair_all"]))
+        ),
+        "{} + {} with itself and mate mapped".format(*stats["pair_map"]),
+        "{} + {} singletons ({} : {})".format(
+            *(stats["sgltn"] + _percents(stats["sgltn"], stats["pair_all"]))
+        ),
+        "{} + {} with mate mapped to a different chr".format(
+            *stats["diffchr"]
+        ),
+        "{} + {} with mate mapped to a different chr (mapQ>=5)".format(
+            *stats["diffhigh"]
+        ),
+    ]
+
+    return "\n".join(lines) + "\n"
+
+
+def _get_flag_key(fields):
+    """Gets the flag, if the mate is on another reference and the MAPQ."""
+    # The mate is on the same reference if RNEXT is '=' or the same as RNAME
+    # (including when both are unmapped, i.e. '*')
+    return fields[1], fields[6] not in {b"=", fields[2]}, fields[4]
+
+
+def _percents(numerators, denominators):
+    """Computes percentages as samtools does (single precision)."""
+    return [_percent(n, d) for n, d in zip(numerators, denominators)]
+
+
+def _percent(n, d):
+    """Computes a percentage as samtools does (single precision)."""
+    if d == 0:
+        return "N/A"
+    ratio = _to_float(_to_float(n) / _to_float(d))
+    return "{:.2f}%".format(ratio * 100.0)
+
+
+def _to_float(value):
+    """Rounds a value to single precision."""
+    return struct.unpack("f", struct.pack("f", value))[0]
@@ -0,0 +1,228 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import re
+import struct
+from collections import OrderedDict
+
+from . import ProgramError
+from .bgzf import BgzfWriter
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["reg_to_bin", "reg_to_bins", "bgzip_vcf"]
+
+
+# The size of the windows of the linear index (16 kbp)
+_linear_shift = 14
+
+# The END field of the INFO column (for structural variants)
+_info_end_re = re.compile(rb"(?:^|;)END=(\d+)")
+
+
+def reg_to_bin(beg, end):
+    """Computes the smallest bin containing a region (UCSC binning scheme).
+
+    :param beg: the start of the region (0-based, inclusive)
+    :param end: the end of the region (0-based, exclusive)
+
+    :type beg: int
+    :type end: int
+
+    :returns: the bin
+    :rtype: int
+
+    """
+    end -= 1
+    if beg >> 14 == end >> 14:
+        return ((1 << 15) - 1) // 7 + (beg >> 14)
+    if beg >> 17 == end >> 17:
+        return ((1 << 12) - 1) // 7 + (beg >> 17)
+    if beg >> 20 == end >> 20:
+        return ((1 << 9) - 1) // 7 + (beg >> 20)
+    if beg >> 23 == end >> 23:
+        return ((1 << 6) - 1) // 7 + (beg >> 23)
+    if beg >> 26 == end >> 26:
+        return ((1 << 3) - 1) // 7 + (beg >> 26)
+    return 0
+
+
+def reg_to_bins(beg, end):
+    """Lists the bins that might overlap a region.
+
+    :param beg: the start of the region (0-based, inclusive)
+    :param end: the end of the region (0-based, exclusive)
+
+    :type beg: int
+    :type end: int
+
+    :returns: the bins
+    :rtype: list
+
+    """
+    end -= 1
+    bins = [0]
+    for offset, shift in ((1, 26), (9, 23), (73, 20), (585, 17),
+                          (4681, 14)):
+        bins.extend(range(offset + (beg >> shift),
+                          offset + (end >> shift) + 1))
+    return bins
+
+
+def bgzip_vcf(filename, output=None, compress_level=6):
+    """Compresses a (sorted) VCF file (BGZF) and indexes it (tabix).
+
+    :param filename: the name of the VCF file
+    :param output: the name of the compressed file (``filename.gz`` if None)
+    :param compress_level: the compression level
+
+    :type filename: string
+    :type output: string
+    :type compress_level: int
+
+    :returns: the name of the compressed file (its index has the ``.tbi``
+              extension)
+    :rtype: string
+
+    The file is written in temporary files first, so that an incomplete
+    compressed file (or index) is never left behind.
+
+    """
+    if output is None:
+        output = "{}.gz".format(filename)
+    index = "{}.tbi".format(output)
+
+    # The index of each contig (in the file order)
+    contigs = OrderedDict()
+
+    tmp_output = "{}.tmp".format(output)
+    with open(filename, "rb") as i_file, \
+            BgzfWriter(tmp_output, compress_level) as o_file:
+        current = None
+        last_pos = -1
+        for line in i_file:
+            # The header
+            if line.startswith(b"#"):
+                o_file.write(line)
+                continue
+            if not line.strip():
+                continue
+
+            # The region of the record (0-based)
+            fields = line.split(b"\t", 8)
+            try:
+                contig, beg = fields[0].decode(), int(fields[1]) - 1
+                end = beg + len(fields[3])
+            except (IndexError, ValueError):
+                m = "{}: invalid VCF record".format(filename)
+                raise ProgramError(m)
+            if len(fields) > 7:
+                info_end = _info_end_re.search(fields[7])
+                if info_end is not None:
+                    end = max(end, int(info_end.group(1)))
+
+            # The records need to be sorted
+            if contig != current:
+                if contig in contigs:
+                    m = "{}: {}: contig is not contiguous".format(filename,
+                                                                  contig)
+                    raise ProgramError(m)
+                contigs[contig] = _ContigIndex()
+                current = contig
+                last_pos = -1
+            if beg < last_pos:
+                m = "{}: {}:{}: file is not sorted".format(filename, contig,
+                                                           beg + 1)
+                raise ProgramError(m)
+            last_pos = beg
+
+            # Writing the record
+            voffset_beg = o_file.tell()
+            o_file.write(line)
+            contigs[contig].add(beg, end, voffset_beg, o_file.tell())
+
+    # Writing the index
+    tmp_index = "{}.tmp".format(index)
+    _write_index(contigs, tmp_index)
+
+    os.replace(tmp_output, output)
+    os.replace(tmp_index, index)
+
+    return output
+
+
+class _ContigIndex(object):
+    """The binning and linear indexes of a contig."""
+    def __init__(self):
+        """Initializes a _ContigIndex instance."""
+        self.bins = OrderedDict()
+        self.linear = []
+
+    def add(self, beg, end, voffset_beg, voffset_end):
+        """Adds a record (merging its chunk with the previous one)."""
+        # The binning index
+        chunks = self.bins.setdefault(reg_to_bin(beg, max(end, beg + 1)), [])
+        if chunks and chunks[-1][1] == voffset_beg:
+            chunks[-1][1] = voffset_end
+        else:
+            chunks.append([voffset_beg, voffset_end])
+
+        # The linear index (the first record overlapping each window)
+        first_window = beg >> _linear_shift
+        last_window = (max(end, beg + 1) - 1) >> _linear_shift
+        if len(self.linear) <= last_window:
+            self.linear.extend([None] * (last_window + 1 - len(self.linear)))
+        for window in range(first_window, last_window + 1):
+            if self.linear[window] is None:
+                self.linear[window] = voffset_beg
+
+    def get_linear_index(self):
+        """Returns the linear index (filling the empty windows)."""
+        linear = []
+        previous = 0
+        for voffset in self.linear:
+            if voffset is None:
+                voffset = previous
+            linear.append(voffset)
+            previous = voffset
+        return linear
+
+
+def _write_index(contigs, filename):
+    """Writes a tabix index (for a VCF file)."""
+    # The names of the contigs (NULL terminated)
+    names = b"".join(name.encode() + b"\0" for name in contigs.keys())
+
+    with BgzfWriter(filename) as o_file:
+        # The magic number, the number of contigs, the format (VCF), the
+        # columns (sequence, begin and end), the meta character and the
+        # number of lines to skip
+        o_file.write(b"TBI\1")
+        o_file.write(struct.pack("<8i", len(contigs), 2, 1, 2, 0, ord("#"),
+                                 0, len(names)))
+        o_file.write(names)
+
+        for contig_index in contigs.values():
+            # The binning index
+            o_file.write(struct.pack("<i", len(contig_index.bins)))
+            for bin_number, chunks in contig_index.bins.items():
+                o_file.write(struct.pack("<Ii", bin_number, len(chunks)))
+                for chunk in chunks:
+                    o_file.write(struct.pack("<QQ", *chunk))
+
+            # The linear index
+            linear = contig_index.get_linear_index()
+            o_file.write(struct.pack("<i", len(linear)))
+            o_file.write(struct.pack("<{}Q".format(len(linear)), *linear))
@@ -14,18 +14,28 @@ __license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
 
 
 import os
+import re
 import shlex
+import shutil
 from glob import glob
 from math import ceil
-from tempfile import NamedTemporaryFile
-from subprocess import check_call, SubprocessError
+from tempfile import NamedTemporaryFile, gettempdir
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, check_call, SubprocessError
 
 from .. import ProgramError
+from ..utils import atomic_output
+from ..fastq import split_paired_fastq
 
 
 __all__ = ["bwa", "fastq_mcf", "fastqc", "gatk", "picard_tools", "samtools",
            "bowtie2", "bcftools", "pgx_coverage_graph",
-           "pgx_read_quality_graph", "vcftools"]
+           "pgx_read_quality_graph", "vcftools", "pgx_flagstat",
+           "pgx_site_genotyper"]
+
+
+# The (optionally compressed) FASTQ files
+_fastq_re = re.compile(r"\.f(ast)?q(\.gz)?$")
 
 
 class GenericTool(object):
@@ -38,15 +48,53 @@ class GenericTool(object):
     REQUIREMENT = 5
     INPUT_TO_SPLIT = 6
 
+    # The placeholder of the temporary directory of the node running the job
+    # (the local one, or $TMPDIR on the DRMAA nodes)
+    TMP_DIR = "$PGXTMPDIR"
+
+    # The separator of the commands of a pipe (in the piped command)
+    PIPE = "|"
+
     # By default, a tool produces usable data
     _produce_data = True
 
     # By default, no multiple inputs
     _merge_all_inputs = False
 
+    # By default, lanes are not merged
+    _merge_lanes = False
+
+    # By default, the read group cannot be added by the tool
+    _read_group_injection = False
+
+    # By default, the tool does not reuse the outputs of other steps
+    # (otherwise, the names of the tools whose steps need to run first)
+    _reused_tools = ()
+
+    # By default, the VCF files are removed once compressed (if they are not
+    # read by the following steps)
+    _keep_vcf = False
+
+    # By default, the tool is single threaded (otherwise, the option setting
+    # its number of threads, e.g. "-t {threads}")
+    _thread_option = None
+
+    # The number of reserved processors not used as threads by the tool (e.g.
+    # samtools counts the threads in addition to the main one)
+    _thread_offset = 0
+
+    # By default, the STDOUT of the tool is not piped into another command
+    # (otherwise, the executable and the options of the command reading it,
+    # or a tuple of options for a chain of commands of the same executable)
+    _pipe_exec = None
+    _pipe_command = None
+
     # The local tool configuration
     _tool_configuration = {}
 
+    # The options of the whole pipeline
+    _pipeline_options = {}
+
     # By default, we run locally
     _locally = True
 
@@ -66,6 +114,22 @@ class GenericTool(object):
         """Returns True if the tool has multiple inputs. False otherwise."""
         return self._merge_all_inputs
 
+    def need_to_merge_lanes(self):
+        """Returns True if the tool merges the lanes of a sample."""
+        return self._merge_lanes
+
+    def can_inject_read_group(self):
+        """Returns True if the tool can add the read group to its output."""
+        return self._read_group_injection
+
+    def get_reused_tools(self):
+        """Returns the names of the tools whose outputs are reused."""
+        return self._reused_tools
+
+    def need_to_keep_vcf(self):
+        """Returns True if the VCF files are kept once compressed."""
+        return self._keep_vcf
+
     @staticmethod
     def set_tool_configuration(drmaa_options):
         """Sets the configuration for all the tools."""
@@ -76,6 +140,16 @@ class GenericTool(object):
         """Get the configuration for all the tools."""
         return GenericTool._tool_configuration
 
+    @staticmethod
+    def set_pipeline_options(pipeline_options):
+        """Sets the options of the whole pipeline (for all the tools)."""
+        GenericTool._pipeline_options = pipeline_options
+
+    @staticmethod
+    def get_pipeline_options():
+        """Get the options of the whole pipeline."""
+        return GenericTool._pipeline_options
+
     @staticmethod
     def do_not_run_locally():
         """Do not run the tools locally (sets _locally to False)."""
@@ -195,35 +269,23 @@ class GenericTool(object):
         # The name of the job
         tool_name = self.get_tool_name()
 
-        # Are we in need of a bulk submission?
-        bulk, nb_chunks, file_to_split = GenericTool._is_bulk_job(
-            GenericTool.get_tool_configuration(),
-            tool_name,
-        )
-
-        # Do we need to split a file for bulk jobs?
-        nb_split=None
-        original_output_name = None
-        if bulk:
-            # Is there an output file?
-            if "output" not in tool_options:
-                m = "{}: cannot run in bulk job".format(tool_name)
-                raise ProgramError(m)
-
-            split_name, nb_split = GenericTool._split_file(
-                file_to_split=tool_options[file_to_split],
-                nb_chunks=nb_chunks,
-                out_dir=out_dir,
-                out_dir_suffix=tool_options["sample_id"],
+        # Do we need to split a file for bulk jobs? (the files might have
+        # already been split by a parent tool, which will merge the results)
+        final_outputs, split_inputs, chunk_files = {}, {}, []
+        if "nb_split" not in tool_options:
+            final_outputs, split_inputs, chunk_files = self.split_for_bulk(
+                tool_options, out_dir,
             )
+        nb_split = tool_options.get("nb_split", None)
+        bulk = nb_split is not None
 
-            # Changing the name of the split file
-            tool_options[file_to_split] = split_name
-
-            # There is now one output per split job
-            original_output_name = tool_options["output"]
-            name, ext = os.path.splitext(original_output_name)
-            tool_options["output"] = name + "_$PGXCHUNKID" + ext
+        # The number of threads (the chunks of a bulk job run in parallel on
+        # the reserved processors when executed locally, so they each get a
+        # single one)
+        nb_proc = None
+        if bulk and GenericTool.run_locally():
+            nb_proc = 1
+        self.set_thread_options(tool_options, nb_proc)
 
         # Checks the options
         checked_options = self.check_options(tool_options)
@@ -233,17 +295,55 @@ class GenericTool(object):
         job_command = [os.path.join(bin_dir, self.get_executable())]
         job_command += self.get_command().format(**checked_options).split()
 
+        # The command reading the STDOUT of the tool (if any)
+        pipe_command = None
+        if self._pipe_command is not None:
+            pipe_options = self._pipe_command
+            if not isinstance(pipe_options, tuple):
+                pipe_options = (pipe_options, )
+
+            pipe_command = []
+            for curr_options in pipe_options:
+                if pipe_command:
+                    pipe_command.append(GenericTool.PIPE)
+                pipe_command.append(os.path.join(bin_dir, self._pipe_exec))
+                pipe_command += curr_options.format(**checked_options).split()
+
         # The STDOUT and STDERR files
         job_stdout = self.get_stdout().format(**checked_options)
         job_stderr = self.get_stderr().format(**checked_options)
 
+        # The commands compressing and indexing the VCF files (the chunks of
+        # a bulk job are compressed once merged)
+        post_commands = None
+        if not bulk:
+            post_commands = self.get_vcf_post_commands(tool_options)
+
         # Execute it
         if GenericTool.run_locally():
-            GenericTool._execute_command_locally(
-                command=job_command,
-                stdout=job_stdout,
-                stderr=job_stderr,
-            )
+            # The temporary directory is the local one
+            job_command = GenericTool._set_local_tmp_dir(job_command)
+            if pipe_command is not None:
+                pipe_command = GenericTool._set_local_tmp_dir(pipe_command)
+
+            if bulk:
+                GenericTool._execute_bulk_command_locally(
+                    command=job_command,
+                    stdout=job_stdout,
+                    stderr=job_stderr,
+                    nb_chunks=nb_split,
+                    nb_process=GenericTool.get_tool_nb_proc(tool_name),
+                    pipe_command=pipe_command,
+                )
+
+            else:
+                GenericTool._execute_command_locally(
+                    command=job_command,
+                    stdout=job_stdout,
+                    stderr=job_stderr,
+                    pipe_command=pipe_command,
+                    post_commands=post_commands,
+                )
         else:
             # Getting the tool walltime and nodes variable (for DRMAA)
             walltime, nodes = GenericTool._create_drmaa_var(
@@ -262,21 +362,9 @@ class GenericTool(object):
                     walltime=walltime,
                     nodes=nodes,
                     nb_chunks=nb_split,
+                    pipe_command=pipe_command,
                 )
 
-                # Merging the bulk jobs
-                try:
-                    self.merge_bulk_results(
-                        final_output=original_output_name,
-                        chunk_output=tool_options["output"],
-                        nb_files=nb_split,
-                        out_dir=out_dir,
-                    )
-
-                except AttributeError:
-                    m = "{}: unable to join bulk results".format(tool_name)
-                    raise ProgramError(m)
-
             else:
                 GenericTool._execute_command_drmaa(
                     command=job_command,
@@ -287,11 +375,327 @@ class GenericTool(object):
                     walltime=walltime,
                     nodes=nodes,
                     preamble=GenericTool.get_script_preamble(),
+                    pipe_command=pipe_command,
+                    post_commands=post_commands,
                 )
 
+        # Merging the bulk jobs (if the files were split here)
+        if final_outputs:
+            self.merge_bulk_job(tool_options, final_outputs, split_inputs,
+                                chunk_files, out_dir)
+
+    def keep_only_compressed_vcf(self, tool_options):
+        """Checks if the VCF output files are removed once compressed.
+
+        :param tool_options: the tool options
+
+        :type tool_options: dict
+
+        :returns: True if the VCF files are compressed (the ``bgzip_vcf``
+                  option of the step, or of the pipeline, is ``yes``) and not
+                  kept (the ``keep_vcf`` option is not ``yes``)
+        :rtype: bool
+
+        """
+        if not GenericTool._need_to_bgzip_vcf(tool_options):
+            return False
+        return not (self.need_to_keep_vcf()
+                    or (tool_options.get("keep_vcf", "no") == "yes"))
+
+    def get_vcf_post_commands(self, tool_options):
+        """Gets the commands compressing and indexing the VCF output files.
+
+        :param tool_options: the tool options
+
+        :type tool_options: dict
+
+        :returns: the ``bgzip`` and ``tabix`` commands (executed in the job
+                  once the tool is over), or an empty list if the VCF files
+                  are not compressed
+        :rtype: list
+
+        This is only done if the ``bgzip_vcf`` option (of the step, or of the
+        pipeline) is ``yes``. The compressed files are written next to the VCF
+        files (``.vcf.gz``, with a ``.vcf.gz.tbi`` index), and the VCF files
+        are removed, unless the ``keep_vcf`` option is ``yes`` (it is set by
+        the pipeline for the steps whose outputs are read by the following
+        ones).
+
+        """
+        if not GenericTool._need_to_bgzip_vcf(tool_options):
+            return []
+
+        # Are the VCF files kept?
+        bgzip_options = ["-f"]
+        if not self.keep_only_compressed_vcf(tool_options):
+            bgzip_options.append("-k")
+
+        bin_dir = GenericTool.get_tool_bin_dir("Tabix")
+        post_commands = []
+        for name, option_type in self.get_required_options().items():
+            if (option_type != self.OUTPUT) or (name not in tool_options):
+                continue
+
+            # Only the VCF files
+            filename = tool_options[name]
+            if not filename.endswith(".vcf"):
+                continue
+
+            post_commands.append(
+                [os.path.join(bin_dir, "bgzip")] + bgzip_options + [filename],
+            )
+            post_commands.append([os.path.join(bin_dir, "tabix"), "-f", "-p",
+                                  "vcf", "{}.gz".format(filename)])
+
+        return post_commands
+
     @staticmethod
-    def _execute_command_locally(command, stdout=None, stderr=None):
-        """Executes a command using the subprocess module."""
+    def _need_to_bgzip_vcf(tool_options):
+        """Checks the bgzip_vcf option (of the step, or of the pipeline)."""
+        bgzip = tool_options.get(
+            "bgzip_vcf",
+            GenericTool.get_pipeline_options().get("bgzip_vcf", "no"),
+        )
+        return bgzip == "yes"
+
+    def set_thread_options(self, tool_options, nb_proc=None):
+        """Sets the number of threads of the tool (if it is multithreaded).
+
+        :param tool_options: the tool options (modified in place)
+        :param nb_proc: the number of processors (those reserved for the tool
+                        in the tool configuration if None)
+
+        :type tool_options: dict
+        :type nb_proc: int
+
+        The ``threads`` option is set (unless already present), and so is the
+        ``thread_opt`` option (the tool's thread option). The latter is empty
+        if the thread option was already written in one of the other options
+        (e.g. ``other_opt = -t 4``).
+
+        """
+        required_options = self.get_required_options()
+        if (("thread_opt" not in required_options)
+                and ("threads" not in required_options)):
+            return
+
+        # The number of threads
+        if "threads" not in tool_options:
+            if nb_proc is None:
+                nb_proc = GenericTool.get_tool_nb_proc(self.get_tool_name())
+            tool_options["threads"] = max(nb_proc - self._thread_offset, 0)
+
+        # The thread option (unless it was set by hand)
+        if ((self._thread_option is None)
+                or ("thread_opt" not in required_options)
+                or ("thread_opt" in tool_options)):
+            return
+        flag = self._thread_option.split()[0]
+        for value in tool_options.values():
+            if isinstance(value, str) and (flag in value.split()):
+                tool_options["thread_opt"] = ""
+                return
+        tool_options["thread_opt"] = self._thread_option.format(
+            threads=tool_options["threads"],
+        )
+
+    def split_for_bulk(self, tool_options, out_dir):
+        """Splits the file(s) to split if the tool needs a bulk submission.
+
+        :param tool_options: the tool options (modified in place)
+        :param out_dir: the output directory
+
+        :type tool_options: dict
+        :type out_dir: string
+
+        :returns: the final name of the output files and the original name
+                  of the split files (both by option name), and the split
+                  files that need to be deleted once the bulk job is over.
+
+        The options to split (``split_file`` in the tool configuration, with
+        multiple options separated by commas) are replaced by the name of the
+        chunks, and so are the output files (using ``$PGXCHUNKID``). The
+        number of chunks is saved as the ``nb_split`` option.
+
+        Paired FASTQ files are split into read-pair synchronised chunks, while
+        other files are split by lines.
+
+        """
+        # The name of the job
+        tool_name = self.get_tool_name()
+
+        # Are we in need of a bulk submission?
+        bulk, nb_chunks, files_to_split = GenericTool._is_bulk_job(
+            GenericTool.get_tool_configuration(),
+            tool_name,
+        )
+        if not bulk:
+            return {}, {}, []
+
+        # Are there output files, and can we merge them?
+        output_names = [
+            name for name, option_type in self.get_required_options().items()
+            if (option_type == self.OUTPUT) and (name in tool_options)
+        ]
+        if ((len(output_names) == 0)
+                or (not hasattr(self, "merge_bulk_results"))):
+            m = "{}: cannot run in bulk job".format(tool_name)
+            raise ProgramError(m)
+
+        # The files to split should be in the options
+        for name in files_to_split:
+            if name not in tool_options:
+                m = "{}: {}: no file to split".format(tool_name, name)
+                raise ProgramError(m)
+
+        # The name of the directory containing the chunks
+        out_dir_suffix = os.path.basename(
+            tool_options.get("prefix", tool_options["sample_id"]),
+        )
+
+        # Splitting the file(s)
+        chunk_files = []
+        if all(_fastq_re.search(tool_options[name])
+               for name in files_to_split):
+            split_names, nb_split = GenericTool._split_fastq_files(
+                files_to_split=[tool_options[name] for name in files_to_split],
+                nb_chunks=nb_chunks,
+                out_dir=out_dir,
+                out_dir_suffix=out_dir_suffix,
+            )
+
+            # The FASTQ chunks are only temporary
+            chunk_files = split_names
+
+        elif len(files_to_split) == 1:
+            split_name, nb_split = GenericTool._split_file(
+                file_to_split=tool_options[files_to_split[0]],
+                nb_chunks=nb_chunks,
+                out_dir=out_dir,
+                out_dir_suffix=out_dir_suffix,
+            )
+            split_names = [split_name]
+
+        else:
+            m = "{}: {}: can only split multiple FASTQ files".format(
+                tool_name, ", ".join(files_to_split),
+            )
+            raise ProgramError(m)
+
+        # Changing the name of the split files
+        split_inputs = {}
+        for name, split_name in zip(files_to_split, split_names):
+            split_inputs[name] = tool_options[name]
+            tool_options[name] = split_name
+
+        # There is now one output per split job
+        final_outputs = {}
+        for name in output_names:
+            final_outputs[name] = tool_options[name]
+            root, ext = os.path.splitext(tool_options[name])
+            tool_options[name] = root + "_$PGXCHUNKID" + ext
+
+        # Saving the number of chunks
+        tool_options["nb_split"] = nb_split
+
+        return final_outputs, split_inputs, chunk_files
+
+    def merge_bulk_job(self, tool_options, final_outputs, split_inputs,
+                       chunk_files, out_dir):
+        """Merges the results of a bulk job split by split_for_bulk.
+
+        :param tool_options: the tool options (modified in place)
+        :param final_outputs: the final name of the output files
+        :param split_inputs: the original name of the split files
+        :param chunk_files: the split files to delete
+        :param out_dir: the output directory
+
+        :type tool_options: dict
+        :type final_outputs: dict
+        :type split_inputs: dict
+        :type chunk_files: list
+        :type out_dir: string
+
+        """
+        nb_split = tool_options["nb_split"]
+
+        # Merging each of the output files
+        for name, final_output in final_outputs.items():
+            self.merge_bulk_results(
+                final_output=final_output,
+                chunk_output=tool_options[name],
+                nb_files=nb_split,
+                out_dir=out_dir,
+                tool_options=tool_options,
+            )
+
+        # Deleting the temporary chunks
+        for chunk_file in chunk_files:
+            GenericTool.remove_files(
+                GenericTool.get_chunk_names(chunk_file, nb_split),
+            )
+
+        # Restoring the options
+        tool_options.update(final_outputs)
+        tool_options.update(split_inputs)
+        del tool_options["nb_split"]
+
+    @staticmethod
+    def get_chunk_names(chunk_output, nb_files):
+        """Returns the names of the chunks of a file (in order).
+
+        :param chunk_output: the name of the chunks (with ``$PGXCHUNKID``)
+        :param nb_files: the number of chunks
+
+        :type chunk_output: string
+        :type nb_files: int
+
+        :returns: the name of each chunk
+        :rtype: list
+
+        """
+        return [chunk_output.replace("$PGXCHUNKID", str(i + 1))
+                for i in range(nb_files)]
+
+    @staticmethod
+    def remove_files(filenames):
+        """Removes files (skipping those that don't exist)."""
+        for filename in filenames:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    @staticmethod
+    def merge_chunks(final_output, chunk_output, nb_files, concatenate):
+        """Concatenates the chunks of an output file, then removes them.
+
+        :param final_output: the name of the final output file
+        :param chunk_output: the name of the chunks (with ``$PGXCHUNKID``)
+        :param nb_files: the number of chunks
+        :param concatenate: the function concatenating the chunks (in order)
+                            into the final output (``concatenate(filenames,
+                            output)``)
+
+        :type final_output: string
+        :type chunk_output: string
+        :type nb_files: int
+        :type concatenate: function
+
+        """
+        filenames = GenericTool.get_chunk_names(chunk_output, nb_files)
+        concatenate(filenames, final_output)
+        GenericTool.remove_files(filenames)
+
+    @staticmethod
+    def _execute_command_locally(command, stdout=None, stderr=None,
+                                 pipe_command=None, post_commands=None):
+        """Executes a command using the subprocess module.
+
+        If ``pipe_command`` is set, the STDOUT of the command is piped into
+        it (and its STDOUT is written in ``stdout``). The ``post_commands``
+        (if any) are executed once the command is over (their STDERR is
+        written in ``stderr`` as well).
+
+        """
         # The stdout and stderr files
         if stdout is not None:
             stdout = open(stdout, "wb")
@@ -299,12 +703,27 @@ class GenericTool(object):
             stderr = open(stderr, "wb")
 
         # The process
+        failed_command = None
         try:
-            check_call(command, stdout=stdout, stderr=stderr)
+            if pipe_command is None:
+                check_call(command, stdout=stdout, stderr=stderr)
+            else:
+                GenericTool._execute_pipe(command, pipe_command, stdout,
+                                          stderr)
+
+            for post_command in post_commands or []:
+                failed_command = post_command
+                check_call(post_command, stderr=stderr)
+
         except SubprocessError:
             # Constructing the error message
             m = "The following command failed:\n\n"
-            m += "    {}\n\n".format(" ".join(command))
+            if failed_command is not None:
+                m += "    {}\n\n".format(" ".join(failed_command))
+            else:
+                m += "    {}\n\n".format(" ".join(command))
+                if pipe_command is not None:
+                    m += "    | {}\n\n".format(" ".join(pipe_command))
 
             # The name of the log file
             log_filename = "log file"
@@ -315,8 +734,15 @@ class GenericTool(object):
             # Raising the exception
             raise ProgramError(m)
 
-        except FileNotFoundError:
-            m = "{}: no such executable".format(command[0])
+        except FileNotFoundError as e:
+            # The executable might be the one of the piped (or following)
+            # command
+            executable = command[0]
+            if failed_command is not None:
+                executable = failed_command[0]
+            elif (pipe_command is not None) and (e.filename in pipe_command):
+                executable = e.filename
+            m = "{}: no such executable".format(executable)
             raise ProgramError(m)
 
         finally:
@@ -326,9 +752,104 @@ class GenericTool(object):
             if stderr is not None:
                 stderr.close()
 
+    @staticmethod
+    def _execute_pipe(command, pipe_command, stdout, stderr):
+        """Executes a command piped into others (like 'set -o pipefail').
+
+        The commands of ``pipe_command`` are separated by
+        :py:attr:`GenericTool.PIPE`. A :py:class:`subprocess.SubprocessError`
+        is raised if any of the commands failed.
+
+        """
+        # The commands of the pipe
+        commands = [command, []]
+        for chunk in pipe_command:
+            if chunk == GenericTool.PIPE:
+                commands.append([])
+            else:
+                commands[-1].append(chunk)
+
+        processes = []
+        try:
+            for i, curr_command in enumerate(commands):
+                stdin = processes[-1].stdout if processes else None
+                try:
+                    processes.append(Popen(
+                        curr_command, stdin=stdin, stderr=stderr,
+                        stdout=stdout if i == len(commands) - 1 else PIPE,
+                    ))
+                finally:
+                    # Only the next command reads the pipe
+                    if stdin is not None:
+                        stdin.close()
+        except FileNotFoundError:
+            for process in processes:
+                process.kill()
+                process.wait()
+            raise
+
+        # All the commands need to succeed
+        statuses = [process.wait() for process in reversed(processes)]
+        if any(status != 0 for status in statuses):
+            raise SubprocessError()
+
+    @staticmethod
+    def _execute_bulk_command_locally(command, stdout, stderr, nb_chunks,
+                                      nb_process, pipe_command=None):
+        """Executes a bulk command locally (using multiple processes)."""
+        with ThreadPoolExecutor(max_workers=nb_process) as executor:
+            jobs = []
+            for i in range(nb_chunks):
+                chunk_id = str(i + 1)
+                chunk_pipe_command = None
+                if pipe_command is not None:
+                    chunk_pipe_command = [
+                        chunk.replace("$PGXCHUNKID", chunk_id)
+                        for chunk in pipe_command
+                    ]
+                jobs.append(executor.submit(
+                    GenericTool._execute_command_locally,
+                    command=[
+                        chunk.replace("$PGXCHUNKID", chunk_id)
+                        for chunk in command
+                    ],
+                    stdout=stdout.replace("$PGXCHUNKID", chunk_id),
+                    stderr=stderr.replace("$PGXCHUNKID", chunk_id),
+                    pipe_command=chunk_pipe_command,
+                ))
+
+            # Waiting for all the jobs (raising the first error, if any)
+            for job in jobs:
+                job.result()
+
+    @staticmethod
+    def _shell_quote(chunk):
+        """Quotes a part of a command for a job script.
+
+        The chunk ID (``$PGXCHUNKID``) and the temporary directory of the
+        node (``$TMPDIR``, or ``/tmp``) are expanded by the shell running the
+        job.
+
+        """
+        # The commands of a pipe are separated by the shell
+        if chunk == GenericTool.PIPE:
+            return chunk
+
+        safe_chunk = shlex.quote(chunk)
+        safe_chunk = safe_chunk.replace("$PGXCHUNKID", "'$PGXCHUNKID'")
+        return safe_chunk.replace(GenericTool.TMP_DIR,
+                                  "'\"${TMPDIR:-/tmp}\"'")
+
+    @staticmethod
+    def _set_local_tmp_dir(command):
+        """Replaces the temporary directory placeholder by the local one."""
+        return [chunk.replace(GenericTool.TMP_DIR, gettempdir())
+                for chunk in command]
+
     @staticmethod
     def _execute_command_drmaa(preamble, command, stdout, stderr, out_dir,
-                               job_name, walltime, nodes):
+                               job_name, walltime, nodes, pipe_command=None,
+                               post_commands=None):
         """Executes a command using DRMAA."""
         # Creating the script in a temporary file
         tmp_file = NamedTemporaryFile(mode="w", suffix="_execute.sh",
@@ -340,13 +861,34 @@ class GenericTool(object):
         # Writing the preamble
         print(preamble, file=tmp_file)
 
-        # Writing the command
+        # The following commands only run if the command succeeded
+        if post_commands:
+            print("set -e", file=tmp_file)
+
+        # Writing the command (the script fails if any piped command fails)
+        if pipe_command is not None:
+            print("set -o pipefail", file=tmp_file)
+            print("{", end=" ", file=tmp_file)
         print(command[0], end=" ", file=tmp_file)
         for chunck in command[1:]:
-            print(shlex.quote(chunck), end=" ", file=tmp_file)
+            print(GenericTool._shell_quote(chunck), end=" ", file=tmp_file)
+        if pipe_command is not None:
+            print("|", pipe_command[0], end=" ", file=tmp_file)
+            for chunck in pipe_command[1:]:
+                print(GenericTool._shell_quote(chunck), end=" ",
+                      file=tmp_file)
+            print(";", "}", end=" ", file=tmp_file)
         print("> {}".format(shlex.quote(stdout)), end=" ", file=tmp_file)
         print("2> {}".format(shlex.quote(stderr)), file=tmp_file, end="\n\n")
 
+        # Writing the following commands (e.g. compressing the VCF files)
+        for post_command in post_commands or []:
+            print(post_command[0], end=" ", file=tmp_file)
+            for chunck in post_command[1:]:
+                print(GenericTool._shell_quote(chunck), end=" ",
+                      file=tmp_file)
+            print("2>> {}".format(shlex.quote(stderr)), file=tmp_file)
+
         # Closing the temporary file
         tmp_file.close()
 
@@ -396,7 +938,8 @@ class GenericTool(object):
 
     @staticmethod
     def _execute_bulk_command_drmaa(preamble, command, stdout, stderr, out_dir,
-                                    job_name, walltime, nodes, nb_chunks):
+                                    job_name, walltime, nodes, nb_chunks,
+                                    pipe_command=None):
         """Executes a bulk command using DRMAA."""
         # Creating the script in a temporary file
         tmp_file = NamedTemporaryFile(mode="w", suffix="_execute.sh",
@@ -408,21 +951,26 @@ class GenericTool(object):
         # Writing the preamble
         print(preamble, file=tmp_file)
 
-        # Writing the command
+        # Writing the command (the script fails if any piped command fails)
+        if pipe_command is not None:
+            print("set -o pipefail", file=tmp_file)
+            print("{", end=" ", file=tmp_file)
         print(command[0], end=" ", file=tmp_file)
         for chunck in command[1:]:
-            safe_chunk = shlex.quote(chunck)
-            safe_chunk = safe_chunk.replace("$PGXCHUNKID", "'$PGXCHUNKID'")
-            print(safe_chunk, end=" ", file=tmp_file)
+            print(GenericTool._shell_quote(chunck), end=" ", file=tmp_file)
+        if pipe_command is not None:
+            print("|", pipe_command[0], end=" ", file=tmp_file)
+            for chunck in pipe_command[1:]:
+                print(GenericTool._shell_quote(chunck), end=" ",
+                      file=tmp_file)
+            print(";", "}", end=" ", file=tmp_file)
 
         # The STDOUT
-        safe_stdout = shlex.quote(stdout)
-        safe_stdout = safe_stdout.replace("$PGXCHUNKID", "'$PGXCHUNKID'")
+        safe_stdout = GenericTool._shell_quote(stdout)
         print("> {}".format(safe_stdout), end=" ", file=tmp_file)
 
         # The STDERR
-        safe_stderr = shlex.quote(stderr)
-        safe_stderr = safe_stderr.replace("$PGXCHUNKID", "'$PGXCHUNKID'")
+        safe_stderr = GenericTool._shell_quote(stderr)
         print("2> {}".format(safe_stderr), file=tmp_file, end="\n\n")
 
         # Closing the temporary file
@@ -527,6 +1075,35 @@ class GenericTool(object):
         # Returning the name of the split files
         return filename.format(i="$PGXCHUNKID"), nb_files
 
+    @staticmethod
+    def _split_fastq_files(files_to_split, nb_chunks, out_dir,
+                           out_dir_suffix):
+        """Split paired FASTQ files to launch a bulk job."""
+        # The directory containing the chunks
+        dirname = os.path.join(out_dir, "{}_chunks".format(out_dir_suffix))
+        if not os.path.isdir(dirname):
+            os.mkdir(dirname)
+
+        # The name of the chunks (keeping the name of the original files at
+        # the end, since it contains the read number)
+        filenames = [
+            os.path.join(dirname, "chunk_{i}." + os.path.basename(filename))
+            for filename in files_to_split
+        ]
+
+        # Splitting
+        nb_files = split_paired_fastq(
+            filenames=files_to_split,
+            out_filenames=[
+                [filename.format(i=i + 1) for filename in filenames]
+                for i in range(nb_chunks)
+            ],
+        )
+
+        # Returning the name of the split files
+        return [filename.format(i="$PGXCHUNKID")
+                for filename in filenames], nb_files
+
     @staticmethod
     def _is_job_completed(job):
         """Checks the job status and return False if not completed."""
@@ -561,15 +1138,54 @@ class GenericTool(object):
         """Checks if the tool needs splitting (for array submission)."""
         bulk_submission = False
         nb_chunks = 1
-        split_file = None
+        split_files = None
         if job_name in options:
             job_options = options[job_name]
             if ("nb_chunks" in job_options) and ("split_file" in job_options):
                 nb_chunks = int(job_options["nb_chunks"])
-                split_file = job_options["split_file"]
+                split_files = [
+                    name.strip()
+                    for name in job_options["split_file"].split(",")
+                ]
                 bulk_submission = True
 
-        return bulk_submission, nb_chunks, split_file
+        return bulk_submission, nb_chunks, split_files
+
+    @staticmethod
+    def link_file(source, destination):
+        """Links a file (using a hard link if possible)."""
+        if os.path.lexists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            os.symlink(os.path.abspath(source), destination)
+
+    @staticmethod
+    def copy_file(source, destination):
+        """Copies a file (never sharing its content with the source).
+
+        The destination is replaced once written (using
+        :py:func:`atomic_output`).
+
+        """
+        with atomic_output(destination) as o_file:
+            with open(source, "rb") as i_file:
+                shutil.copyfileobj(i_file, o_file)
+
+    @staticmethod
+    def get_tool_nb_proc(tool_name):
+        """Returns the number of processors reserved for the tool."""
+        # Getting all the tool configuration
+        tool_conf = GenericTool.get_tool_configuration()
+
+        # By default, only one processor
+        nb_proc = 1
+        if (tool_name in tool_conf) and ("nb_proc" in tool_conf[tool_name]):
+            nb_proc = int(tool_conf[tool_name]["nb_proc"])
+
+        # Returning the number of processors
+        return nb_proc
 
     def check_options(self, options):
         """Checks the tool options."""
@@ -593,9 +1209,15 @@ class GenericTool(object):
 
             # Checking if the option is an input file
             if option_type == self.INPUT:
-                # The file should exists
-                if not os.path.isfile(options[option_name]):
-                    m = "{}: no such file".format(options[option_name])
+                # The file should exists (at least one chunk if the file was
+                # split for a bulk job)
+                filename = options[option_name]
+                if "$PGXCHUNKID" in filename:
+                    if len(glob(filename.replace("$PGXCHUNKID", "*"))) < 1:
+                        m = "{}: no such files".format(filename)
+                        raise ProgramError(m)
+                elif not os.path.isfile(filename):
+                    m = "{}: no such file".format(filename)
                     raise ProgramError(m)
 
                 # Option is now safe
@@ -7,9 +7,10 @@
 # Commons, PO Box 1866, Mountain View, CA 94042, USA.
 
 
-import re
-
 from . import GenericTool
+from .. import ProgramError
+from .samtools import IndexBam
+from .vcftools import VcfConcat
 
 
 __author__ = "Louis-Philippe Lemieux Perreault"
@@ -18,13 +19,14 @@ __copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
 __license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
 
 
-__all__ = ["BcftoolsVariantCaller"]
+__all__ = ["BcftoolsVariantCaller", "BcftoolsMpileupCall",
+           "BcftoolsMpileupCall_Multi"]
 
 
 class Bcftools(GenericTool):
 
     # The version of the tool
-    _version = "1.1"
+    _version = "1.10"
 
     # The executable
     _exec = "bcftools"
@@ -39,6 +41,10 @@ class BcftoolsVariantCaller(Bcftools):
     # The name of the tool
     _tool_name = "BcftoolsVariantCaller"
 
+    # The version of the tool (the calls are made by the legacy 'view'
+    # command, not by 'call' as for the mpileup steps)
+    _version = "1.1"
+
     # The options
     _command = "view -vcg {input}"
 
@@ -61,3 +67,127 @@ class BcftoolsVariantCaller(Bcftools):
     def __init__(self):
         """Initialize a BcftoolsVariantCaller instance."""
         pass
+
+
+class _MpileupCall(Bcftools):
+
+    # The pileup is streamed into the caller (no intermediate file)
+    _pipe_exec = Bcftools._exec
+    _pipe_command = "call -m -v -O v {other_opt}"
+
+    # The STDOUT and STDERR
+    _stdout = "{output}"
+    _stderr = "{output}.err"
+
+    # The suffix that will be added just before the extension of the output
+    # file
+    _suffix = "bcftools"
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?bam$", )
+    _output_type = (".{}.vcf".format(_suffix), )
+
+    def __init__(self):
+        """Initialize a _MpileupCall instance."""
+        pass
+
+    def index_inputs(self, options, out_dir):
+        """Indexes the input BAM file(s)."""
+        # A single input file
+        if not self.need_to_merge_all_inputs():
+            if "input" not in options:
+                m = "{}: no input file".format(self.__class__.__name__)
+                raise ProgramError(m)
+            IndexBam().execute({"input": options["input"]}, out_dir)
+            return
+
+        # All the input files (in parallel)
+        if "inputs" not in options:
+            m = "{}: no input files".format(self.__class__.__name__)
+            raise ProgramError(m)
+        IndexBam.index_all(
+            filenames=options["inputs"],
+            out_dir=out_dir,
+            nb_process=GenericTool.get_tool_nb_proc(self.get_tool_name()),
+        )
+
+    def execute(self, options, out_dir=None):
+        """Calls the variants (by chunk of regions, if required)."""
+        # First we index the input file(s)
+        self.index_inputs(options, out_dir)
+
+        # By default, the (padded) targets of the pipeline are called
+        if "targets" not in options:
+            targets = GenericTool.get_pipeline_options().get("targets", None)
+            if targets is not None:
+                options["targets"] = targets
+
+        # Do we need to split the regions for a bulk job? If so, each chunk
+        # of regions is called separately
+        final_outputs, split_inputs, chunk_files = self.split_for_bulk(
+            options, out_dir,
+        )
+
+        # The regions to call
+        if "targets" in options:
+            options["regions_opt"] = "-R {}".format(options["targets"])
+
+        super().execute(options, out_dir)
+
+        # Merging the chunks (if required)
+        if final_outputs:
+            self.merge_bulk_job(options, final_outputs, split_inputs,
+                                chunk_files, out_dir)
+
+    def merge_bulk_results(self, final_output, chunk_output, nb_files,
+                           out_dir, tool_options):
+        """Concatenates the VCF of each chunk of regions (in order)."""
+        VcfConcat.concatenate_chunks(final_output, chunk_output, nb_files,
+                                     out_dir, tool_options)
+
+
+class BcftoolsMpileupCall(_MpileupCall):
+
+    # The name of the tool
+    _tool_name = "BcftoolsMpileupCall"
+
+    # The options
+    _command = ("mpileup -O u -f {reference} {regions_opt} "
+                "{other_mpileup_opt} {input}")
+
+    # The description of the required options
+    _required_options = {"input":             GenericTool.INPUT,
+                         "output":            GenericTool.OUTPUT,
+                         "reference":         GenericTool.INPUT,
+                         "regions_opt":       GenericTool.OPTIONAL,
+                         "other_mpileup_opt": GenericTool.OPTIONAL,
+                         "other_opt":         GenericTool.OPTIONAL}
+
+    def __init__(self):
+        """Initialize a BcftoolsMpileupCall instance."""
+        pass
+
+
+class BcftoolsMpileupCall_Multi(_MpileupCall):
+
+    # The name of the tool
+    _tool_name = "BcftoolsMpileupCall_Multi"
+
+    # The options
+    _command = ("mpileup -O u -f {reference} {regions_opt} "
+                "{other_mpileup_opt} {inputs}")
+
+    # The description of the required options
+    _required_options = {"inputs":            GenericTool.INPUTS,
+                         "output":            GenericTool.OUTPUT,
+                         "reference":         GenericTool.INPUT,
+                         "regions_opt":       GenericTool.OPTIONAL,
+                         "other_mpileup_opt": GenericTool.OPTIONAL,
+                         "other_opt":         GenericTool.OPTIONAL}
+
+    # This tool needs multiple input
+    _merge_all_inputs = True
+
+    def __init__(self):
+        """Initialize a BcftoolsMpileupCall_Multi instance."""
+        pass
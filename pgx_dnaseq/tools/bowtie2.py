@@ -8,6 +8,8 @@
 
 
 from . import GenericTool
+from .. import ProgramError
+from ..sam import concatenate_sam, get_read_group
 
 
 __author__ = "Louis-Philippe Lemieux Perreault"
@@ -27,10 +29,19 @@ class Bowtie2(GenericTool):
     # The executable
     _exec = "bowtie2"
 
+    # The number of threads
+    _thread_option = "-p {threads}"
+
     def __init__(self):
         """Initialize a Bowtie2  instance."""
         pass
 
+    def merge_bulk_results(self, final_output, chunk_output, nb_files,
+                           out_dir, tool_options):
+        """Merges the alignments of each chunk of reads."""
+        self.merge_chunks(final_output, chunk_output, nb_files,
+                          concatenate_sam)
+
 
 class Bowtie2_align(Bowtie2):
 
@@ -38,18 +49,21 @@ class Bowtie2_align(Bowtie2):
     _tool_name = "Bowtie2_align"
 
     # The options
-    _command = "{reference} -1 {input1} -2 {input2} -S {output} {other_opt}"
+    _command = ("{thread_opt} {reference} -1 {input1} -2 {input2} -S {output} "
+                "{rg_opt} {other_opt}")
 
     # The STDOUT and STDERR
     _stdout = "{output}.out"
     _stderr = "{output}.err"
 
     # The description of the required options
-    _required_options = {"input1":    GenericTool.INPUT,
-                         "input2":    GenericTool.INPUT,
-                         "output":    GenericTool.OUTPUT,
-                         "reference": GenericTool.REQUIREMENT,
-                         "other_opt": GenericTool.OPTIONAL}
+    _required_options = {"input1":     GenericTool.INPUT,
+                         "input2":     GenericTool.INPUT,
+                         "output":     GenericTool.OUTPUT,
+                         "reference":  GenericTool.REQUIREMENT,
+                         "rg_opt":     GenericTool.OPTIONAL,
+                         "thread_opt": GenericTool.OPTIONAL,
+                         "other_opt":  GenericTool.OPTIONAL}
 
     # The suffix that will be added just before the extension of the output
     # file
@@ -60,6 +74,29 @@ class Bowtie2_align(Bowtie2):
                    r"_R2\.(\S+\.)?fastq(\.gz)?$")
     _output_type = (".{}.sam".format(_suffix),)
 
+    # The read group can be added while aligning
+    _read_group_injection = True
+
     def __init__(self):
         """Initialize a Bowtie2_align instance."""
         pass
+
+    def execute(self, options, out_dir=None):
+        """Aligns the reads (adding the read group, if required)."""
+        if options.get("inject_rg", "no") == "yes":
+            try:
+                read_group = get_read_group(options)
+            except KeyError as e:
+                m = "{}: missing read group option {}".format(
+                    self.__class__.__name__, e,
+                )
+                raise ProgramError(m)
+
+            # The ID has its own option
+            options["rg_opt"] = "--rg-id {} {}".format(
+                read_group[0][1],
+                " ".join("--rg {}:{}".format(*field)
+                         for field in read_group[1:]),
+            )
+
+        super().execute(options, out_dir)
@@ -11,6 +11,7 @@ import os
 
 from . import GenericTool
 from .. import ProgramError
+from ..sam import concatenate_sam, get_read_group
 
 
 __author__ = "Louis-Philippe Lemieux Perreault"
@@ -30,10 +31,38 @@ class BWA(GenericTool):
     # The executable
     _exec = "bwa"
 
+    # The number of threads
+    _thread_option = "-t {threads}"
+
     def __init__(self):
         """Initialize a BWA instance."""
         pass
 
+    def set_read_group_option(self, options):
+        """Sets the read group option (if it needs to be injected)."""
+        if options.get("inject_rg", "no") != "yes":
+            return
+
+        try:
+            read_group = get_read_group(options)
+        except KeyError as e:
+            m = "{}: missing read group option {}".format(
+                self.__class__.__name__, e,
+            )
+            raise ProgramError(m)
+
+        # The tabulations are escaped (BWA replaces the '\t' by tabulations)
+        options["rg_opt"] = "-{} @RG\\t{}".format(
+            self._read_group_flag,
+            "\\t".join("{}:{}".format(*field) for field in read_group),
+        )
+
+    def merge_bulk_results(self, final_output, chunk_output, nb_files,
+                           out_dir, tool_options):
+        """Merges the alignments of each chunk of reads."""
+        self.merge_chunks(final_output, chunk_output, nb_files,
+                          concatenate_sam)
+
 
 class ALN(BWA):
 
@@ -41,7 +70,7 @@ class ALN(BWA):
     _tool_name = "ALN"
 
     # The options
-    _command = "aln {reference} {other_aln_opt} {input}"
+    _command = "aln {thread_opt} {reference} {other_aln_opt} {input}"
 
     # The STDOUT and STDERR
     _stdout = "{output}"
@@ -50,6 +79,7 @@ class ALN(BWA):
     # The description of the required options
     _required_options = {"reference":     GenericTool.INPUT,
                          "other_aln_opt": GenericTool.OPTIONAL,
+                         "thread_opt":    GenericTool.OPTIONAL,
                          "input":         GenericTool.INPUT,
                          "output":        GenericTool.OUTPUT}
 
@@ -64,18 +94,21 @@ class MEM(BWA):
     _tool_name = "MEM"
 
     # The options
-    _command = "mem {reference} {input1} {input2} {other_opt} "
+    _command = ("mem {thread_opt} {rg_opt} {reference} {input1} {input2} "
+                "{other_opt}")
 
     # The STDOUT and STDERR
     _stdout = "{output}"
     _stderr = "{output}.err"
 
     # The description of the required options
-    _required_options = {"reference": GenericTool.INPUT,
-                         "other_opt": GenericTool.OPTIONAL,
-                         "input1":    GenericTool.INPUT,
-                         "input2":    GenericTool.INPUT,
-                         "output":    GenericTool.OUTPUT}
+    _required_options = {"reference":  GenericTool.INPUT,
+                         "other_opt":  GenericTool.OPTIONAL,
+                         "rg_opt":     GenericTool.OPTIONAL,
+                         "thread_opt": GenericTool.OPTIONAL,
+                         "input1":     GenericTool.INPUT,
+                         "input2":     GenericTool.INPUT,
+                         "output":     GenericTool.OUTPUT}
 
     # The suffix that will be added just before the extension of the output
     # file
@@ -86,10 +119,19 @@ class MEM(BWA):
                    r"_R2\.(\S+\.)?fastq(\.gz)?$")
     _output_type = (".{}.sam".format(_suffix),)
 
+    # The read group can be added while aligning
+    _read_group_injection = True
+    _read_group_flag = "R"
+
     def __init__(self):
         """Initialize a MEM instance."""
         pass
 
+    def execute(self, options, out_dir=None):
+        """Execute MEM (adding the read group, if required)."""
+        self.set_read_group_option(options)
+        super().execute(options, out_dir)
+
 
 class SAMPE(BWA):
 
@@ -97,7 +139,7 @@ class SAMPE(BWA):
     _tool_name = "SAMPE"
 
     # The options
-    _command = "sampe {reference} {sai1} {sai2} {input1} {input2}"
+    _command = "sampe {rg_opt} {reference} {sai1} {sai2} {input1} {input2}"
 
     # The STDOUT and STDERR
     _stdout = "{output}"
@@ -105,6 +147,7 @@ class SAMPE(BWA):
 
     # The description of the required options
     _required_options = {"reference": GenericTool.INPUT,
+                         "rg_opt":    GenericTool.OPTIONAL,
                          "sai1":      GenericTool.INPUT,
                          "sai2":      GenericTool.INPUT,
                          "input1":    GenericTool.INPUT,
@@ -120,14 +163,26 @@ class SAMPE(BWA):
                    r"_R2\.(\S+\.)?fastq(\.gz)?$")
     _output_type = (".{}.sam".format(_suffix),)
 
+    # The read group can be added while aligning
+    _read_group_injection = True
+    _read_group_flag = "r"
+
     def __init__(self):
         """Initialize a SAMPE instance."""
         pass
 
     def execute(self, options, out_dir=None):
         """Execute ALN and SAMPE."""
+        # Do we need to split the reads for a bulk job? If so, ALN and SAMPE
+        # are both executed on each chunk of reads
+        final_outputs, split_inputs, chunk_files = self.split_for_bulk(
+            options, out_dir,
+        )
+
         # The ALN options for the first file
         aln_options = {}
+        if "nb_split" in options:
+            aln_options["nb_split"] = options["nb_split"]
         try:
             # The reference
             aln_options["reference"] = options["reference"]
@@ -170,5 +225,12 @@ class SAMPE(BWA):
         # Executing for the second file
         ALN().execute(aln_options, out_dir)
 
-        # Executing SAMPE
+        # Executing SAMPE (adding the read group, if required)
+        self.set_read_group_option(options)
         super().execute(options, out_dir)
+
+        # Merging the chunks (if required)
+        if final_outputs:
+            chunk_files.extend([options["sai1"], options["sai2"]])
+            self.merge_bulk_job(options, final_outputs, split_inputs,
+                                chunk_files, out_dir)
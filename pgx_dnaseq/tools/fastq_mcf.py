@@ -7,10 +7,14 @@
 # Commons, PO Box 1866, Mountain View, CA 94042, USA.
 
 
+import os
 import re
+import shutil
 from glob import glob
+from collections import OrderedDict
 
 from . import GenericTool
+from ..fastq import concatenate_gzip
 
 
 __author__ = "Louis-Philippe Lemieux Perreault"
@@ -71,18 +75,93 @@ class ClipTrim(FastQMCF):
         """Initialize a ClipTrim instance."""
         pass
 
+    def merge_bulk_results(self, final_output, chunk_output, nb_files,
+                           out_dir, tool_options):
+        """Merges the trimmed reads (or the reports) of each chunk."""
+        # The name of the chunks
+        output_files = self.get_chunk_names(chunk_output, nb_files)
+
+        if final_output.endswith(".gz"):
+            # The compressed chunks are simply concatenated
+            concatenate_gzip(output_files, final_output)
+
+        else:
+            # This is the prefix of the reports (STDOUT and STDERR)
+            self._merge_reports(
+                filenames=["{}.out".format(i) for i in output_files],
+                output="{}.out".format(final_output),
+            )
+            with open("{}.err".format(final_output), "wb") as o_file:
+                for filename in output_files:
+                    with open("{}.err".format(filename), "rb") as i_file:
+                        shutil.copyfileobj(i_file, o_file)
+            output_files = [
+                "{}.{}".format(filename, ext)
+                for filename in output_files for ext in ("out", "err")
+            ]
+
+        # Removing the output files
+        self.remove_files(output_files)
+
+    @staticmethod
+    def _merge_reports(filenames, output):
+        """Sums the counters of the fastq-mcf reports of each chunk."""
+        nb_reads = 0
+        nb_shorts = 0
+        nb_trimmed = OrderedDict()
+        for filename in filenames:
+            content = None
+            with open(filename, "r") as i_file:
+                content = i_file.read()
+
+            nb_reads += int(re.search(r"Total reads: (\d+)", content).group(1))
+            nb_shorts += int(
+                re.search(r"Too short after clip: (\d+)", content).group(1)
+            )
+
+            # The number of trimmed reads for each file (without the chunk
+            # number in the name)
+            for nb, name in re.findall(r"Trimmed (\d+) reads \((.+?)\)",
+                                       content):
+                name = re.sub(r"^chunk_\d+\.", "", os.path.basename(name))
+                nb_trimmed[name] = nb_trimmed.get(name, 0) + int(nb)
+
+        with open(output, "w") as o_file:
+            print("Chunks: {}".format(len(filenames)), file=o_file)
+            print("Total reads: {}".format(nb_reads), file=o_file)
+            print("Too short after clip: {}".format(nb_shorts), file=o_file)
+            for name, nb in nb_trimmed.items():
+                print("Trimmed {} reads ({})".format(nb, name), file=o_file)
+
     def read_report(self, prefix):
-        """Reads a ClipTrim report file."""
-        # Getting the report file name
-        filename = glob("{}.out".format(prefix))
-        assert len(filename) == 1
-        filename = filename[0]
+        """Reads a ClipTrim report file (summing the lanes, if any)."""
+        # Getting the report file names (one per lane if required)
+        filenames = glob("{}.out".format(prefix))
+        filenames += glob("{}_L[0-9][0-9][0-9].out".format(prefix))
+        assert len(filenames) >= 1
+
+        # Saving the results
+        result = {
+            "total_reads_before_trim":   0,
+            "nb_short_reads_after_trim": 0,
+            "nb_trimmed_r1":             0,
+            "nb_trimmed_r2":             0,
+        }
+
+        for filename in sorted(filenames):
+            # Reading the content
+            content = None
+            with open(filename, "r") as i_file:
+                content = i_file.read()
 
-        # Reading the content
-        content = None
-        with open(filename, "r") as i_file:
-            content = i_file.read()
+            for name, value in self._parse_report(content).items():
+                result[name] += value
 
+        return result
+
+    @staticmethod
+    def _parse_report(content):
+        """Parses the content of a fastq-mcf report."""
         # Getting the total number of reads
         nb_reads = int(re.search(r"Total reads: (\d+)", content).group(1)) * 2
 
@@ -96,12 +175,9 @@ class ClipTrim(FastQMCF):
         trim_r2 = re.search(r"Trimmed (\d+) reads .*_R2\.fastq\.gz", content)
         trim_r2 = int(trim_r2.group(1))
 
-        # Saving the results
-        result = {
+        return {
             "total_reads_before_trim":   nb_reads,
             "nb_short_reads_after_trim": nb_shorts,
             "nb_trimmed_r1":             trim_r1,
             "nb_trimmed_r2":             trim_r2,
         }
-
-        return result
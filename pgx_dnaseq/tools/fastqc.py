@@ -32,6 +32,9 @@ class FastQC(GenericTool):
     # The executable
     _exec = "fastqc"
 
+    # The number of threads (files processed simultaneously)
+    _thread_option = "--threads {threads}"
+
     def __init__(self):
         """Initialize a FastQC instance."""
         pass
@@ -43,15 +46,16 @@ class FastQC_FastQ(FastQC):
     _tool_name = "FastQC_FastQ"
 
     # The options
-    _command = "{input}"
+    _command = "{thread_opt} {input}"
 
     # The STDOUT and STDERR
     _stdout = "{output}.out"
     _stderr = "{output}.err"
 
     # The description of the required options
-    _required_options = {"input":  GenericTool.INPUT,
-                         "output": GenericTool.OUTPUT}
+    _required_options = {"input":      GenericTool.INPUT,
+                         "output":     GenericTool.OUTPUT,
+                         "thread_opt": GenericTool.OPTIONAL}
 
     # The suffix that will be added just before the extension of the output
     # file
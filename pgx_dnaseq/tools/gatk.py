@@ -25,8 +25,8 @@ __license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
 
 __all__ = ["RealignerTargetCreator", "IndelRealigner", "PrintReads",
            "BaseRecalibrator", "UnifiedGenotyper", "UnifiedGenotyper_Multi",
-           "HaplotypeCaller", "HaplotypeCaller_Multi", "VariantRecalibrator",
-           "ApplyRecalibration"]
+           "HaplotypeCaller", "HaplotypeCaller_Multi", "HaplotypeCaller_GVCF",
+           "GenotypeGVCFs", "VariantRecalibrator", "ApplyRecalibration"]
 
 
 class GATK(JAR):
@@ -38,10 +38,57 @@ class GATK(JAR):
     _jar_location = "/opt/GenomeAnalysisTK-3.3-0"
     _jar = "GenomeAnalysisTK.jar"
 
+    # By default, the walker is restricted to the targets (if any)
+    _restrict_to_targets = True
+
+    # Some walkers drop the reads outside of the targets (so they are only
+    # restricted if asked to)
+    _drops_off_target_reads = False
+
     def __init__(self):
         """Initialize a PicardTools instance."""
         pass
 
+    def get_child_command(self):
+        """Returns the command options of the child (intervals, threads)."""
+        return "{} {{intervals_opt}} {{thread_opt}}".format(
+            super().get_child_command(),
+        )
+
+    def get_child_required_options(self):
+        """Returns the required options of the child (intervals, threads)."""
+        required_options = super().get_child_required_options().copy()
+        required_options["intervals_opt"] = GenericTool.OPTIONAL
+        required_options["thread_opt"] = GenericTool.OPTIONAL
+        return required_options
+
+    def execute(self, options, out_dir=None):
+        """Restricts the walker to the targets (if any) and executes it."""
+        options["intervals_opt"] = ""
+
+        # The targets of the step, or the (padded) targets of the pipeline
+        targets = options.get(
+            "targets",
+            GenericTool.get_pipeline_options().get("targets", None),
+        )
+
+        restrict = self._restrict_to_targets and (targets is not None)
+        if restrict and self._drops_off_target_reads:
+            restrict = options.get("drop_off_target_reads", "no") == "yes"
+
+        if restrict:
+            options["intervals_opt"] = "-L {}".format(targets)
+
+        super().execute(options, out_dir)
+
+    @staticmethod
+    def get_gvcf_store(options):
+        """Returns the directory where the GVCFs are kept (None if none)."""
+        return options.get(
+            "gvcf_store",
+            GenericTool.get_pipeline_options().get("gvcf_store", None),
+        )
+
 
 class RealignerTargetCreator(GATK):
 
@@ -70,6 +117,9 @@ class RealignerTargetCreator(GATK):
     _input_type = (r"\.(\S+\.)?[sb]am$", )
     _output_type = (".intervals", )
 
+    # The number of threads (data threads)
+    _thread_option = "-nt {threads}"
+
     def __init__(self):
         """Initialize a _Realign instance."""
         pass
@@ -103,6 +153,9 @@ class IndelRealigner(GATK):
     _input_type = (r"\.(\S+\.)?[sb]am$", )
     _output_type = (".{}.bam".format(_suffix), )
 
+    # The reads outside of the targets would be dropped
+    _drops_off_target_reads = True
+
     def __init__(self):
         """Initialize a IndelRealigner instance."""
         pass
@@ -170,6 +223,12 @@ class PrintReads(GATK):
     _input_type = (r"\.(\S+\.)?[sb]am$", )
     _output_type = (".grp", )
 
+    # The reads outside of the targets would be dropped
+    _drops_off_target_reads = True
+
+    # The number of threads (CPU threads)
+    _thread_option = "-nct {threads}"
+
     def __init__(self):
         """Initialize a PrintReads instance."""
         pass
@@ -203,6 +262,9 @@ class BaseRecalibrator(GATK):
     _input_type = (r"\.(\S+\.)?[sb]am$", )
     _output_type = (".{}.bam".format(_suffix), )
 
+    # The number of threads (CPU threads)
+    _thread_option = "-nct {threads}"
+
     def __init__(self):
         """Initialize a BaseRecalibrator instance."""
         pass
@@ -255,6 +317,9 @@ class UnifiedGenotyper(GATK):
     _input_type = (r"\.(\S+\.)?[sb]am$", )
     _output_type = (".{}.vcf".format(_suffix), )
 
+    # The number of threads (data threads)
+    _thread_option = "-nt {threads}"
+
     def __init__(self):
         """Initialize a UnifiedGenotyper instance."""
         pass
@@ -302,6 +367,9 @@ class UnifiedGenotyper_Multi(GATK):
     # This tool needs multiple input
     _merge_all_inputs = True
 
+    # The number of threads (data threads)
+    _thread_option = "-nt {threads}"
+
     def __init__(self):
         """Initialize a UnifiedGenotyper_Multi instance."""
         pass
@@ -312,8 +380,11 @@ class UnifiedGenotyper_Multi(GATK):
         if "inputs" not in options:
             m = "{}: no input files".format(self.__class__.__name__)
             raise ProgramError(m)
-        for filename in options["inputs"]:
-            IndexBam().execute({"input": filename}, out_dir)
+        IndexBam.index_all(
+            filenames=options["inputs"],
+            out_dir=out_dir,
+            nb_process=GenericTool.get_tool_nb_proc(self.get_tool_name()),
+        )
 
         # We need to create the list of bam files
         list_filename = os.path.join(out_dir, "input_files.list")
@@ -355,6 +426,9 @@ class HaplotypeCaller(GATK):
     _input_type = (r"\.(\S+\.)?[sb]am$", )
     _output_type = (".{}.vcf".format(_suffix), )
 
+    # The number of threads (CPU threads)
+    _thread_option = "-nct {threads}"
+
     def __init__(self):
         """Initialize a HaplotypeCaller instance."""
         pass
@@ -371,6 +445,74 @@ class HaplotypeCaller(GATK):
         super().execute(options, out_dir)
 
 
+class HaplotypeCaller_GVCF(HaplotypeCaller):
+
+    # The name of the tool
+    _tool_name = "HaplotypeCaller_GVCF"
+
+    # The options (the index parameters are required for GVCF files)
+    _command = ("-T HaplotypeCaller -R {reference} -I {input} --dbsnp {dbsnp} "
+                "--emitRefConfidence GVCF --variant_index_type LINEAR "
+                "--variant_index_parameter 128000 -o {output} {other_opt}")
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?[sb]am$", )
+    _output_type = (".{}.g.vcf".format(HaplotypeCaller._suffix), )
+
+    # The GVCF files are kept once compressed (they are copied in the GVCF
+    # store, and reused from it)
+    _keep_vcf = True
+
+    def __init__(self):
+        """Initialize a HaplotypeCaller_GVCF instance."""
+        pass
+
+    def execute(self, options, out_dir=None):
+        """Calls a sample (reusing its stored GVCF, if up to date)."""
+        if ("input" not in options) or ("output" not in options):
+            m = "{}: no input or output file".format(self.__class__.__name__)
+            raise ProgramError(m)
+
+        # The GVCF of the sample in the store (if any)
+        gvcf_store = GATK.get_gvcf_store(options)
+        stored_gvcf = None
+        if gvcf_store is not None:
+            stored_gvcf = os.path.join(
+                gvcf_store, "{}.g.vcf".format(options["sample_id"]),
+            )
+
+        # The stored GVCF is reused if it is newer than the BAM file
+        if HaplotypeCaller_GVCF._is_fresh(stored_gvcf, options["input"]):
+            for suffix in ("", ".idx"):
+                GenericTool.link_file(stored_gvcf + suffix,
+                                      options["output"] + suffix)
+            return
+
+        super().execute(options, out_dir)
+
+        # Storing a copy of the GVCF (and of its index, written after it) for
+        # the next runs (the store outlives the run directories, and might be
+        # on another file system)
+        if stored_gvcf is not None:
+            if not os.path.isdir(gvcf_store):
+                os.makedirs(gvcf_store, exist_ok=True)
+            for suffix in ("", ".idx"):
+                GenericTool.copy_file(options["output"] + suffix,
+                                      stored_gvcf + suffix)
+
+    @staticmethod
+    def _is_fresh(gvcf, bam):
+        """Checks if a GVCF (and its index) is newer than a BAM file."""
+        if gvcf is None:
+            return False
+        gvcf_index = "{}.idx".format(gvcf)
+        if not (os.path.isfile(gvcf) and os.path.isfile(gvcf_index)):
+            return False
+        bam_mtime = os.path.getmtime(bam)
+        return ((os.path.getmtime(gvcf) >= bam_mtime)
+                and (os.path.getmtime(gvcf_index) >= bam_mtime))
+
+
 class HaplotypeCaller_Multi(GATK):
 
     # The name of the tool
@@ -403,6 +545,12 @@ class HaplotypeCaller_Multi(GATK):
     # This tool needs multiple input
     _merge_all_inputs = True
 
+    # The targets are already part of the command (since they can be split)
+    _restrict_to_targets = False
+
+    # The number of threads (CPU threads)
+    _thread_option = "-nct {threads}"
+
     def __init__(self):
         """Initialize a HaplotypeCaller instance."""
         pass
@@ -413,8 +561,17 @@ class HaplotypeCaller_Multi(GATK):
         if "inputs" not in options:
             m = "{}: no input files".format(self.__class__.__name__)
             raise ProgramError(m)
-        for filename in options["inputs"]:
-            IndexBam().execute({"input": filename}, out_dir)
+
+        # By default, the (padded) targets of the pipeline are called
+        if "targets" not in options:
+            targets = GenericTool.get_pipeline_options().get("targets", None)
+            if targets is not None:
+                options["targets"] = targets
+        IndexBam.index_all(
+            filenames=options["inputs"],
+            out_dir=out_dir,
+            nb_process=GenericTool.get_tool_nb_proc(self.get_tool_name()),
+        )
 
         # We need to create the list of bam files
         list_filename = os.path.join(out_dir, "input_files.list")
@@ -428,21 +585,86 @@ class HaplotypeCaller_Multi(GATK):
         super().execute(options, out_dir)
 
     def merge_bulk_results(self, final_output, chunk_output, nb_files,
-                           out_dir):
+                           out_dir, tool_options):
         """Merges output files if bulk results present."""
-        # Sorting the files
-        output_files = []
-        for i in range(nb_files):
-            output_files.append(chunk_output.replace("$PGXCHUNKID",
-                                                     str(i + 1)))
+        VcfConcat.concatenate_chunks(final_output, chunk_output, nb_files,
+                                     out_dir, tool_options)
 
-        VcfConcat().execute({"inputs": output_files,
-                             "output": final_output}, out_dir)
 
-        # Removing the output files
-        for filename in output_files:
-            if os.path.isfile(filename):
-                os.remove(filename)
+class GenotypeGVCFs(GATK):
+
+    # The name of the tool
+    _tool_name = "GenotypeGVCFs"
+
+    # The options
+    _command = ("-T GenotypeGVCFs -R {reference} --variant {input} "
+                "--dbsnp {dbsnp} -o {output} {other_opt}")
+
+    # The STDOUT and STDERR
+    _stdout = "{output}.out"
+    _stderr = "{output}.err"
+
+    # The description of the required options
+    _required_options = {"input":     GenericTool.INPUT,
+                         "output":    GenericTool.OUTPUT,
+                         "reference": GenericTool.INPUT,
+                         "other_opt": GenericTool.OPTIONAL,
+                         "dbsnp":     GenericTool.INPUT}
+
+    # The suffix that will be added just before the extension of the output
+    # file
+    _suffix = "genotype_gvcfs"
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?g\.vcf$", )
+    _output_type = (".{}.vcf".format(_suffix), )
+
+    # This tool needs multiple input
+    _merge_all_inputs = True
+
+    # The number of threads (data threads)
+    _thread_option = "-nt {threads}"
+
+    def __init__(self):
+        """Initialize a GenotypeGVCFs instance."""
+        pass
+
+    def execute(self, options, out_dir=None):
+        """Genotypes all the GVCFs (of this run and of the store)."""
+        if "inputs" not in options:
+            m = "{}: no input files".format(self.__class__.__name__)
+            raise ProgramError(m)
+
+        # The GVCFs of this run (by sample)
+        gvcfs = {}
+        for filename in options["inputs"]:
+            sample_id = os.path.basename(filename).split(".")[0]
+            gvcfs[sample_id] = filename
+
+        # The GVCFs of the samples from the previous runs
+        gvcf_store = GATK.get_gvcf_store(options)
+        if (gvcf_store is not None) and os.path.isdir(gvcf_store):
+            for filename in os.listdir(gvcf_store):
+                if not filename.endswith(".g.vcf"):
+                    continue
+                if not os.path.isfile(os.path.join(gvcf_store, filename)):
+                    # A dangling link (from an older version of the store)
+                    continue
+                sample_id = filename[:-len(".g.vcf")]
+                if sample_id not in gvcfs:
+                    gvcfs[sample_id] = os.path.join(gvcf_store, filename)
+
+        # We need to create the list of GVCF files
+        list_filename = os.path.join(out_dir, "gvcf_files.list")
+        with open(list_filename, "w") as o_file:
+            print("\n".join(gvcfs[name] for name in sorted(gvcfs)),
+                  file=o_file)
+
+        # The input file is now the file containing the list
+        options["input"] = list_filename
+
+        # Then we genotype
+        super().execute(options, out_dir)
 
 
 class VariantRecalibrator(GATK):
@@ -484,6 +706,12 @@ class VariantRecalibrator(GATK):
     _input_type = (r"\.(\S+\.)?vcf$", )
     _output_type = (".recal", )
 
+    # The variants are already restricted to the targets
+    _restrict_to_targets = False
+
+    # The number of threads (data threads)
+    _thread_option = "-nt {threads}"
+
     def __init__(self):
         """Initialize a VariantRecalibrator instance."""
         pass
@@ -519,6 +747,12 @@ class ApplyRecalibration(GATK):
     _input_type = (r"\.(\S+\.)?vcf$", )
     _output_type = (".{}.vcf".format(_suffix), )
 
+    # The variants are already restricted to the targets
+    _restrict_to_targets = False
+
+    # The number of threads (data threads)
+    _thread_option = "-nt {threads}"
+
     def __init__(self):
         """Initialize a ApplyRecalibration instance."""
         pass
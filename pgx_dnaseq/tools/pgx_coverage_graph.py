@@ -7,6 +7,7 @@
 # Commons, PO Box 1866, Mountain View, CA 94042, USA.
 
 
+import os
 import re
 from glob import glob
 from shutil import copyfile
@@ -32,6 +33,9 @@ class PGx_CoverageGraph(GenericTool):
     # The executable
     _exec = "coverage_graph.py"
 
+    # The depth is computed by groups of regions in parallel
+    _thread_option = "--nb-process {threads}"
+
     def __init__(self):
         """Initialize a PGx_CoverageGraph instance."""
         pass
@@ -43,7 +47,8 @@ class CoverageGraph(PGx_CoverageGraph):
     _tool_name = "CoverageGraph"
 
     # The options
-    _command = "{other_opt} --out {out_prefix} --bed {targets} --bam {input}"
+    _command = ("{other_opt} {thread_opt} --out {out_prefix} --bed {targets} "
+                "--bam {input}")
 
     # The STDOUT and STDERR
     _stdout = "{output}.out"
@@ -54,6 +59,7 @@ class CoverageGraph(PGx_CoverageGraph):
                          "output":     GenericTool.OUTPUT,
                          "out_prefix": GenericTool.OUTPUT,
                          "targets":    GenericTool.INPUT,
+                         "thread_opt": GenericTool.OPTIONAL,
                          "other_opt":  GenericTool.OPTIONAL}
 
     # The suffix that will be added just before the extension of the output
@@ -111,7 +117,8 @@ class CoverageGraph_Multi(PGx_CoverageGraph):
     _tool_name = "CoverageGraph_Multi"
 
     # The options
-    _command = "{other_opt} --out {out_prefix} --bed {targets} --bam {inputs}"
+    _command = ("{other_opt} {thread_opt} {reuse_opt} --out {out_prefix} "
+                "--bed {targets} --bam {inputs}")
 
     # The STDOUT and STDERR
     _stdout = "{output}.out"
@@ -122,6 +129,8 @@ class CoverageGraph_Multi(PGx_CoverageGraph):
                          "output":     GenericTool.OUTPUT,
                          "out_prefix": GenericTool.OUTPUT,
                          "targets":    GenericTool.INPUT,
+                         "thread_opt": GenericTool.OPTIONAL,
+                         "reuse_opt":  GenericTool.OPTIONAL,
                          "other_opt":  GenericTool.OPTIONAL}
 
     # The suffix that will be added just before the extension of the output
@@ -135,6 +144,9 @@ class CoverageGraph_Multi(PGx_CoverageGraph):
     # This tool needs multiple input
     _merge_all_inputs = True
 
+    # The depth of the samples computed by the CoverageGraph steps is reused
+    _reused_tools = ("CoverageGraph", )
+
     # This tool does not produce usable data...
     _produce_data = False
 
@@ -148,13 +160,29 @@ class CoverageGraph_Multi(PGx_CoverageGraph):
         if "inputs" not in options:
             m = "{}: no input files".format(self.__class__.__name__)
             raise ProgramError(m)
-        for filename in options["inputs"]:
-            IndexBam().execute({"input": filename}, out_dir)
+        IndexBam.index_all(
+            filenames=options["inputs"],
+            out_dir=out_dir,
+            nb_process=GenericTool.get_tool_nb_proc(self.get_tool_name()),
+        )
 
         # Searching for the out prefix
         out_prefix = re.sub("\.png$", "", options["output"])
         options["out_prefix"] = out_prefix
 
+        # The depth files of the CoverageGraph steps (the samples they
+        # contain are not computed again, if they were computed with the same
+        # options)
+        if out_dir is not None:
+            depth_files = sorted(glob(os.path.join(
+                os.path.dirname(os.path.normpath(out_dir)), "*_CoverageGraph",
+                "*.{}.depth".format(self._suffix),
+            )))
+            if depth_files:
+                options["reuse_opt"] = "--reuse-depth {}".format(
+                    " ".join(depth_files),
+                )
+
         # Executing the software
         super().execute(options, out_dir)
 
@@ -0,0 +1,97 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import re
+
+from . import GenericTool
+from .. import ProgramError
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["Sam2BamFlagStat"]
+
+
+class PGx_FlagStat(GenericTool):
+
+    # The version of the tool
+    _version = "0.1"
+
+    # The executable
+    _exec = "sam_flagstat.py"
+
+    def __init__(self):
+        """Initialize a PGx_FlagStat instance."""
+        pass
+
+
+class Sam2BamFlagStat(PGx_FlagStat):
+
+    # The name of the tool
+    _tool_name = "Sam2BamFlagStat"
+
+    # The options
+    _command = ("{samtools_opt} --threads {threads} "
+                "--compression-level {compression_level} --input {input} "
+                "--bam {output} --output {flagstat}")
+
+    # The STDOUT and STDERR
+    _stdout = "{output}.out"
+    _stderr = "{output}.err"
+
+    # The description of the required options
+    _required_options = {"input":             GenericTool.INPUT,
+                         "output":            GenericTool.OUTPUT,
+                         "flagstat":          GenericTool.OUTPUT,
+                         "threads":           GenericTool.REQUIREMENT,
+                         "compression_level": GenericTool.REQUIREMENT,
+                         "samtools_opt":      GenericTool.OPTIONAL}
+
+    # The suffix that will be added just before the extension of the output
+    # file
+    _suffix = "sam2bam"
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?sam$", )
+    _output_type = (".{}.bam".format(_suffix), )
+
+    # The threads are used by samtools in addition to the main one
+    _thread_offset = 1
+
+    def __init__(self):
+        """Initialize a Sam2BamFlagStat instance."""
+        pass
+
+    def execute(self, options, out_dir=None):
+        """Converts a SAM file to BAM while computing the flag statistics."""
+        if "output" not in options:
+            m = "{}: no output file".format(self.__class__.__name__)
+            raise ProgramError(m)
+
+        # The flag statistics are written next to the BAM file (where the
+        # FlagStat step will find them)
+        options["flagstat"] = re.sub(r"\.bam$", ".flagstat",
+                                     options["output"])
+
+        # The BAM is only read once (by the next step), so it is written fast
+        if "compression_level" not in options:
+            options["compression_level"] = 1
+
+        # The samtools executable
+        samtools_bin_dir = GenericTool.get_tool_bin_dir("Sam2Bam")
+        if samtools_bin_dir:
+            options["samtools_opt"] = "--samtools-exec {}".format(
+                samtools_bin_dir,
+            )
+
+        super().execute(options, out_dir)
@@ -0,0 +1,85 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+from . import GenericTool
+from .samtools import IndexBam
+from .. import ProgramError
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["SiteGenotyper"]
+
+
+class PGx_SiteGenotyper(GenericTool):
+
+    # The version of the tool
+    _version = "0.1"
+
+    # The executable
+    _exec = "genotype_sites.py"
+
+    def __init__(self):
+        """Initialize a PGx_SiteGenotyper instance."""
+        pass
+
+
+class SiteGenotyper(PGx_SiteGenotyper):
+
+    # The name of the tool
+    _tool_name = "SiteGenotyper"
+
+    # The options
+    _command = ("{samtools_opt} {other_opt} --sample {sample_id} "
+                "--sites {sites} --input {input} --output {output}")
+
+    # The STDOUT and STDERR
+    _stdout = "{output}.out"
+    _stderr = "{output}.err"
+
+    # The description of the required options
+    _required_options = {"input":        GenericTool.INPUT,
+                         "sites":        GenericTool.INPUT,
+                         "sample_id":    GenericTool.REQUIREMENT,
+                         "samtools_opt": GenericTool.OPTIONAL,
+                         "other_opt":    GenericTool.OPTIONAL,
+                         "output":       GenericTool.OUTPUT}
+
+    # The suffix that will be added just before the extension of the output
+    # file
+    _suffix = "site_genotyper"
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?bam$", )
+    _output_type = (".{}.vcf".format(_suffix), )
+
+    def __init__(self):
+        """Initialize a SiteGenotyper instance."""
+        pass
+
+    def execute(self, options, out_dir=None):
+        """Genotypes the sites (reading their reads through the index)."""
+        # First we index the input file
+        if "input" not in options:
+            m = "{}: no input file".format(self.__class__.__name__)
+            raise ProgramError(m)
+        IndexBam().execute({"input": options["input"]}, out_dir)
+
+        # The samtools executable
+        samtools_bin_dir = GenericTool.get_tool_bin_dir("IndexBam")
+        if samtools_bin_dir:
+            options["samtools_opt"] = "--samtools-exec {}".format(
+                samtools_bin_dir,
+            )
+
+        super().execute(options, out_dir)
@@ -13,6 +13,7 @@ from glob import glob
 
 from .java import JAR
 from . import GenericTool
+from .. import ProgramError
 
 
 __author__ = "Abdellatif Daghrach"
@@ -69,6 +70,19 @@ class SortSam(PicardTools):
         """Initialize a SortSam instance."""
         pass
 
+    def execute(self, options, out_dir=None):
+        """Sorts a BAM file (creating its index if sorted by coordinate)."""
+        # The index is created while writing the BAM file, so that the next
+        # steps don't need to index it again
+        if options.get("sort_order", None) == "coordinate":
+            other_opt = options.get("other_opt", "")
+            if "CREATE_INDEX" not in other_opt:
+                options["other_opt"] = "{} CREATE_INDEX=true".format(
+                    other_opt,
+                ).strip()
+
+        super().execute(options, out_dir)
+
 
 class HsMetrics(PicardTools):
 
@@ -114,21 +128,7 @@ class HsMetrics(PicardTools):
         assert len(filename) == 1
         filename = filename[0]
 
-        result = {}
-        with open(filename, "r") as i_file:
-            # Reading until the header
-            header = i_file.readline()
-            while not header.startswith("## METRICS"):
-                header = i_file.readline()
-
-            # The two rows (header and data)
-            header = i_file.readline().rstrip("\n").split("\t")
-            data = i_file.readline().rstrip("\n").split("\t")
-
-            for name, value in zip(header, data):
-                result[name.lower()] = value
-
-        return result
+        return read_metrics(filename)
 
 
 class InsertSize(PicardTools):
@@ -238,23 +238,24 @@ class AddRG(PicardTools):
     _tool_name = "AddRG"
 
     # The options
-    _command = ("AddOrReplaceReadGroups I={input} O={output} RGDS={rgds} "
-                "RGPL={rgpl} RGPU={rgpu} RGSM={sample_id} RGCN={rgcn} "
-                "RGLB={rglb}")
+    _command = ("AddOrReplaceReadGroups I={input} O={output} "
+                "RGID={read_group_id} RGDS={rgds} RGPL={rgpl} RGPU={rgpu} "
+                "RGSM={sample_id} RGCN={rgcn} RGLB={rglb}")
 
     # The STDOUT and STDERR
     _stdout = "{output}.out"
     _stderr = "{output}.err"
 
     # The description of the required options
-    _required_options = {"input":       GenericTool.INPUT,
-                         "output":      GenericTool.OUTPUT,
-                         "rgds":        GenericTool.REQUIREMENT,
-                         "rgpl":        GenericTool.REQUIREMENT,
-                         "rgpu":        GenericTool.REQUIREMENT,
-                         "sample_id":   GenericTool.REQUIREMENT,
-                         "rgcn":        GenericTool.REQUIREMENT,
-                         "rglb":        GenericTool.REQUIREMENT}
+    _required_options = {"input":         GenericTool.INPUT,
+                         "output":        GenericTool.OUTPUT,
+                         "read_group_id": GenericTool.REQUIREMENT,
+                         "rgds":          GenericTool.REQUIREMENT,
+                         "rgpl":          GenericTool.REQUIREMENT,
+                         "rgpu":          GenericTool.REQUIREMENT,
+                         "sample_id":     GenericTool.REQUIREMENT,
+                         "rgcn":          GenericTool.REQUIREMENT,
+                         "rglb":          GenericTool.REQUIREMENT}
 
     # The suffix that will be added just before the extension of the output
     # file
@@ -268,6 +269,35 @@ class AddRG(PicardTools):
         """Initialize a AddRG instance."""
         pass
 
+    def execute(self, options, out_dir=None):
+        """Adds the read group (which is lane specific if required)."""
+        # The read group might have been added by the aligner, so the BAM
+        # file (and its index) only needs to be linked
+        if options.get("rg_injected", "no") == "yes":
+            if ("input" not in options) or ("output" not in options):
+                m = "{}: no input or output file".format(
+                    self.__class__.__name__,
+                )
+                raise ProgramError(m)
+            GenericTool.link_file(options["input"], options["output"])
+
+            # Both the samtools and Picard index names
+            bam_root = re.compile(r"\.bam$")
+            for index_name, output_index_name in (
+                    ("{}.bai".format(options["input"]),
+                     "{}.bai".format(options["output"])),
+                    (bam_root.sub(".bai", options["input"]),
+                     bam_root.sub(".bai", options["output"]))):
+                if (index_name.endswith(".bai")
+                        and os.path.isfile(index_name)):
+                    GenericTool.link_file(index_name, output_index_name)
+            return
+
+        # The platform unit is lane specific
+        if ("lane" in options) and ("rgpu" in options):
+            options["rgpu"] = "{}.{}".format(options["rgpu"], options["lane"])
+        super().execute(options, out_dir)
+
 
 class MarkDuplicates(PicardTools):
 
@@ -317,18 +347,32 @@ class MarkDuplicates(PicardTools):
         assert len(filename) == 1
         filename = filename[0]
 
-        result = {}
-        with open(filename, "r") as i_file:
-            # Reading until the header
+        return read_metrics(filename)
+
+
+def read_metrics(filename):
+    """Reads the first row of a Picard metrics file.
+
+    :param filename: the name of the metrics file
+
+    :type filename: string
+
+    :returns: the metrics (with lower case names)
+    :rtype: dict
+
+    """
+    result = {}
+    with open(filename, "r") as i_file:
+        # Reading until the header
+        header = i_file.readline()
+        while not header.startswith("## METRICS"):
             header = i_file.readline()
-            while not header.startswith("## METRICS"):
-                header = i_file.readline()
 
-            # The two rows (header and data)
-            header = i_file.readline().rstrip("\n").split("\t")
-            data = i_file.readline().rstrip("\n").split("\t")
+        # The two rows (header and data)
+        header = i_file.readline().rstrip("\n").split("\t")
+        data = i_file.readline().rstrip("\n").split("\t")
 
-            for name, value in zip(header, data):
-                result[name.lower()] = value
+        for name, value in zip(header, data):
+            result[name.lower()] = value
 
-        return result
+    return result
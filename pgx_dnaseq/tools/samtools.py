@@ -7,10 +7,19 @@
 # Commons, PO Box 1866, Mountain View, CA 94042, USA.
 
 
+import os
 import re
+import fcntl
+import hashlib
+from glob import glob
+from shutil import copyfile
+from tempfile import gettempdir
+from concurrent.futures import ThreadPoolExecutor
 
 from . import GenericTool
 from .. import ProgramError
+from .picard_tools import read_metrics
+from .pgx_flagstat import Sam2BamFlagStat
 
 
 __author__ = "Louis-Philippe Lemieux Perreault"
@@ -20,21 +29,52 @@ __license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
 
 
 __all__ = ["Sam2Bam", "IndexBam", "KeepMapped", "FlagStat", "MPILEUP",
-           "MPILEUP_Multi"]
+           "MPILEUP_Multi", "MergeLanes", "MarkDup", "SortBam"]
 
 
 class Samtools(GenericTool):
 
     # The version of the tool
-    _version = "1.1"
+    _version = "1.10"
 
     # The executable
     _exec = "samtools"
 
+    # The default compression level of the BAM files (if any)
+    _compression_level = None
+
+    # The number of threads (used in addition to the main one)
+    _thread_option = "-@ {threads}"
+    _thread_offset = 1
+
     def __init__(self):
         """Initialize a Samtools instance."""
         pass
 
+    def execute(self, options, out_dir=None):
+        """Sets the number of threads and the compression level."""
+        self.set_samtools_options(options)
+        super().execute(options, out_dir)
+
+    def set_samtools_options(self, options):
+        """Sets the number of threads and the compression level (if needed).
+
+        :param options: the tool options (modified in place)
+
+        :type options: dict
+
+        """
+        required_options = self.get_required_options()
+
+        # The number of threads, from the number of processors in the tool
+        # configuration
+        self.set_thread_options(options)
+
+        # The compression level (which can be set for each step)
+        if (("compression_level" in required_options)
+                and ("compression_level" not in options)):
+            options["compression_level"] = self._compression_level
+
 
 class Sam2Bam(Samtools):
 
@@ -42,15 +82,18 @@ class Sam2Bam(Samtools):
     _tool_name = "Sam2Bam"
 
     # The options
-    _command = "view -h -b -S {input}"
+    _command = ("view -h -b -S {thread_opt} "
+                "--output-fmt-option level={compression_level} {input}")
 
     # The STDOUT and STDERR
     _stdout = "{output}"
     _stderr = "{output}.err"
 
     # The description of the required options
-    _required_options = {"input":  GenericTool.INPUT,
-                         "output": GenericTool.OUTPUT}
+    _required_options = {"input":             GenericTool.INPUT,
+                         "output":            GenericTool.OUTPUT,
+                         "thread_opt":        GenericTool.OPTIONAL,
+                         "compression_level": GenericTool.REQUIREMENT}
 
     # The suffix that will be added just before the extension of the output
     # file
@@ -60,10 +103,23 @@ class Sam2Bam(Samtools):
     _input_type = (r"\.(\S+\.)?sam$", )
     _output_type = (".{}.bam".format(_suffix), )
 
+    # The BAM is only read once (by the next step), so it is written fast
+    _compression_level = 1
+
     def __init__(self):
         """Initialize a Sam2Bam instance."""
         pass
 
+    def execute(self, options, out_dir=None):
+        """Converts a SAM file to BAM (optionally computing the flagstat)."""
+        # The flag statistics might be computed while writing the BAM file
+        # (so that the FlagStat step doesn't need to read it again)
+        if options.get("flagstat", "no") == "yes":
+            Sam2BamFlagStat().execute(options, out_dir)
+            return
+
+        super().execute(options, out_dir)
+
 
 class IndexBam(Samtools):
 
@@ -92,23 +148,101 @@ class IndexBam(Samtools):
         """Initialize a IndexBam instance."""
         pass
 
+    def execute(self, options, out_dir=None):
+        """Indexes a BAM file (unless it already has an up to date index)."""
+        if "input" not in options:
+            m = "{}: no input file".format(self.__class__.__name__)
+            raise ProgramError(m)
+
+        # Concurrent steps might need to index the same BAM file, so the
+        # index is created while holding a lock. The lock file is kept (since
+        # deleting it would let another process lock a new file), so it is
+        # created in the temporary directory (and not next to the BAM file)
+        with open(IndexBam.get_lock_name(options["input"]), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if not IndexBam.has_fresh_index(options["input"]):
+                    super().execute(options, out_dir)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def get_lock_name(filename):
+        """Gets the name of the lock file used to index a BAM file."""
+        lock_dir = os.path.join(gettempdir(),
+                                "pgx_dnaseq_locks_{}".format(os.getuid()))
+        os.makedirs(lock_dir, exist_ok=True)
+        checksum = hashlib.md5(os.path.realpath(filename).encode())
+        return os.path.join(lock_dir,
+                            "{}.bai.lock".format(checksum.hexdigest()))
+
+    @staticmethod
+    def has_fresh_index(filename):
+        """Checks if a BAM file has an index more recent than itself.
+
+        Both the samtools (``file.bam.bai``) and the Picard (``file.bai``)
+        index names are checked.
+
+        """
+        index_names = ["{}.bai".format(filename)]
+        if filename.endswith(".bam"):
+            index_names.append(re.sub(r"\.bam$", ".bai", filename))
+
+        bam_mtime = os.path.getmtime(filename)
+        for index_name in index_names:
+            if (os.path.isfile(index_name)
+                    and (os.path.getmtime(index_name) >= bam_mtime)):
+                return True
+
+        return False
+
+    @staticmethod
+    def index_all(filenames, out_dir=None, nb_process=1):
+        """Indexes multiple BAM files (in parallel when running locally)."""
+        # With DRMAA, the jobs are submitted one after the other
+        if not GenericTool.run_locally():
+            nb_process = 1
+
+        with ThreadPoolExecutor(max_workers=max(nb_process, 1)) as executor:
+            jobs = [
+                executor.submit(IndexBam().execute, {"input": filename},
+                                out_dir)
+                for filename in sorted(set(filenames))
+            ]
+
+            # Waiting for all the jobs (raising the first error, if any)
+            for job in jobs:
+                job.result()
+
 
 class KeepMapped(Samtools):
 
     # The name of the tool
     _tool_name = "KeepMapped"
 
-    # The options
-    _command = "view -u -h {mapped_opt} {input}"
+    # The options (the unmapped reads are written to STDOUT)
+    _command = ("view -b -h {thread_opt} "
+                "--output-fmt-option level={compression_level} "
+                "-F 4 -U - -o {output} {input}")
+
+    # The unmapped reads are kept, so they are compressed again (using the
+    # default compression level)
+    _pipe_exec = "samtools"
+    _pipe_command = ("view -b "
+                     "--output-fmt-option level={unmapped_compression_level} "
+                     "-o {unmapped} -")
 
     # The STDOUT and STDERR
-    _stdout = "{output}"
+    _stdout = "{output}.out"
     _stderr = "{output}.err"
 
     # The description of the required options
-    _required_options = {"input":      GenericTool.INPUT,
-                         "output":     GenericTool.OUTPUT,
-                         "mapped_opt": GenericTool.OPTIONAL}
+    _required_options = {"input":                      GenericTool.INPUT,
+                         "output":                     GenericTool.OUTPUT,
+                         "unmapped":                   GenericTool.OUTPUT,
+                         "thread_opt":                 GenericTool.OPTIONAL,
+                         "compression_level":          GenericTool.REQUIREMENT,
+                         "unmapped_compression_level": GenericTool.REQUIREMENT}
 
     # The suffix that will be added just before the extension of the output
     # file
@@ -118,23 +252,100 @@ class KeepMapped(Samtools):
     _input_type = (r"\.(\S+\.)?[sb]am$", )
     _output_type = (".{}.bam".format(_suffix), )
 
+    # The BAM is only read once (by the next step), so it is written fast
+    # (instead of being written uncompressed)
+    _compression_level = 1
+
+    # The default compression level of the (kept) unmapped reads
+    _unmapped_compression_level = 6
+
     def __init__(self):
         """Initialize a KeepMapped instance."""
         pass
 
     def execute(self, options, out_dir=None):
         """Extract mapped reads (keeping the unmapped ones)."""
-        # First, we extract the mapped reads
-        options["mapped_opt"] = "-F 4"
-        super().execute(options, out_dir)
+        if "output" not in options:
+            m = "{}: no output file".format(self.__class__.__name__)
+            raise ProgramError(m)
 
-        # Then, we extract the unmapped reads
-        options["mapped_opt"] = "-f 4"
-        options["output"] = re.sub("{}$".format(self._output_type[0]),
-                                   ".unmapped.bam", options["output"])
+        # The format of the unmapped reads (BAM or FASTQ)
+        unmapped_format = options.get("unmapped_format", "bam")
+        if unmapped_format not in {"bam", "fastq"}:
+            m = "{}: {}: invalid unmapped format".format(
+                self.__class__.__name__, unmapped_format,
+            )
+            raise ProgramError(m)
+
+        # The mapped and unmapped reads are extracted in a single pass
+        prefix = re.sub("{}$".format(self._output_type[0]), "",
+                        options["output"])
+
+        # The unmapped reads might be kept as (compressed) FASTQ, piping them
+        # directly into samtools fastq
+        if unmapped_format == "fastq":
+            for name, suffix in _KeepMappedFastQ.unmapped_suffixes:
+                options[name] = "{}.unmapped{}.fastq.gz".format(prefix,
+                                                                suffix)
+            _KeepMappedFastQ().execute(options, out_dir)
+            return
+
+        options["unmapped"] = "{}.unmapped.bam".format(prefix)
+        options.setdefault("unmapped_compression_level",
+                           self._unmapped_compression_level)
         super().execute(options, out_dir)
 
 
+class _KeepMappedFastQ(Samtools):
+
+    # The name of the tool (it is the KeepMapped step)
+    _tool_name = "KeepMapped"
+
+    # The options (the unmapped reads are written to STDOUT)
+    _command = ("view -b -h {thread_opt} "
+                "--output-fmt-option level={compression_level} "
+                "-F 4 -U - -o {output} {input}")
+
+    # The unmapped reads (paired, singletons and the others)
+    _pipe_exec = "samtools"
+    _pipe_command = ("fastq -c 6 -1 {unmapped_r1} -2 {unmapped_r2} "
+                     "-s {unmapped_single} -0 {unmapped_other} -")
+
+    # The STDOUT and STDERR
+    _stdout = "{output}.out"
+    _stderr = "{output}.err"
+
+    # The description of the required options
+    _required_options = {"input":             GenericTool.INPUT,
+                         "output":            GenericTool.OUTPUT,
+                         "unmapped_r1":       GenericTool.OUTPUT,
+                         "unmapped_r2":       GenericTool.OUTPUT,
+                         "unmapped_single":   GenericTool.OUTPUT,
+                         "unmapped_other":    GenericTool.OUTPUT,
+                         "thread_opt":        GenericTool.OPTIONAL,
+                         "compression_level": GenericTool.REQUIREMENT}
+
+    # The suffix of the unmapped reads FASTQ files (by option)
+    unmapped_suffixes = (("unmapped_r1", "_R1"), ("unmapped_r2", "_R2"),
+                         ("unmapped_single", "_singletons"),
+                         ("unmapped_other", "_other"))
+
+    # The suffix that will be added just before the extension of the output
+    # file
+    _suffix = "mapped"
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?[sb]am$", )
+    _output_type = (".{}.bam".format(_suffix), )
+
+    # The BAM is only read once (by the next step), so it is written fast
+    _compression_level = 1
+
+    def __init__(self):
+        """Initialize a _KeepMappedFastQ instance."""
+        pass
+
+
 class FlagStat(Samtools):
 
     # The name of the tool
@@ -166,6 +377,24 @@ class FlagStat(Samtools):
         """Initialize a FlagStat instance."""
         pass
 
+    def execute(self, options, out_dir=None):
+        """Computes the flag statistics (unless they already were)."""
+        if ("input" not in options) or ("output" not in options):
+            m = "{}: no input or output file".format(self.__class__.__name__)
+            raise ProgramError(m)
+
+        # The flag statistics might have been computed while the BAM file was
+        # written (e.g. by Sam2Bam)
+        precomputed = re.sub(r"\.bam$", ".flagstat", options["input"])
+        if ((precomputed != options["input"])
+                and os.path.isfile(precomputed)
+                and (os.path.getmtime(precomputed)
+                     >= os.path.getmtime(options["input"]))):
+            copyfile(precomputed, options["output"])
+            return
+
+        super().execute(options, out_dir)
+
 
 class MPILEUP(Samtools):
 
@@ -248,8 +477,272 @@ class MPILEUP_Multi(Samtools):
         if "inputs" not in options:
             m = "{}: no input files".format(self.__class__.__name__)
             raise ProgramError(m)
-        for filename in options["inputs"]:
-            IndexBam().execute({"input": filename}, out_dir)
+        IndexBam.index_all(
+            filenames=options["inputs"],
+            out_dir=out_dir,
+            nb_process=GenericTool.get_tool_nb_proc(self.get_tool_name()),
+        )
 
         # Then we create the MPILEUP file from multiple inputs
         super().execute(options, out_dir)
+
+
+class MergeLanes(Samtools):
+
+    # The name of the tool
+    _tool_name = "MergeLanes"
+
+    # The options
+    _command = "merge -f {thread_opt} -l {compression_level} {output} {inputs}"
+
+    # The STDOUT and STDERR
+    _stdout = "{output}.out"
+    _stderr = "{output}.err"
+
+    # The description of the required options
+    _required_options = {"inputs":            GenericTool.INPUTS,
+                         "output":            GenericTool.OUTPUT,
+                         "thread_opt":        GenericTool.OPTIONAL,
+                         "compression_level": GenericTool.REQUIREMENT}
+
+    # The suffix that will be added just before the extension of the output
+    # file
+    _suffix = "lanes"
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?bam$", )
+    _output_type = (".{}.bam".format(_suffix), )
+
+    # This tool merges the (sorted) BAM files of each lanes of a sample
+    _merge_lanes = True
+
+    # The default zlib compression level
+    _compression_level = 6
+
+    def __init__(self):
+        """Initialize a MergeLanes instance."""
+        pass
+
+
+class MarkDup(Samtools):
+
+    # The name of the tool
+    _tool_name = "MarkDup"
+
+    # The options (the reads are grouped by name, to add the mate
+    # information...)
+    _command = "collate -O -u {input} {collate_tmp_prefix}"
+
+    # ... and sorted back by coordinate before marking the duplicates (the
+    # intermediate BAM are streamed uncompressed between the commands)
+    _pipe_exec = "samtools"
+    _pipe_command = (
+        "fixmate -m -O bam --output-fmt-option level=0 - -",
+        "sort {thread_opt} -m {memory_per_thread} -T {sort_tmp_prefix} -l 0 "
+        "-O bam -",
+        "markdup {thread_opt} -s -f {stats} -d {optical_distance} "
+        "--output-fmt-option level={compression_level} {other_opt} - "
+        "{output}",
+    )
+
+    # The STDOUT and STDERR
+    _stdout = "{output}.out"
+    _stderr = "{output}.err"
+
+    # The description of the required options
+    _required_options = {"input":              GenericTool.INPUT,
+                         "output":             GenericTool.OUTPUT,
+                         "stats":              GenericTool.OUTPUT,
+                         "optical_distance":   GenericTool.REQUIREMENT,
+                         "memory_per_thread":  GenericTool.REQUIREMENT,
+                         "collate_tmp_prefix": GenericTool.REQUIREMENT,
+                         "sort_tmp_prefix":    GenericTool.REQUIREMENT,
+                         "thread_opt":         GenericTool.OPTIONAL,
+                         "compression_level":  GenericTool.REQUIREMENT,
+                         "other_opt":          GenericTool.OPTIONAL}
+
+    # The suffix that will be added just before the extension of the output
+    # file
+    _suffix = "dedup"
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?bam$", )
+    _output_type = (".{}.bam".format(_suffix), )
+
+    # The default zlib compression level
+    _compression_level = 6
+
+    def __init__(self):
+        """Initialize a MarkDup instance."""
+        pass
+
+    def execute(self, options, out_dir=None):
+        """Mark duplicates (piping collate, fixmate, sort and markdup)."""
+        if ("input" not in options) or ("output" not in options):
+            m = "{}: no input or output file".format(self.__class__.__name__)
+            raise ProgramError(m)
+
+        # The temporary files go in the local directory of the node running
+        # the job (unless specified)
+        root = re.sub(r"\.bam$", "", options["output"])
+        tmp_dir = options.get("tmp_dir", GenericTool.TMP_DIR)
+        for name in ("collate", "sort"):
+            options["{}_tmp_prefix".format(name)] = os.path.join(
+                tmp_dir,
+                "{}.{}_tmp".format(os.path.basename(root), name),
+            )
+
+        # The memory per sorting thread (samtools' default)
+        if "memory_per_thread" not in options:
+            options["memory_per_thread"] = "768M"
+
+        # Marking the duplicates (the optical duplicate distance is the same
+        # as Picard's default)
+        options["stats"] = "{}.markdup_stats".format(root)
+        if "optical_distance" not in options:
+            options["optical_distance"] = 100
+        super().execute(options, out_dir)
+
+        # Writing the metrics (as Picard's MarkDuplicates would)
+        MarkDup._write_metrics(
+            stats=options["stats"],
+            metrics=re.sub(r"\.[sb]am$", ".dedup", options["output"]),
+            library=options.get("rglb", options.get("sample_id", "Unknown")),
+        )
+
+    @staticmethod
+    def _write_metrics(stats, metrics, library):
+        """Writes the samtools markdup statistics as Picard's metrics."""
+        # Reading the statistics
+        values = {}
+        with open(stats, "r") as i_file:
+            for line in i_file:
+                if ":" not in line:
+                    continue
+                name, value = line.split(":", 1)
+                values[name.strip()] = value.strip()
+
+        # Picard counts the pairs, while samtools counts the reads
+        try:
+            nb_single = int(values["SINGLE"])
+            nb_paired = int(values["PAIRED"])
+            nb_single_dup = int(values["DUPLICATE SINGLE"])
+            nb_paired_dup = int(values["DUPLICATE PAIR"])
+            nb_optical_dup = int(values["DUPLICATE PAIR OPTICAL"])
+        except KeyError as e:
+            m = "{}: missing statistic {}".format(stats, e)
+            raise ProgramError(m)
+
+        percent = 0
+        if nb_single + nb_paired > 0:
+            percent = (nb_single_dup + nb_paired_dup) / (nb_single + nb_paired)
+
+        # The metrics
+        metrics_values = [
+            ("LIBRARY", library),
+            ("UNPAIRED_READS_EXAMINED", nb_single),
+            ("READ_PAIRS_EXAMINED", nb_paired // 2),
+            ("UNPAIRED_READ_DUPLICATES", nb_single_dup),
+            ("READ_PAIR_DUPLICATES", nb_paired_dup // 2),
+            ("READ_PAIR_OPTICAL_DUPLICATES", nb_optical_dup // 2),
+            ("PERCENT_DUPLICATION", "{:.6f}".format(percent)),
+            ("ESTIMATED_LIBRARY_SIZE",
+             values.get("ESTIMATED_LIBRARY_SIZE", "")),
+        ]
+
+        with open(metrics, "w") as o_file:
+            print("## pgx_dnaseq.tools.samtools.MarkDup", file=o_file)
+            print("# samtools markdup (statistics from {})".format(stats),
+                  file=o_file)
+            print(file=o_file)
+            print("## METRICS CLASS\tpicard.sam.DuplicationMetrics",
+                  file=o_file)
+            print(*[name for name, value in metrics_values], sep="\t",
+                  file=o_file)
+            print(*[value for name, value in metrics_values], sep="\t",
+                  file=o_file)
+
+    def read_report(self, prefix):
+        """Reads a MarkDup report file."""
+        # Getting the report file name
+        filename = glob("{}*.{}".format(prefix, self._suffix))
+        assert len(filename) == 1
+        filename = filename[0]
+
+        return read_metrics(filename)
+
+
+class SortBam(Samtools):
+
+    # The name of the tool
+    _tool_name = "SortBam"
+
+    # The options
+    _command = ("sort {thread_opt} -m {memory_per_thread} -T {tmp_prefix} "
+                "-l {compression_level} {sort_opt} -o {output_opt} {input}")
+
+    # The STDOUT and STDERR
+    _stdout = "{output}.out"
+    _stderr = "{output}.err"
+
+    # The description of the required options
+    _required_options = {"input":             GenericTool.INPUT,
+                         "output":            GenericTool.OUTPUT,
+                         "output_opt":        GenericTool.REQUIREMENT,
+                         "memory_per_thread": GenericTool.REQUIREMENT,
+                         "tmp_prefix":        GenericTool.REQUIREMENT,
+                         "thread_opt":        GenericTool.OPTIONAL,
+                         "compression_level": GenericTool.REQUIREMENT,
+                         "sort_opt":          GenericTool.OPTIONAL}
+
+    # The suffix that will be added just before the extension of the output
+    # file
+    _suffix = "sorted"
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?[sb]am$", )
+    _output_type = (".{}.bam".format(_suffix), )
+
+    # The default zlib compression level
+    _compression_level = 6
+
+    def __init__(self):
+        """Initialize a SortBam instance."""
+        pass
+
+    def execute(self, options, out_dir=None):
+        """Sorts a BAM file (writing its index at the same time)."""
+        if "output" not in options:
+            m = "{}: no output file".format(self.__class__.__name__)
+            raise ProgramError(m)
+
+        # The sort order (coordinate, as Picard's SortSam, or queryname)
+        sort_order = options.get("sort_order", "coordinate")
+        if sort_order not in {"coordinate", "queryname"}:
+            m = "{}: {}: invalid sort order".format(self.__class__.__name__,
+                                                    sort_order)
+            raise ProgramError(m)
+
+        # When sorted by coordinate, the index is written with the BAM file
+        options["output_opt"] = options["output"]
+        if sort_order == "coordinate":
+            options["output_opt"] = "{0}##idx##{0}.bai".format(
+                options["output"],
+            )
+            options["sort_opt"] = "--write-index"
+        else:
+            options["sort_opt"] = "-n"
+
+        # The memory per thread (samtools' default)
+        if "memory_per_thread" not in options:
+            options["memory_per_thread"] = "768M"
+
+        # The temporary files go in the local directory of the node running
+        # the job (unless specified)
+        tmp_dir = options.get("tmp_dir", GenericTool.TMP_DIR)
+        options["tmp_prefix"] = os.path.join(
+            tmp_dir,
+            "{}.sort_tmp".format(os.path.basename(options["output"])),
+        )
+
+        super().execute(options, out_dir)
@@ -19,7 +19,7 @@ __copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
 __license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
 
 
-__all__ = ["VcfConcat", "VcfSort"]
+__all__ = ["VcfConcat", "VcfSort", "VcfSortByReference"]
 
 
 class Vcftools(GenericTool):
@@ -67,6 +67,28 @@ class VcfConcat(Vcftools):
         """Initialize a VcfConcat instance."""
         pass
 
+    @staticmethod
+    def concatenate_chunks(final_output, chunk_output, nb_files, out_dir,
+                           tool_options):
+        """Concatenates the VCF chunks of a bulk job (in order).
+
+        The merged VCF file is compressed (and indexed) by the concatenation
+        job, following the options of the bulk job (``bgzip_vcf`` and
+        ``keep_vcf``).
+
+        """
+        concat_options = {
+            name: tool_options[name] for name in ("bgzip_vcf", "keep_vcf")
+            if name in tool_options
+        }
+
+        def concatenate(filenames, output):
+            concat_options.update({"inputs": filenames, "output": output})
+            VcfConcat().execute(dict(concat_options), out_dir)
+
+        GenericTool.merge_chunks(final_output, chunk_output, nb_files,
+                                 concatenate)
+
 
 class VcfSort(Vcftools):
 
@@ -99,3 +121,51 @@ class VcfSort(Vcftools):
     def __init__(self):
         """Initialize a VcfSort instance."""
         pass
+
+
+class VcfSortByReference(Vcftools):
+
+    # The name of the tool
+    _tool_name = "VcfSortByReference"
+
+    # The version and the executable are different (it is part of pgx_dnaseq)
+    _version = "0.1"
+    _exec = "sort_vcf.py"
+
+    # The options
+    _command = "--input {input} --output {output} {reference_opt} {other_opt}"
+
+    # The STDOUT and STDERR
+    _stdout = "{output}.out"
+    _stderr = "{output}.err"
+
+    # The description of the required options
+    _required_options = {"input":         GenericTool.INPUT,
+                         "reference_opt": GenericTool.OPTIONAL,
+                         "other_opt":     GenericTool.OPTIONAL,
+                         "output":        GenericTool.OUTPUT}
+
+    # The suffix that will be added just before the extension of the output
+    # file
+    _suffix = "vcf_sort"
+
+    # The input and output type
+    _input_type = (r"\.(\S+\.)?vcf$", )
+    _output_type = (".{}.vcf".format(_suffix), )
+
+    def __init__(self):
+        """Initialize a VcfSortByReference instance."""
+        pass
+
+    def execute(self, options, out_dir=None):
+        """Sorts a VCF file (using the contig order of the reference)."""
+        # The reference (of the step, or of the pipeline) gives the contig
+        # order (otherwise, the contigs of the VCF header are used)
+        reference = options.get(
+            "reference",
+            GenericTool.get_pipeline_options().get("reference", None),
+        )
+        if reference is not None:
+            options["reference_opt"] = "--reference {}".format(reference)
+
+        super().execute(options, out_dir)
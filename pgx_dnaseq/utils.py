@@ -0,0 +1,61 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["atomic_output"]
+
+
+# The umask of the process (it can only be read by changing it, which is not
+# thread safe, so it is read once)
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+@contextmanager
+def atomic_output(filename, mode="wb", suffix=""):
+    """Writes a file using a temporary file, which then replaces it.
+
+    :param filename: the name of the file
+    :param mode: the mode of the file (``w`` or ``wb``)
+    :param suffix: the suffix of the temporary file
+
+    :type filename: string
+    :type mode: string
+    :type suffix: string
+
+    :returns: the temporary file (in the same directory)
+    :rtype: file
+
+    The temporary file gets the default permissions (``NamedTemporaryFile``
+    only gives them to the user), and it replaces the file once written, so
+    that other processes never read a partial file. It is removed if there
+    is an error.
+
+    """
+    with NamedTemporaryFile(mode=mode, dir=os.path.dirname(filename) or ".",
+                            suffix=suffix, delete=False) as o_file:
+        try:
+            yield o_file
+        except BaseException:
+            o_file.close()
+            os.remove(o_file.name)
+            raise
+
+    os.chmod(o_file.name, 0o666 & ~_umask)
+    os.replace(o_file.name, filename)
@@ -0,0 +1,247 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import re
+import sys
+import gzip
+import heapq
+from tempfile import TemporaryFile
+
+from . import ProgramError
+from .bgzf import BgzfWriter
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+__all__ = ["read_contig_order", "sort_vcf"]
+
+
+# The contig lines of a VCF header
+_contig_re = re.compile(rb"^##contig=<.*?ID=([^,>]+)")
+
+
+def read_contig_order(reference=None, header=None):
+    """Reads the order of the contigs.
+
+    :param reference: the reference (FASTA) file
+    :param header: the header lines of a VCF file (bytes)
+
+    :type reference: string
+    :type header: list
+
+    :returns: the contigs in the reference order
+    :rtype: list
+
+    The order is read from the reference index (``.fai``), from the sequence
+    dictionary (``.dict``), or from the ``##contig`` lines of the header (in
+    that order).
+
+    """
+    if reference is not None:
+        # The reference index
+        fai = "{}.fai".format(reference)
+        if os.path.isfile(fai):
+            with open(fai, "r") as i_file:
+                return [line.split("\t")[0] for line in i_file if line.strip()]
+
+        # The sequence dictionary (reference.dict)
+        seq_dict = "{}.dict".format(os.path.splitext(reference)[0])
+        if os.path.isfile(seq_dict):
+            contigs = []
+            with open(seq_dict, "r") as i_file:
+                for line in i_file:
+                    row = line.rstrip("\n").split("\t")
+                    if row[0] != "@SQ":
+                        continue
+                    for field in row[1:]:
+                        if field.startswith("SN:"):
+                            contigs.append(field[3:])
+            return contigs
+
+        m = "{}: no index (.fai) or dictionary (.dict)".format(reference)
+        raise ProgramError(m)
+
+    # The header
+    contigs = []
+    for line in header or []:
+        match = _contig_re.match(line)
+        if match is not None:
+            contigs.append(match.group(1).decode())
+    return contigs
+
+
+def sort_vcf(filename, output, reference=None, max_records=500000,
+             tmp_dir=None, bgzip=False, compress_level=6):
+    """Sorts a VCF file using the contig order of the reference.
+
+    :param filename: the name of the VCF file ('-' for STDIN)
+    :param output: the name of the sorted VCF file ('-' for STDOUT)
+    :param reference: the reference (FASTA) file (the contig order is read
+                      from the VCF header if None)
+    :param max_records: the maximal number of records kept in memory
+    :param tmp_dir: the directory for the temporary files
+    :param bgzip: whether to write a BGZF compressed file
+    :param compress_level: the compression level (if bgzip is True)
+
+    :type filename: string
+    :type output: string
+    :type reference: string
+    :type max_records: int
+    :type tmp_dir: string
+    :type bgzip: bool
+    :type compress_level: int
+
+    :returns: the number of records
+    :rtype: int
+
+    The records are read by runs of at most ``max_records`` (the memory
+    usage is bounded by this number of records, not by their size). Each run
+    is sorted and written in a temporary file, and the runs are then merged.
+    Contigs absent from the reference are written after the others, in their
+    order of appearance. The ``##contig`` lines of the header are written in
+    the same order (since GATK checks the order of the records against them).
+
+    """
+    i_file = _open_vcf(filename)
+    runs = []
+    try:
+        # The header
+        header = []
+        line = i_file.readline()
+        while line.startswith(b"#"):
+            header.append(line)
+            line = i_file.readline()
+
+        # The rank of each contig
+        ranks = {
+            contig.encode(): i
+            for i, contig in enumerate(read_contig_order(reference, header))
+        }
+        if reference is not None and len(ranks) == 0:
+            m = "{}: no contig".format(reference)
+            raise ProgramError(m)
+
+        # Reading the records by runs
+        records = []
+        while line:
+            if line.strip():
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                records.append((_record_key(line, ranks), line))
+                if len(records) >= max_records:
+                    runs.append(_write_run(records, tmp_dir))
+                    records = []
+            line = i_file.readline()
+
+    finally:
+        if i_file is not sys.stdin.buffer:
+            i_file.close()
+
+    # The sorted records (the last run is kept in memory)
+    records.sort(key=lambda record: record[0])
+    if runs:
+        sorted_records = heapq.merge(
+            *[_read_run(run, i, ranks) for i, run in enumerate(runs)],
+            ((key, len(runs), line) for key, line in records)
+        )
+    else:
+        sorted_records = ((key, 0, line) for key, line in records)
+
+    # Writing the sorted records
+    o_file = None
+    if bgzip:
+        o_file = BgzfWriter(output, compress_level)
+    elif output == "-":
+        o_file = sys.stdout.buffer
+    else:
+        o_file = open(output, "wb")
+
+    nb_records = 0
+    try:
+        for line in _sort_contig_lines(header, ranks):
+            o_file.write(line)
+
+        for key, run_id, line in sorted_records:
+            o_file.write(line)
+            nb_records += 1
+
+    finally:
+        if o_file is not sys.stdout.buffer:
+            o_file.close()
+        for run in runs:
+            run.close()
+
+    return nb_records
+
+
+def _open_vcf(filename):
+    """Opens a (compressed) VCF file (in binary mode)."""
+    if filename == "-":
+        return sys.stdin.buffer
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rb")
+    return open(filename, "rb")
+
+
+def _sort_contig_lines(header, ranks):
+    """Sorts the contig lines of a header (where the first one was)."""
+    contig_lines = []
+    first = None
+    for i, line in enumerate(header):
+        match = _contig_re.match(line)
+        if match is not None:
+            contig_lines.append((ranks.get(match.group(1), len(ranks)), line))
+            if first is None:
+                first = i
+    if first is None:
+        return header
+
+    # The contigs absent from the reference keep their order (the sort is
+    # stable)
+    contig_lines.sort(key=lambda contig_line: contig_line[0])
+    other_lines = [line for line in header if _contig_re.match(line) is None]
+    return (other_lines[:first] + [line for rank, line in contig_lines] +
+            other_lines[first:])
+
+
+def _record_key(line, ranks):
+    """Gets the sort key of a record (the contig rank and the position)."""
+    fields = line.split(b"\t", 2)
+    try:
+        contig, pos = fields[0], int(fields[1])
+    except (IndexError, ValueError):
+        m = "invalid VCF record: {}".format(line[:80].decode(errors="ignore"))
+        raise ProgramError(m)
+
+    # The contigs absent from the reference are added at the end
+    if contig not in ranks:
+        ranks[contig] = len(ranks)
+
+    return ranks[contig], pos
+
+
+def _write_run(records, tmp_dir):
+    """Sorts records and writes them in a temporary file."""
+    records.sort(key=lambda record: record[0])
+    run = TemporaryFile(mode="w+b", dir=tmp_dir)
+    for key, line in records:
+        run.write(line)
+    run.seek(0)
+    return run
+
+
+def _read_run(run, run_id, ranks):
+    """Reads the records of a sorted run (with their key)."""
+    for line in run:
+        yield _record_key(line, ranks), run_id, line
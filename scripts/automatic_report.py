@@ -104,8 +104,9 @@ def gather_samples(filename):
 
             for sample in samples:
                 if sample.endswith(".fastq") or sample.endswith(".fastq.gz"):
-                    all_samples.add(re.search(r"(^\w+)_R[12]",
-                                              sample).group(1))
+                    # The lane (if any) is not part of the sample name
+                    sample = re.search(r"(^\w+)_R[12]", sample).group(1)
+                    all_samples.add(re.sub(r"_L\d{3}$", "", sample))
 
                 else:
                     all_samples.add(re.search(r"\w+", sample).group())
@@ -253,9 +254,9 @@ def construct_report_content(samples, pipeline_steps, jinja2_env):
                 final_data = gather_values(sample_data, req_values, final_data,
                                            sample, prefix)
 
-        if step.get_tool_name() == "MarkDuplicates":
+        if step.get_tool_name() in {"MarkDuplicates", "MarkDup"}:
             available_steps.add("MarkDuplicates")
-            logging.info("Collecting MarkDuplicates")
+            logging.info("Collecting {}".format(step.get_tool_name()))
             for sample in samples:
                 sample_data = step.read_report(os.path.join(prefix, sample))
 
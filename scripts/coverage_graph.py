@@ -12,14 +12,20 @@ import os
 import re
 import sys
 import argparse
-from csv import QUOTE_NONE
+from itertools import repeat
 from subprocess import Popen, PIPE
+from tempfile import TemporaryDirectory
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
 import matplotlib as mpl
 
 from pgx_dnaseq import __version__
+from pgx_dnaseq import ProgramError as PGxProgramError
+from pgx_dnaseq.bam import BamFile, find_bai
+from pgx_dnaseq.bed import write_bed, file_checksum, get_bed_index
+from pgx_dnaseq.depth import write_depth, read_depth, merge_depth
 
 
 __author__ = "Louis-Philippe Lemieux Perreault"
@@ -33,6 +39,14 @@ __email__ = "louis-philippe.lemieux.perreault@statgen.org"
 __status__ = "Development"
 
 
+# The number of positions read at once from samtools depth
+_chunk_size = 100000
+
+# The number of region groups per process (smaller groups balance the load
+# between the processes)
+_groups_per_process = 4
+
+
 def main():
     """The main function."""
     # The parser object
@@ -45,22 +59,70 @@ def main():
         args = parse_args(parser)
         check_args(args)
 
-        # Reading the bed file to get the number of nucleotide that should be
-        # covered
-        nb_bases = read_bed(args.bed)
-
-        # Getting the depth
-        sample_depth = None
-        sample_list = None
-        if args.bam is not None:
-            sample_depth = compute_sample_depth(args)
-            sample_list = list(sample_depth.columns)
-        else:
-            sample_depth = read_depth(args.depth_file)
-            sample_list = sample_depth.keys()
+        try:
+            # Getting the depth histograms (for each combination of
+            # thresholds)
+            if args.bam is not None:
+                # Reading the bed file to get the (merged) targeted regions
+                # and the number of nucleotide that should be covered (the
+                # index is cached in the output directory)
+                bed_index = get_bed_index(
+                    args.bed, cache_dir=os.path.dirname(args.out) or ".",
+                )
+                if bed_index.nb_overlaps > 0:
+                    print("WARNING: {}: {} overlapping regions were "
+                          "merged".format(args.bed, bed_index.nb_overlaps),
+                          file=sys.stderr)
+                nb_bases = bed_index.nb_bases
+
+                # The combinations of thresholds
+                thresholds = [(mapq, baseq) for mapq in args.mapq
+                              for baseq in args.baseq]
+                bed_checksum = file_checksum(args.bed)
+
+                # The histograms of the samples found in the reused depth
+                # files
+                samples = args.bam
+                histograms = np.zeros(
+                    (len(thresholds), len(samples), args.bam_depth + 1),
+                    dtype=np.int64,
+                )
+                reused = {}
+                if args.reuse_depth is not None:
+                    reused = read_reused_depth(args.reuse_depth, samples,
+                                               thresholds, bed_checksum,
+                                               args.bam_depth)
+                for i, sample in enumerate(samples):
+                    if sample in reused:
+                        histograms[:, i] = reused[sample]
+
+                # Computing the histograms of the other samples
+                missing = [i for i, sample in enumerate(samples)
+                           if sample not in reused]
+                if missing:
+                    histograms[:, missing] = compute_sample_depth(
+                        [samples[i] for i in missing], thresholds,
+                        bed_index.regions(), args,
+                    )
+
+                # Saving the histograms
+                write_depth("{}.depth".format(args.out), histograms, samples,
+                            thresholds, nb_bases, bed_checksum,
+                            args.bam_depth)
+
+            else:
+                # Reading the pre-computed histograms
+                metadata, histograms = merge_depth(args.depth_file)
+                check_depth_metadata(metadata, args)
+                nb_bases = metadata["nb_bases"]
+                thresholds = metadata["thresholds"]
+                samples = metadata["samples"]
+
+        except PGxProgramError as e:
+            raise ProgramError(e.message)
 
         # Plots the graph
-        plot_depth(sample_depth, nb_bases, sample_list, args)
+        plot_depth(thresholds, samples, histograms, nb_bases, args)
 
     except KeyboardInterrupt:
         print("Cancelled by user", sys.stderr)
@@ -70,139 +132,315 @@ def main():
         parser.error(e.message)
 
 
-def read_bed(filename):
-    """Reads a BED file and computes the number of nucleotide included."""
-    # Reading the BED file
-    bed_file = pd.read_csv(filename, sep="\t", names=["chr", "start", "end"],
-                           usecols=range(3)).sort(columns=["chr", "start",
-                                                           "end"])
-
-    # Checking that the file is merged
-    for i in range(1, len(bed_file)):
-        if bed_file.chr.iloc[i] != bed_file.chr.iloc[i-1]:
-            continue
-        if bed_file.start.iloc[i] + 1 <= bed_file.end.iloc[i-1]:
-            m = "{}: regions should be merged".format(filename)
-            raise ProgramError(m)
-
-    # Computing the length of the regions (no need to add 1, since the starting
-    # position is in 0 format)
-    bed_file["length"] = bed_file.end - bed_file.start
-
-    # Returns the number of nucleotides in the targeted regions
-    return bed_file.length.sum()
-
-
-def plot_depth(depth, nb_bases, samples, options):
+def plot_depth(thresholds, samples, histograms, nb_bases, options):
+    """Plots the depth for all samples (one facet per thresholds)."""
     # Importing
     mpl.use("Agg")
     import matplotlib.pyplot as plt
     plt.ioff()
 
-    """Plots the depth for all samples."""
-    # The figure and axe
-    fig, ax = plt.subplots(1, 1, figsize=(14, 8.5))
-
-    # Adding the grids
-    ax.grid(color='#8E8E8E', linestyle=':', linewidth=1, which="major")
-    ax.set_axisbelow(True)
-
-    # The labels
-    ax.set_title(("Sample Depth (MapQ={mapq}, BaseQ={baseq}, "
-                  "MaxDepth={bam_depth})".format(**vars(options))))
-    ax.set_xlabel("Read Depth")
-    ax.set_ylabel("Base Proportion")
-
-    # Setting the X limit
-    if options.max_depth is not None:
-        ax.set_xlim(0, options.max_depth)
-
-    # Plotting for each sample
-    for sample in samples:
-        # Do we need to compute the cumulative values?
-        cumul = None
-        if options.depth_file is None:
-            # Computing the bins and the cumulative
-            bins = np.bincount(depth[sample])
-            cumul = np.array([np.sum(bins[i:]) for i in range(len(bins))],
-                             dtype=int) / nb_bases
-        else:
-            # Getting the pre-computed cumulative values
-            cumul = depth[sample]
+    # The figure and the axes (one per combination of thresholds)
+    nb_facets = len(thresholds)
+    nb_cols = min(nb_facets, 2)
+    nb_rows = -(-nb_facets // nb_cols)
+    fig, axes = plt.subplots(nb_rows, nb_cols,
+                             figsize=(14 * nb_cols, 8.5 * nb_rows),
+                             sharex=True, sharey=True, squeeze=False)
+
+    for ax, (mapq, baseq), threshold_histograms in zip(axes.ravel(),
+                                                       thresholds,
+                                                       histograms):
+        # Adding the grids
+        ax.grid(color='#8E8E8E', linestyle=':', linewidth=1, which="major")
+        ax.set_axisbelow(True)
+
+        # The labels
+        ax.set_title(("Sample Depth (MapQ={}, BaseQ={}, "
+                      "MaxDepth={})".format(mapq, baseq,
+                                            histograms.shape[2] - 1)))
+        ax.set_xlabel("Read Depth")
+        ax.set_ylabel("Base Proportion")
+
+        # Setting the X limit
+        if options.max_depth is not None:
+            ax.set_xlim(0, options.max_depth)
+
+        # Plotting for each sample
+        for sample, values in zip(samples, threshold_histograms):
+            # The reverse cumulative of the histogram (up to the highest
+            # observed depth)
+            observed = np.flatnonzero(values)
+            bins = values[:observed[-1] + 1 if len(observed) else 1]
+            cumul = np.cumsum(bins[::-1])[::-1] / nb_bases
+
+            # Plotting
+            ax.plot(np.arange(len(cumul)), cumul, lw=2,
+                    label=os.path.basename(sample.split(".")[0]))
+
+        # Plotting the legend
+        ax.legend(loc="best", fancybox=True, ncol=3, shadow=True)
+
+    # Removing the unused axes
+    for ax in axes.ravel()[nb_facets:]:
+        ax.set_visible(False)
+
+    fig.savefig("{}.png".format(options.out), bbox_inches="tight", dpi=300)
+    plt.close(fig)
 
-        # Plotting
-        plt.plot(np.arange(len(cumul)), cumul, lw=2,
-                 label=os.path.basename(sample.split(".")[0]))
 
-        # Saving the cumulative data (if required)
-        if options.depth_file is None:
-            with open("{}.txt".format(options.out), "w") as o_file:
-                print(sample, file=o_file)
-                print(*cumul, sep=" ", file=o_file)
+def check_depth_metadata(metadata, options):
+    """Checks that the depth files were computed on the same targets."""
+    # The BED file is not required to plot the depth files, but it needs to be
+    # the same if provided
+    if options.bed is not None:
+        if file_checksum(options.bed) != metadata["bed_checksum"]:
+            m = "{}: not the BED file of the depth files".format(options.bed)
+            raise ProgramError(m)
 
-    # Plotting the legend
-    ax.legend(loc="best", fancybox=True, ncol=3, shadow=True)
+    # Warning for the samples seen more than once
+    seen = set()
+    for sample in metadata["samples"]:
+        if sample in seen:
+            print("WARNING: {}: seen in more than one depth "
+                  "file".format(sample), file=sys.stderr)
+        seen.add(sample)
 
-    fig.savefig("{}.png".format(options.out), bbox_inches="tight", dpi=300)
-    plt.close(fig)
 
+def read_reused_depth(filenames, bams, thresholds, bed_checksum, max_depth):
+    """Reads the histograms of BAM files from previously computed depth files.
 
-def read_depth(filenames):
-    """Reads the depth from pre-computed files (from this script)."""
-    # The map containing the values
-    depths = {}
+    Only the depth files computed with the same targets, thresholds and
+    maximal depth are used, and only for the BAM files that were not modified
+    since. The histograms (thresholds x depths) are returned by BAM file.
 
-    # Each file contains the following two lines:
-    #     1- The name of the original BAM file
-    #     2- A list of cumulative values (float) separated by spaces
+    """
+    # The BAM files (the depth files might have been computed from another
+    # directory)
+    bams = {os.path.realpath(bam): bam for bam in bams}
+
+    reused = {}
     for filename in filenames:
-        with open(filename, "r") as i_file:
-            bam_file = i_file.readline().rstrip("\n")
-            cumul_values = np.array(i_file.readline().rstrip("\n").split(" "),
-                                    dtype=float)
-            if bam_file in depths:
-                print("WARNING: {}: already seen... "
-                      "overwriting".format(bam_file), file=sys.stderr)
+        metadata, histograms = read_depth(filename)
+        if ((metadata["bed_checksum"] != bed_checksum)
+                or (metadata["thresholds"] != thresholds)
+                or (metadata["max_depth"] != max_depth)):
+            print("WARNING: {}: computed with other options... "
+                  "skipping".format(filename), file=sys.stderr)
+            continue
 
-            # Saving the depth
-            depths[bam_file] = cumul_values
+        for i, sample in enumerate(metadata["samples"]):
+            bam = bams.get(os.path.realpath(sample))
+            if (bam is None) or (bam in reused):
+                continue
+            if os.path.getmtime(bam) > os.path.getmtime(filename):
+                continue
+            reused[bam] = np.array(histograms[:, i])
 
-    # Returning the cumulative values
-    return depths
+    return reused
 
 
-def compute_sample_depth(options):
-    """Computes the sample depth using samtools (and extract relevant info."""
-    # The number of sample
-    samples = options.bam
-    nb_samples = len(samples)
+def compute_sample_depth(bams, thresholds, regions, options):
+    """Computes the depth histograms of each sample using samtools.
+
+    The histograms (thresholds x samples x depths) are returned.
 
-    # The command
+    The depth of every targeted position (``samtools depth -a``) is read by
+    chunks, and each chunk is added to the histograms, so that the memory
+    only depends on the maximal depth and on the number of samples. Depths
+    higher than the maximal depth (``-d``) are counted as the maximal depth.
+    With ``--native``, the BAM files are read directly (without samtools).
+
+    With many mapping or base quality thresholds, the BAM files are read
+    directly (once), and one histogram is computed for each combination of
+    thresholds.
+
+    The targeted regions need to be merged (so that no base is counted
+    twice). When using more than one process, they are split in groups of
+    (about) the same number of bases. The depth of each group is computed
+    separately (using the BAM indexes), and the histograms of the groups are
+    summed.
+
+    """
+    # The number of sample
+    nb_samples = len(bams)
+    nb_bins = options.bam_depth + 1
+
+    # The groups of regions (each group is on a single chromosome)
+    groups = None
+    if options.nb_process > 1:
+        groups = split_regions(regions,
+                               options.nb_process * _groups_per_process)
+
+    # The BAM files are read directly
+    if options.native or len(thresholds) > 1:
+        if groups is None:
+            groups = [regions]
+        histograms = sum_histograms(
+            compute_native_histograms, options.nb_process,
+            repeat(bams), groups, repeat(thresholds),
+            repeat(options.bam_depth),
+        )
+        return histograms.reshape(len(thresholds), nb_samples, nb_bins)
+
+    # The command (samtools depth uses -q for the base quality and -Q for the
+    # mapping quality)
     command = "samtools"
     if options.samtools_exec is not None:
         command = os.path.join(options.samtools_exec, "samtools")
-    command = [command, "mpileup", "-A", "-d", str(options.bam_depth), "-q",
-               str(options.mapq), "-Q", str(options.baseq)]
+    mapq, baseq = thresholds[0]
+    command = [command, "depth", "-a", "-q", str(baseq), "-Q", str(mapq)]
+
+    with TemporaryDirectory() as tmp_dir:
+        # A single process reads all the (merged) regions at once
+        if groups is None:
+            bed = os.path.join(tmp_dir, "targets.bed")
+            write_bed(regions, bed)
+            histograms = compute_histograms(
+                command + ["-b", bed] + bams, nb_samples, options.bam_depth,
+            )
+            return histograms.reshape(1, nb_samples, nb_bins)
+
+        # The command of each group (the regions of the group in a BED file,
+        # and its span as region, so that samtools uses the index)
+        commands = []
+        for i, group in enumerate(groups):
+            bed = os.path.join(tmp_dir, "group_{}.bed".format(i + 1))
+            write_bed(group, bed)
+            span = "{}:{}-{}".format(group[0][0], group[0][1] + 1,
+                                     group[-1][2])
+            commands.append(command + ["-b", bed, "-r", span] + bams)
+
+        # Computing the histograms of the groups in parallel
+        histograms = sum_histograms(
+            compute_histograms, options.nb_process, commands,
+            repeat(nb_samples), repeat(options.bam_depth),
+        )
+
+    return histograms.reshape(1, nb_samples, nb_bins)
+
+
+def sum_histograms(function, nb_process, *iterables):
+    """Sums the histograms computed for each group (in parallel)."""
+    histograms = None
+    executor = None
+    if nb_process > 1:
+        executor = ProcessPoolExecutor(max_workers=nb_process)
 
-    # If there is a bed, we add it
-    if options.bed is not None:
-        command.extend(["-l", options.bed])
+    try:
+        if executor is None:
+            results = map(function, *iterables)
+        else:
+            results = executor.map(function, *iterables)
+        for group_histograms in results:
+            if histograms is None:
+                histograms = group_histograms
+            else:
+                histograms += group_histograms
+
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return histograms
+
+
+def compute_native_histograms(bams, regions, thresholds, max_depth):
+    """Computes the depth histograms of the samples, reading the BAM files.
+
+    The histograms are flattened by thresholds, then by samples. The regions
+    on chromosomes absent from a BAM file are skipped.
+
+    """
+    nb_bins = max_depth + 1
+    nb_samples = len(bams)
+    histograms = np.zeros(len(thresholds) * nb_samples * nb_bins,
+                          dtype=np.int64)
 
-    # Adds the input files
-    command.extend(options.bam)
+    # The offset of the bins of each threshold (for the current sample)
+    offsets = np.arange(len(thresholds))[:, np.newaxis] * nb_samples * nb_bins
+
+    for i, filename in enumerate(bams):
+        try:
+            with BamFile(filename) as bam:
+                for chrom, start, end in regions:
+                    if chrom not in bam.lengths:
+                        continue
+                    depths = bam.depths(chrom, start, end, thresholds)
+                    depths = (np.minimum(depths, max_depth) + offsets +
+                              i * nb_bins)
+                    histograms += np.bincount(depths.ravel(),
+                                              minlength=len(histograms))
+
+        except PGxProgramError as e:
+            raise ProgramError(e.message)
+
+    return histograms
+
+
+def compute_histograms(command, nb_samples, max_depth):
+    """Computes the depth histograms of the samples (flattened)."""
+    nb_bins = max_depth + 1
 
     # Launching the subprocess
     p = Popen(command, stdout=PIPE)
 
-    # Reading the output from samtools
-    depth = pd.read_csv(p.stdout, sep="\t", names=samples, quoting=QUOTE_NONE,
-                        encoding="ascii",
-                        usecols=range(3, (nb_samples * 3) + 3, 3))
+    # Reading the depth columns by chunks (the histograms of all the samples
+    # are computed with a single bincount, offsetting the bins of each
+    # sample)
+    histograms = np.zeros(nb_samples * nb_bins, dtype=np.int64)
+    offsets = np.arange(nb_samples) * nb_bins
+    reader = pd.read_csv(p.stdout, sep="\t", header=None,
+                         usecols=range(2, nb_samples + 2),
+                         chunksize=_chunk_size)
+    for chunk in reader:
+        depths = np.minimum(chunk.values, max_depth) + offsets
+        histograms += np.bincount(depths.ravel(),
+                                  minlength=len(histograms))
 
     # Closing the PIPE
     p.stdout.close()
+    if p.wait() != 0:
+        m = "samtools depth: could not compute the depth"
+        raise ProgramError(m)
+
+    return histograms
+
+
+def split_regions(regions, nb_groups):
+    """Splits regions in groups of about the same number of bases.
+
+    Each group contains consecutive regions of a single chromosome (the
+    regions longer than a group are split).
 
-    return depth
+    """
+    # The number of bases per group
+    nb_bases = sum(end - start for chrom, start, end in regions)
+    group_size = max(-(-nb_bases // nb_groups), 1)
+
+    groups = []
+    group, group_bases = [], 0
+    for chrom, start, end in sorted(regions):
+        # A new chromosome starts a new group
+        if group and group[-1][0] != chrom:
+            groups.append(group)
+            group, group_bases = [], 0
+
+        while start < end:
+            # The part of the region fitting in the group
+            piece_end = min(end, start + group_size - group_bases)
+            group.append((chrom, start, piece_end))
+            group_bases += piece_end - start
+            start = piece_end
+
+            # The group is full
+            if group_bases >= group_size:
+                groups.append(group)
+                group, group_bases = [], 0
+
+    if group:
+        groups.append(group)
+
+    return groups
 
 
 def check_args(args):
@@ -246,22 +484,39 @@ def check_args(args):
                 m = "{}: no such file".format(filename)
                 raise ProgramError(m)
 
-    # Checking the BED file
-    if not args.bed.endswith(".bed"):
-        m = "{}: no a bed format".format(args.bed)
-        raise ProgramError(m)
+    # Checking the reused depth files
+    if args.reuse_depth is not None:
+        if args.bam is None:
+            m = "--reuse-depth requires --bam"
+            raise ProgramError(m)
+        for filename in args.reuse_depth:
+            if not os.path.isfile(filename):
+                m = "{}: no such file".format(filename)
+                raise ProgramError(m)
 
-    if not os.path.isfile(args.bed):
-        m = "{}: no such file".format(args.bed)
+    # Checking the BED file (only required to compute the depth)
+    if (args.bed is None) and (args.bam is not None):
+        m = "--bed is required with --bam"
         raise ProgramError(m)
 
+    if args.bed is not None:
+        if not args.bed.endswith(".bed"):
+            m = "{}: no a bed format".format(args.bed)
+            raise ProgramError(m)
+
+        if not os.path.isfile(args.bed):
+            m = "{}: no such file".format(args.bed)
+            raise ProgramError(m)
+
     # Checking the qualities
-    if args.mapq < 0:
-        m = "{}: invalid map quality".format(args.mapq)
-        raise ProgramError(m)
-    if args.baseq < 0 or args.baseq > 41:
-        m = "{}: invalid base quality".format(args.baseq)
-        raise ProgramError(m)
+    for mapq in args.mapq:
+        if mapq < 0:
+            m = "{}: invalid map quality".format(mapq)
+            raise ProgramError(m)
+    for baseq in args.baseq:
+        if baseq < 0 or baseq > 41:
+            m = "{}: invalid base quality".format(baseq)
+            raise ProgramError(m)
 
     # Checking that the max depth is higher than 0
     if args.max_depth is not None:
@@ -269,6 +524,25 @@ def check_args(args):
             m = "{}: invalid maximal depth".format(args.max_depth)
             raise ProgramError(m)
 
+    # Reading the BAM files directly requires their index
+    nb_thresholds = len(args.mapq) * len(args.baseq)
+    native = args.native or (nb_thresholds > 1)
+    if native and (args.bam is not None):
+        for filename in args.bam:
+            if not filename.endswith(".bam"):
+                m = "{}: not a bam file (reading it directly)".format(
+                    filename,
+                )
+                raise ProgramError(m)
+            if find_bai(filename) is None:
+                m = "{}: no index (.bai)".format(filename)
+                raise ProgramError(m)
+
+    # Checking the number of processes
+    if args.nb_process < 1:
+        m = "{}: invalid number of processes".format(args.nb_process)
+        raise ProgramError(m)
+
     # Checking for the executable
     if args.samtools_exec is not None:
         if not os.path.isfile(os.path.join(args.samtools_exec, "samtools")):
@@ -288,15 +562,23 @@ def parse_args(parser):
     ================   =======  ===============================================
         Options         Type                      Description
     ================   =======  ===============================================
-    ``--depth-file``   string   Results from this script (to redo the plot
-                                faster)
+    ``--depth-file``   string   Depth files from this script (to redo the
+                                plot faster)
     ``--bam``          string   Input BAM file(s) (one or more, separated by
                                 spaces)
+    ``--reuse-depth``  string   Depth files from this script containing
+                                some of the BAM files (not computed again)
     ``--bed``          string   BED file to restrict to targeted regions
+                                (required with ``--bam``)
     ``-q``             int      skip alignments with mapQ smaller than INT
-    ``-Q``             int      skip bases with baseQ/BAQ smaller than INT
-    ``-d``             int      max per-BAM depth to avoid excessive memory
-                                usage
+                                (one or more)
+    ``-Q``             int      skip bases with baseQ smaller than INT
+                                (one or more)
+    ``-d``             int      max per-BAM depth (higher depths are counted
+                                as INT)
+    ``--nb-process``   int      The number of processes computing the depth
+    ``--native``       bool     Read the BAM files directly (without
+                                samtools)
     ``--max-depth``    int      The maximal depth to plot (in order to zoom in
                                 the plots)
     ``--out``          string   The prefix of the output file
@@ -318,26 +600,41 @@ def parse_args(parser):
     # The input files
     group = parser.add_argument_group("Input Files")
     group.add_argument("--depth-file", type=str, metavar="FILE", nargs="+",
-                       help=("Results from this script (to redo the plot "
+                       help=("Depth files from this script (to redo the plot "
                              "faster) (one or more, separate by spaces)"))
     group.add_argument("--bam", type=str, metavar="BAM", nargs="+",
                        help=("Input BAM file(s) (one or more, separated by "
                              "spaces)"))
-    group.add_argument("--bed", type=str, metavar="BED", required=True,
-                       help="BED file to restrict to targeted regions")
-
-    # The MPILEUP options
-    group = parser.add_argument_group("MPILEUP Options")
-    group.add_argument("-q", type=int, metavar="INT", default=0, dest="mapq",
+    group.add_argument("--reuse-depth", type=str, metavar="FILE", nargs="+",
+                       help=("Depth files from this script containing some "
+                             "of the BAM files, whose depth is not computed "
+                             "again (if computed with the same options) "
+                             "(one or more, separated by spaces)"))
+    group.add_argument("--bed", type=str, metavar="BED",
+                       help=("BED file to restrict to targeted regions "
+                             "(required with --bam)"))
+
+    # The depth options
+    group = parser.add_argument_group("Depth Options")
+    group.add_argument("-q", type=int, metavar="INT", default=[0], nargs="+",
+                       dest="mapq",
                        help=("skip alignments with mapQ smaller than INT "
-                             "[%(default)d]"))
-    group.add_argument("-Q", type=int, metavar="INT", default=13, dest="baseq",
-                       help=("skip bases with baseQ/BAQ smaller than INT "
-                             "[%(default)d]"))
+                             "(one or more) [0]"))
+    group.add_argument("-Q", type=int, metavar="INT", default=[13],
+                       nargs="+", dest="baseq",
+                       help=("skip bases with baseQ smaller than INT "
+                             "(one or more) [13]"))
     group.add_argument("-d", type=int, metavar="INT", default=250,
                        dest="bam_depth",
-                       help=("max per-BAM depth to avoid excessive memory "
-                             "usage [%(default)d]"))
+                       help=("max per-BAM depth (higher depths are counted "
+                             "as INT) [%(default)d]"))
+    group.add_argument("--nb-process", type=int, metavar="INT", default=1,
+                       help=("The number of processes computing the depth "
+                             "(by groups of regions, using the BAM indexes) "
+                             "[%(default)d]"))
+    group.add_argument("--native", action="store_true",
+                       help=("Read the (indexed) BAM files directly, without "
+                             "samtools"))
 
     # Plotting options
     group = parser.add_argument_group("Plotting Options")
@@ -348,7 +645,8 @@ def parse_args(parser):
     # The output
     group = parser.add_argument_group("Output Options")
     group.add_argument("-o", "--out", metavar="FILE", default="depth",
-                       help="The name of the output file [%(default)s]")
+                       help=("The prefix of the output files (the plot and "
+                             "the depth file) [%(default)s]"))
 
     return parser.parse_args()
 
@@ -17,13 +17,15 @@ import traceback
 from copy import copy
 
 from ruffus import pipeline_printout_graph, pipeline_run
-from ruffus import originate, formatter, collate, transform, regex
+from ruffus import originate, formatter, collate, transform, regex, follows
 
 import pgx_dnaseq
 from pgx_dnaseq import __version__
 from pgx_dnaseq import ProgramError
 from pgx_dnaseq.tools import GenericTool as Tool
+from pgx_dnaseq.bed import get_padded_bed
 from pgx_dnaseq.read_config import read_config_file, get_pipeline_steps
+from pgx_dnaseq.read_config import get_pipeline_options
 
 
 __author__ = "Louis-Philippe Lemieux Perreault"
@@ -37,23 +39,143 @@ __email__ = "louis-philippe.lemieux.perreault@statgen.org"
 __status__ = "Development"
 
 
+# The lane information in the input file names (e.g. SAMPLE_L001_R1.fastq.gz)
+_lane_re = re.compile(
+    r"^(?P<sample>[a-zA-Z0-9_\-]+)_(?P<lane>L\d{3})_R[12]\."
+)
+
+
 def check_input_files(filename):
-    """Checks the input file names."""
-    split_re = re.compile(r"\s+")
-    input_filenames = None
+    """Checks the input file names.
+
+    Samples sequenced on multiple lanes (files named ``{SAMPLE}_L001_R1``,
+    ``{SAMPLE}_L001_R2``, ``{SAMPLE}_L002_R1``, etc.) are split so that each
+    lane pair is processed as its own job. The sample and the lane of each of
+    those jobs are returned as well (using the ID of the job, e.g.
+    ``{SAMPLE}_L001``), so that the samples with a single pair of files are
+    never considered as lanes (even if their name looks like one).
+
+    """
+    input_filenames = []
+    lane_samples = {}
     with open(filename, "r") as i_file:
-        input_filenames = [
-            re.split(r"\s+", i.rstrip("\r\n")) for i in i_file.readlines()
-        ]
-
-    # Checking that all those files exists
-    for sample_files in input_filenames:
-        for input_filename in sample_files:
-            if not os.path.isfile(input_filename):
-                m = "{}: no such file".format(input_filename)
+        for line in i_file:
+            sample_files = re.split(r"\s+", line.strip())
+            if sample_files == [""]:
+                continue
+
+            # Checking that all those files exists
+            for input_filename in sample_files:
+                if not os.path.isfile(input_filename):
+                    m = "{}: no such file".format(input_filename)
+                    raise ProgramError(m)
+
+            # Only one pair of files for this sample
+            if len(sample_files) <= 2:
+                input_filenames.append(sample_files)
+                continue
+
+            # Multiple lanes, so we group the files by lane
+            lanes = {}
+            for input_filename in sample_files:
+                lane = _lane_re.search(os.path.basename(input_filename))
+                if lane is None:
+                    m = "{}: no lane information".format(input_filename)
+                    raise ProgramError(m)
+                key = (lane.group("sample"), lane.group("lane"))
+                lanes.setdefault(key, []).append(input_filename)
+
+            # All the lanes should come from the same sample
+            if len({sample for sample, lane in lanes.keys()}) != 1:
+                m = "{}: multiple samples on the same line".format(
+                    " ".join(sample_files),
+                )
                 raise ProgramError(m)
 
-    return input_filenames
+            # Each lane should be a pair of files
+            for sample, lane in sorted(lanes.keys()):
+                lane_files = sorted(lanes[(sample, lane)])
+                if len(lane_files) != 2:
+                    m = "{}: {}: expecting two files (R1 and R2)".format(
+                        sample, lane,
+                    )
+                    raise ProgramError(m)
+                input_filenames.append(lane_files)
+                lane_samples["{}_{}".format(sample, lane)] = (sample, lane)
+
+    return input_filenames, lane_samples
+
+
+def get_pipeline_targets(pipeline_options, steps):
+    """Pads the targets of the pipeline (once, for all the steps).
+
+    The padded (and merged) targets are cached in ``output/intervals``. The
+    regions are clipped to the reference (the ``reference`` pipeline option,
+    or the one of the first step using it), if any.
+
+    """
+    pipeline_options = dict(pipeline_options)
+    if "targets" not in pipeline_options:
+        return pipeline_options
+
+    # The padding
+    padding = pipeline_options.get("interval_padding", "0")
+    try:
+        padding = int(padding)
+    except ValueError:
+        m = "{}: invalid interval padding".format(padding)
+        raise ProgramError(m)
+    if padding < 0:
+        m = "{}: invalid interval padding".format(padding)
+        raise ProgramError(m)
+
+    # The reference
+    reference = pipeline_options.get("reference", None)
+    if reference is None:
+        for job, job_options in steps:
+            if "reference" in job_options:
+                reference = job_options["reference"]
+                break
+
+    pipeline_options["targets"] = get_padded_bed(
+        pipeline_options["targets"],
+        padding,
+        out_dir=os.path.join("output", "intervals"),
+        reference=reference,
+    )
+
+    return pipeline_options
+
+
+def inject_read_group(steps):
+    """Adds the read group while aligning if an AddRG step follows.
+
+    The AddRG options are given to the alignment steps preceding it, and the
+    AddRG step only links its input file (unless it has ``inject_rg = no``).
+
+    """
+    aligners_options = []
+    for job, job_options in steps:
+        if job.can_inject_read_group():
+            aligners_options.append(job_options)
+            continue
+
+        if job.get_tool_name() != "AddRG":
+            continue
+
+        # Is there an aligner before, and can we inject the read group?
+        if (len(aligners_options) == 0
+                or job_options.get("inject_rg", "yes") == "no"):
+            continue
+
+        for aligner_options in aligners_options:
+            for name in ("read_group_id", "rgds", "rgpl", "rgpu", "rgcn",
+                         "rglb"):
+                if name in job_options:
+                    aligner_options[name] = job_options[name]
+            aligner_options["inject_rg"] = "yes"
+        job_options["rg_injected"] = "yes"
+        aligners_options = []
 
 
 def rename_func(new_name):
@@ -197,7 +319,7 @@ if __name__ == "__main__":
         print()
 
         # Checking the input files
-        input_files = check_input_files(args.input)
+        input_files, lane_samples = check_input_files(args.input)
 
         # Getting the tool's configuration and setting it
         tool_config = read_config_file(args.tool_config)
@@ -214,6 +336,22 @@ if __name__ == "__main__":
         # Getting the pipeline steps
         what_to_run = get_pipeline_steps(args.pipeline_config)
 
+        # The lanes of a sample need to be merged at some point
+        if lane_samples and not any(job.need_to_merge_lanes()
+                                    for job, job_options in what_to_run):
+            m = ("{}: samples with multiple lanes, but no step merging the "
+                 "lanes (MergeLanes)".format(args.input))
+            raise ProgramError(m)
+
+        # The read group is added while aligning (if possible)
+        inject_read_group(what_to_run)
+
+        # Getting the options of the whole pipeline
+        pipeline_options = get_pipeline_options(args.pipeline_config)
+        Tool.set_pipeline_options(
+            get_pipeline_targets(pipeline_options, what_to_run),
+        )
+
         # The first step of the pipeline
         @originate(input_files)
         def start(o_files):
@@ -230,6 +368,18 @@ if __name__ == "__main__":
             input_type = job.get_input_type()
             output_type = job.get_output_type()
 
+            # The VCF files read by the following steps are kept once
+            # compressed (otherwise, the outputs of the step are the
+            # compressed VCF files)
+            if (job.produce_usable_data()
+                    and (job_index + 1 < len(what_to_run))):
+                job_options["keep_vcf"] = "yes"
+            if job.keep_only_compressed_vcf(job_options):
+                output_type = tuple(
+                    "{}.gz".format(suffix) if suffix.endswith(".vcf")
+                    else suffix for suffix in output_type
+                )
+
             # The output directory
             output_dir = os.path.join("output",
                                       "{:02d}_{}".format(job_index + 1,
@@ -266,6 +416,20 @@ if __name__ == "__main__":
                 ]
                 formatter_func = regex
 
+            # What if we need to merge the lanes of each sample? (only the
+            # samples with multiple lanes lose their lane suffix)
+            if job.need_to_merge_lanes() and lane_samples:
+                multi_lanes = "|".join(sorted(
+                    re.escape(sample) for sample, lane in lane_samples.values()
+                ))
+                curr_formatter = [
+                    (r".+/(?P<SAMPLE>(?:{0})(?=_L\d{{3}}{1})|"
+                     r"[a-zA-Z0-9_\-]+(?={1}))(?:_L\d{{3}})?{1}").format(
+                         multi_lanes, i,
+                    )
+                    for i in input_type
+                ]
+
             # Checking if there is only one output
             if len(curr_output) == 1:
                 curr_output = curr_output[0]
@@ -273,7 +437,8 @@ if __name__ == "__main__":
             # Getting the current Ruffus' decorator
             curr_decorator = None
             if ((len(input_type) > len(output_type))
-                    or job.need_to_merge_all_inputs()):
+                    or job.need_to_merge_all_inputs()
+                    or job.need_to_merge_lanes()):
                 # Collate
                 curr_decorator = collate
             elif len(input_type) == len(output_type):
@@ -301,6 +466,10 @@ if __name__ == "__main__":
                     i_files = list(i_files)
                     sample_id = "all_samples"
 
+                # If we need to merge the lanes of a sample
+                if job.need_to_merge_lanes():
+                    i_files = sorted(i_files)
+
                 # The i_files variable is usually a tuple of lists
                 if isinstance(i_files, tuple):
                     i_files = i_files[0]
@@ -309,7 +478,8 @@ if __name__ == "__main__":
                 curr_options = copy(options)
 
                 # Adding the input to the tool option
-                if job.need_to_merge_all_inputs():
+                if (job.need_to_merge_all_inputs()
+                        or job.need_to_merge_lanes()):
                     curr_options["inputs"] = i_files
                 elif nb_in == 1:
                     curr_options["input"] = i_files
@@ -317,6 +487,15 @@ if __name__ == "__main__":
                     for i in range(nb_in):
                         curr_options["input{}".format(i + 1)] = i_files[i]
 
+                # The tool writes the VCF files (which are removed once
+                # compressed)
+                if job.keep_only_compressed_vcf(options):
+                    if nb_out == 1:
+                        o_files = re.sub(r"\.vcf\.gz$", ".vcf", o_files)
+                    else:
+                        o_files = [re.sub(r"\.vcf\.gz$", ".vcf", o_file)
+                                   for o_file in o_files]
+
                 # Adding the output files
                 if nb_out == 1:
                     curr_options["output"] = o_files
@@ -324,9 +503,17 @@ if __name__ == "__main__":
                     for i in range(nb_out):
                         curr_options["output{}".format(i + 1)] = o_files[i]
 
-                # Adding the prefix and sample id
+                # Adding the prefix and the read group (which is lane specific
+                # if the job works on a single lane of a sample)
                 if "prefix" not in curr_options:
                     curr_options["prefix"] = os.path.join(out_dir, sample_id)
+                if "read_group_id" not in curr_options:
+                    curr_options["read_group_id"] = sample_id
+
+                # Adding the lane and sample id (if the job works on a single
+                # lane of a sample)
+                if sample_id in lane_samples:
+                    sample_id, curr_options["lane"] = lane_samples[sample_id]
                 if "sample_id" not in curr_options:
                     curr_options["sample_id"] = sample_id
                 print(curr_options["sample_id"])
@@ -334,6 +521,16 @@ if __name__ == "__main__":
                 # Running the task
                 job.execute(curr_options, out_dir=out_dir)
 
+            # The steps whose outputs are reused by this one need to run first
+            reused_steps = [
+                job_order[i] for i, (previous_job, _) in enumerate(
+                    what_to_run[:job_index],
+                )
+                if previous_job.get_tool_name() in job.get_reused_tools()
+            ]
+            if reused_steps:
+                follows(*reused_steps)(curr_step)
+
             # Setting the attribute for the new function so that it can be
             # pickled
             setattr(__main__, func_name, curr_step)
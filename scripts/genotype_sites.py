@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import sys
+import argparse
+from tempfile import NamedTemporaryFile, TemporaryFile
+from subprocess import Popen, PIPE
+
+from pgx_dnaseq import __version__
+from pgx_dnaseq import ProgramError as PGxProgramError
+from pgx_dnaseq.bam import find_bai
+from pgx_dnaseq.genotype import read_sites, write_sites_bed, pileup_sites, \
+                                compute_likelihoods, call_genotypes, \
+                                write_genotypes
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__credits__ = ["Louis-Philippe Lemieux Perreault", "Abdellatif Daghrach",
+               "Michal Blazejczyk"]
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+__maintainer__ = "Louis-Philippe Lemieux Perreault"
+__email__ = "louis-philippe.lemieux.perreault@statgen.org"
+__status__ = "Development"
+
+
+def main():
+    """The main function."""
+    # The parser object
+    desc = ("Genotypes known sites directly from a BAM file (part of "
+            "pgx_dnaseq version {}).".format(__version__))
+    parser = argparse.ArgumentParser(description=desc)
+
+    try:
+        # Getting and checking the options
+        args = parse_args(parser)
+        check_args(args)
+
+        try:
+            # Reading the sites
+            sites = read_sites(args.sites)
+            if len(sites) == 0:
+                m = "{}: no site".format(args.sites)
+                raise ProgramError(m)
+
+            # Piling up the reads at the sites
+            observations = pileup_sites_from_bam(sites, args)
+
+            # Computing the genotypes
+            likelihoods, depth, allele_depths = compute_likelihoods(
+                *observations, sites=sites
+            )
+            best, pl, gq = call_genotypes(likelihoods)
+
+        except PGxProgramError as e:
+            raise ProgramError(e.message)
+
+        # Writing the genotypes
+        source = "genotype_sites.py (pgx_dnaseq {})".format(__version__)
+        o_file = sys.stdout if args.output == "-" else open(args.output, "w")
+        try:
+            write_genotypes(sites, args.sample, depth, allele_depths, best,
+                            pl, gq, o_file, source=source)
+        finally:
+            if o_file is not sys.stdout:
+                o_file.close()
+
+    except KeyboardInterrupt:
+        print("Cancelled by user", sys.stderr)
+        sys.exit(0)
+
+    except ProgramError as e:
+        parser.error(e.message)
+
+
+def pileup_sites_from_bam(sites, options):
+    """Piles up the reads of the BAM file at the sites (using its index)."""
+    # The samtools executable
+    samtools = "samtools"
+    if options.samtools_exec is not None:
+        samtools = os.path.join(options.samtools_exec, "samtools")
+
+    # The positions of the sites (as a BED file, for samtools)
+    bed = NamedTemporaryFile(mode="w", suffix=".bed", delete=False)
+    bed.close()
+    try:
+        write_sites_bed(sites, bed.name)
+
+        # Only the reads overlapping the sites are read (using the index and
+        # the multi-region iterator, so that each read is read once),
+        # skipping the unmapped, secondary, QC failed, duplicated and
+        # supplementary reads
+        command = [samtools, "view", "-M", "-L", bed.name, "-F", "0xF04",
+                   "-q", str(options.min_mapq), options.input]
+        # The STDERR goes in a temporary file (a full STDERR pipe would
+        # block samtools while the STDOUT is read)
+        with TemporaryFile(mode="w+") as stderr_file:
+            try:
+                proc = Popen(command, stdout=PIPE, stderr=stderr_file,
+                             universal_newlines=True)
+            except FileNotFoundError:
+                m = "{}: cannot launch".format(samtools)
+                raise ProgramError(m)
+
+            observations = pileup_sites(proc.stdout, sites,
+                                        min_base_quality=options.min_baseq)
+            if proc.wait() != 0:
+                stderr_file.seek(0)
+                m = "{}: {}".format(options.input, stderr_file.read().strip())
+                raise ProgramError(m)
+
+    finally:
+        os.remove(bed.name)
+
+    return observations
+
+
+def check_args(args):
+    """Checks the arguments and options.
+
+    :param args: an object containing the options and arguments of the program.
+
+    :type args: :py:class:`argparse.Namespace`
+
+    :returns: ``True`` if everything was OK.
+
+    If there is a problem with an option, an exception is raised using the
+    :py:class:`ProgramError` class, a message is printed to the
+    :class:`sys.stderr` and the program exits with error code 1.
+
+    """
+    # Checking the input files (the BAM file needs its index)
+    for filename in (args.input, args.sites):
+        if not os.path.isfile(filename):
+            m = "{}: no such file".format(filename)
+            raise ProgramError(m)
+    if not args.input.endswith(".bam"):
+        m = "{}: not a bam file".format(args.input)
+        raise ProgramError(m)
+    if find_bai(args.input) is None:
+        m = "{}: no index (.bai)".format(args.input)
+        raise ProgramError(m)
+
+    # Checking samtools
+    if args.samtools_exec is not None:
+        if not os.path.isfile(os.path.join(args.samtools_exec, "samtools")):
+            m = "{}: does not contain samtools".format(args.samtools_exec)
+            raise ProgramError(m)
+
+    # Checking the qualities
+    if args.min_mapq < 0:
+        m = "{}: invalid mapping quality".format(args.min_mapq)
+        raise ProgramError(m)
+    if args.min_baseq < 0:
+        m = "{}: invalid base quality".format(args.min_baseq)
+        raise ProgramError(m)
+
+    return True
+
+
+def parse_args(parser):
+    """Parses the command line options and arguments.
+
+    :returns: A :py:class:`argparse.Namespace` object created by the
+              :py:mod:`argparse` module. It contains the values of the
+              different options.
+
+    ===================   =======  ============================================
+          Options          Type                    Description
+    ===================   =======  ============================================
+    ``--input``           string   The input (indexed) BAM file
+    ``--sites``           string   The sites to genotype (VCF)
+    ``--sample``          string   The name of the sample
+    ``--min-mapq``        int      The minimal mapping quality
+    ``--min-baseq``       int      The minimal base quality
+    ``--samtools-exec``   string   The path to the samtools executable
+    ``--output``          string   The output VCF file ('-' for STDOUT)
+    ===================   =======  ============================================
+
+    .. note::
+        No option check is done here (except for the one automatically done by
+        :py:mod:`argparse`). Those need to be done elsewhere (see
+        :py:func:`checkArgs`).
+
+    """
+    parser.add_argument("--version", action="version",
+                        version=("%(prog)s part of pgx_dnaseq "
+                                 "version {}".format(__version__)))
+    parser.add_argument("--samtools-exec", type=str, metavar="PATH",
+                        help=("The PATH to the samtools executable if not in "
+                              "the $PATH variable"))
+
+    # The input files
+    group = parser.add_argument_group("Input Files")
+    group.add_argument("-i", "--input", type=str, metavar="BAM",
+                       required=True,
+                       help="The input BAM file (with its index)")
+    group.add_argument("--sites", type=str, metavar="FILE", required=True,
+                       help=("The sites to genotype (a VCF file, or at least "
+                             "its first five columns)"))
+    group.add_argument("--sample", type=str, metavar="NAME",
+                       default="sample",
+                       help="The name of the sample [%(default)s]")
+
+    # The pileup options
+    group = parser.add_argument_group("Pileup Options")
+    group.add_argument("-q", "--min-mapq", type=int, metavar="INT",
+                       default=20,
+                       help=("Skip the reads with a mapping quality smaller "
+                             "than INT [%(default)d]"))
+    group.add_argument("-Q", "--min-baseq", type=int, metavar="INT",
+                       default=13,
+                       help=("Skip the bases with a quality smaller than INT "
+                             "[%(default)d]"))
+
+    # The output
+    group = parser.add_argument_group("Output Options")
+    group.add_argument("-o", "--output", metavar="FILE", default="-",
+                       help="The output VCF file [STDOUT]")
+
+    return parser.parse_args()
+
+
+class ProgramError(Exception):
+    """An :py:class:`Exception` raised in case of a problem.
+
+    :param msg: the message to print to the user before exiting.
+
+    :type msg: string
+
+    """
+    def __init__(self, msg):
+        """Construction of the :py:class:`ProgramError` class.
+
+        :param msg: the message to print to the user.
+
+        :type msg: string
+
+        """
+        self.message = str(msg)
+
+    def __str__(self):
+        return self.message
+
+
+# Calling the main, if necessary
+if __name__ == "__main__":
+    main()
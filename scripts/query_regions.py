@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import sys
+import argparse
+
+from pgx_dnaseq import __version__
+from pgx_dnaseq import ProgramError as PGxProgramError
+from pgx_dnaseq.query import parse_region, read_regions, find_step_files, \
+                             query_files
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__credits__ = ["Louis-Philippe Lemieux Perreault", "Abdellatif Daghrach",
+               "Michal Blazejczyk"]
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+__maintainer__ = "Louis-Philippe Lemieux Perreault"
+__email__ = "louis-philippe.lemieux.perreault@statgen.org"
+__status__ = "Development"
+
+
+def main():
+    """The main function."""
+    # The parser object
+    desc = ("Gets the records of the pipeline's VCF (or BAM) files for a "
+            "list of regions (part of pgx_dnaseq version "
+            "{}).".format(__version__))
+    parser = argparse.ArgumentParser(description=desc)
+
+    try:
+        # Getting and checking the options
+        args = parse_args(parser)
+        check_args(args)
+
+        try:
+            # The regions
+            regions = [parse_region(region) for region in args.region or []]
+            if args.regions is not None:
+                regions.extend(read_regions(args.regions))
+
+            # The files (the final VCF files by default)
+            filenames = args.input
+            if filenames is None:
+                filenames = find_step_files(
+                    out_dir=args.output_dir,
+                    step=args.step,
+                    extension=".bam" if args.bam else ".vcf.gz",
+                )
+
+            # Querying the files
+            samtools = "samtools"
+            if args.samtools_exec is not None:
+                samtools = os.path.join(args.samtools_exec, "samtools")
+            results = query_files(
+                filenames, regions,
+                nb_threads=args.nb_threads,
+                samtools=samtools,
+                max_open_files=args.max_open_files,
+                max_cached_blocks=args.max_cached_blocks,
+            )
+
+        except PGxProgramError as e:
+            raise ProgramError(e.message)
+
+        # Writing the records
+        write_records(results, regions, args.output)
+
+    except KeyboardInterrupt:
+        print("Cancelled by user", sys.stderr)
+        sys.exit(0)
+
+    except ProgramError as e:
+        parser.error(e.message)
+
+
+def write_records(results, regions, output):
+    """Writes the records (with their file and region).
+
+    :param results: the records of each region for each file
+    :param regions: the regions (contig, start, end)
+    :param output: the name of the output file ('-' for STDOUT)
+
+    :type results: dict
+    :type regions: list
+    :type output: string
+
+    """
+    # The name of the regions
+    names = []
+    for contig, start, end in regions:
+        if start is None:
+            names.append(contig)
+        else:
+            names.append("{}:{}-{}".format(contig, start, end))
+
+    o_file = sys.stdout if output == "-" else open(output, "w")
+    try:
+        for filename, records in results.items():
+            for name, region_records in zip(names, records):
+                for record in region_records:
+                    print(filename, name, record, sep="\t", file=o_file)
+
+    finally:
+        if o_file is not sys.stdout:
+            o_file.close()
+
+
+def check_args(args):
+    """Checks the arguments and options.
+
+    :param args: an object containing the options and arguments of the program.
+
+    :type args: :py:class:`argparse.Namespace`
+
+    :returns: ``True`` if everything was OK.
+
+    If there is a problem with an option, an exception is raised using the
+    :py:class:`ProgramError` class, a message is printed to the
+    :class:`sys.stderr` and the program exits with error code 1.
+
+    """
+    # Checking the regions
+    if (args.region is None) and (args.regions is None):
+        m = "no region (use --region or --regions)"
+        raise ProgramError(m)
+    if (args.regions is not None) and (not os.path.isfile(args.regions)):
+        m = "{}: no such file".format(args.regions)
+        raise ProgramError(m)
+
+    # Checking the input files
+    if args.input is not None:
+        for filename in args.input:
+            if not os.path.isfile(filename):
+                m = "{}: no such file".format(filename)
+                raise ProgramError(m)
+            if not filename.endswith((".vcf.gz", ".bam")):
+                m = "{}: not a bgzipped VCF or a BAM file".format(filename)
+                raise ProgramError(m)
+    elif not os.path.isdir(args.output_dir):
+        m = "{}: no such directory".format(args.output_dir)
+        raise ProgramError(m)
+
+    # Checking samtools
+    if args.samtools_exec is not None:
+        if not os.path.isfile(os.path.join(args.samtools_exec, "samtools")):
+            m = "{}: does not contain samtools".format(args.samtools_exec)
+            raise ProgramError(m)
+
+    # Checking the numbers
+    for name in ("nb_threads", "max_open_files", "max_cached_blocks"):
+        if getattr(args, name) < 1:
+            m = "{}: invalid {}".format(getattr(args, name),
+                                        name.replace("_", " "))
+            raise ProgramError(m)
+
+    return True
+
+
+def parse_args(parser):
+    """Parses the command line options and arguments.
+
+    :returns: A :py:class:`argparse.Namespace` object created by the
+              :py:mod:`argparse` module. It contains the values of the
+              different options.
+
+    =========================  =======  ======================================
+             Options            Type                 Description
+    =========================  =======  ======================================
+    ``--input``                string   The bgzipped VCF or BAM files
+    ``--output-dir``           string   The output directory of the pipeline
+    ``--step``                 string   The step (number or directory)
+    ``--bam``                  bool     Query the BAM files of the step
+    ``--region``               string   The regions (chr:start-end)
+    ``--regions``              string   A file containing the regions
+    ``--nb-threads``           int      The number of files queried at once
+    ``--max-open-files``       int      The maximal number of open files
+    ``--max-cached-blocks``    int      The maximal number of cached blocks
+    ``--samtools-exec``        string   The path to the samtools executable
+    ``--output``               string   The output file ('-' for STDOUT)
+    =========================  =======  ======================================
+
+    .. note::
+        No option check is done here (except for the one automatically done by
+        :py:mod:`argparse`). Those need to be done elsewhere (see
+        :py:func:`checkArgs`).
+
+    """
+    parser.add_argument("--version", action="version",
+                        version=("%(prog)s part of pgx_dnaseq "
+                                 "version {}".format(__version__)))
+    parser.add_argument("--samtools-exec", type=str, metavar="PATH",
+                        help=("The PATH to the samtools executable if not in "
+                              "the $PATH variable"))
+
+    # The input files
+    group = parser.add_argument_group("Input Files")
+    group.add_argument("-i", "--input", type=str, metavar="FILE", nargs="+",
+                       help=("The bgzipped (and indexed) VCF files, or the "
+                             "(indexed) BAM files (the files of the "
+                             "pipeline are used otherwise)"))
+    group.add_argument("--output-dir", type=str, metavar="DIR",
+                       default="output",
+                       help=("The output directory of the pipeline "
+                             "[%(default)s]"))
+    group.add_argument("--step", type=str, metavar="STEP",
+                       help=("The step (its number or the name of its "
+                             "directory) [the last step with bgzipped VCF "
+                             "files]"))
+    group.add_argument("--bam", action="store_true",
+                       help="Query the BAM files of the step")
+
+    # The regions
+    group = parser.add_argument_group("Region Options")
+    group.add_argument("-r", "--region", type=str, metavar="REGION",
+                       nargs="+",
+                       help="The regions (chr:start-end, chr:pos or chr)")
+    group.add_argument("--regions", type=str, metavar="FILE",
+                       help=("A BED file (.bed), or a file containing one "
+                             "region per line"))
+
+    # The query options
+    group = parser.add_argument_group("Query Options")
+    group.add_argument("-t", "--nb-threads", type=int, metavar="INT",
+                       default=1,
+                       help=("The number of files queried at the same time "
+                             "[%(default)d]"))
+    group.add_argument("--max-open-files", type=int, metavar="INT",
+                       default=16,
+                       help=("The maximal number of open VCF files (per "
+                             "thread) [%(default)d]"))
+    group.add_argument("--max-cached-blocks", type=int, metavar="INT",
+                       default=256,
+                       help=("The maximal number of decompressed blocks kept "
+                             "in memory [%(default)d]"))
+
+    # The output
+    group = parser.add_argument_group("Output Options")
+    group.add_argument("-o", "--output", metavar="FILE", default="-",
+                       help="The output file [STDOUT]")
+
+    return parser.parse_args()
+
+
+class ProgramError(Exception):
+    """An :py:class:`Exception` raised in case of a problem.
+
+    :param msg: the message to print to the user before exiting.
+
+    :type msg: string
+
+    """
+    def __init__(self, msg):
+        """Construction of the :py:class:`ProgramError` class.
+
+        :param msg: the message to print to the user.
+
+        :type msg: string
+
+        """
+        self.message = str(msg)
+
+    def __str__(self):
+        return self.message
+
+
+# Calling the main, if necessary
+if __name__ == "__main__":
+    main()
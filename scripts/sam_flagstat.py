@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import re
+import sys
+import argparse
+from subprocess import Popen, PIPE
+
+from pgx_dnaseq import __version__
+from pgx_dnaseq.sam import count_flags, format_flagstat
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__credits__ = ["Louis-Philippe Lemieux Perreault", "Abdellatif Daghrach",
+               "Michal Blazejczyk"]
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+__maintainer__ = "Louis-Philippe Lemieux Perreault"
+__email__ = "louis-philippe.lemieux.perreault@statgen.org"
+__status__ = "Development"
+
+
+def main():
+    """The main function."""
+    # The parser object
+    desc = ("Computes the flag statistics of a SAM file, optionally while "
+            "converting it to BAM (part of pgx_dnaseq "
+            "version {}).".format(__version__))
+    parser = argparse.ArgumentParser(description=desc)
+
+    try:
+        # Getting and checking the options
+        args = parse_args(parser)
+        check_args(args)
+
+        # Counting the flags (while writing the BAM file, if required)
+        counts = compute_flagstat(args)
+
+        # Writing the report
+        with open(args.output, "w") as o_file:
+            o_file.write(format_flagstat(counts))
+
+    except KeyboardInterrupt:
+        print("Cancelled by user", sys.stderr)
+        sys.exit(0)
+
+    except ProgramError as e:
+        parser.error(e.message)
+
+
+def compute_flagstat(options):
+    """Counts the flags of the input file (writing the BAM if required)."""
+    # The samtools executable
+    samtools = "samtools"
+    if options.samtools_exec is not None:
+        samtools = os.path.join(options.samtools_exec, "samtools")
+
+    # A BAM file is read through samtools
+    reader = None
+    if options.input.endswith(".bam"):
+        reader = Popen([samtools, "view", "-h", options.input], stdout=PIPE)
+        i_file = reader.stdout
+    elif options.input == "-":
+        i_file = sys.stdin.buffer
+    else:
+        i_file = open(options.input, "rb")
+
+    # The BAM file is written by samtools (from the same stream)
+    writer = None
+    if options.bam is not None:
+        writer = Popen(
+            [samtools, "view", "-h", "-b", "-S", "-@", str(options.threads),
+             "--output-fmt-option",
+             "level={}".format(options.compression_level), "-o", options.bam,
+             "-"],
+            stdin=PIPE,
+        )
+
+    try:
+        if writer is None:
+            counts = count_flags(i_file)
+        else:
+            counts = count_flags(_tee(i_file, writer.stdin))
+
+    finally:
+        if i_file is not sys.stdin.buffer:
+            i_file.close()
+        if writer is not None:
+            writer.stdin.close()
+
+    # Checking the processes
+    if (reader is not None) and (reader.wait() != 0):
+        m = "{}: could not read the file".format(options.input)
+        raise ProgramError(m)
+    if (writer is not None) and (writer.wait() != 0):
+        m = "{}: could not write the file".format(options.bam)
+        raise ProgramError(m)
+
+    return counts
+
+
+def _tee(i_file, o_file):
+    """Yields the lines of a file while copying them to another one."""
+    for line in i_file:
+        o_file.write(line)
+        yield line
+
+
+def check_args(args):
+    """Checks the arguments and options.
+
+    :param args: an object containing the options and arguments of the program.
+
+    :type args: :py:class:`argparse.Namespace`
+
+    :returns: ``True`` if everything was OK.
+
+    If there is a problem with an option, an exception is raised using the
+    :py:class:`ProgramError` class, a message is printed to the
+    :class:`sys.stderr` and the program exits with error code 1.
+
+    """
+    # Checking the input file
+    if args.input != "-":
+        if re.fullmatch(r".*\.[bs]am$", args.input) is None:
+            m = "{}: not a sam or bam file".format(args.input)
+            raise ProgramError(m)
+
+        if not os.path.isfile(args.input):
+            m = "{}: no such file".format(args.input)
+            raise ProgramError(m)
+
+    # Checking the BAM file
+    if args.bam is not None:
+        if not args.bam.endswith(".bam"):
+            m = "{}: not a bam file".format(args.bam)
+            raise ProgramError(m)
+
+        if args.input.endswith(".bam"):
+            m = "{}: already a bam file".format(args.input)
+            raise ProgramError(m)
+
+    # Checking the number of threads and the compression level
+    if args.threads < 0:
+        m = "{}: invalid number of threads".format(args.threads)
+        raise ProgramError(m)
+    if args.compression_level < 0 or args.compression_level > 9:
+        m = "{}: invalid compression level".format(args.compression_level)
+        raise ProgramError(m)
+
+    # Checking for the executable
+    if args.samtools_exec is not None:
+        if not os.path.isfile(os.path.join(args.samtools_exec, "samtools")):
+            m = "{}: does not contain samtools".format(args.samtools_exec)
+            raise ProgramError(m)
+
+    return True
+
+
+def parse_args(parser):
+    """Parses the command line options and arguments.
+
+    :returns: A :py:class:`argparse.Namespace` object created by the
+              :py:mod:`argparse` module. It contains the values of the
+              different options.
+
+    =======================   =======  ========================================
+            Options            Type                  Description
+    =======================   =======  ========================================
+    ``--input``               string   The input SAM (or BAM) file ('-' for
+                                       STDIN)
+    ``--bam``                 string   Convert the SAM file to this BAM file
+                                       while computing the statistics
+    ``--threads``             int      The number of additional threads used
+                                       to compress the BAM file
+    ``--compression-level``   int      The compression level of the BAM file
+    ``--output``              string   The name of the flag statistics file
+    =======================   =======  ========================================
+
+    .. note::
+        No option check is done here (except for the one automatically done by
+        :py:mod:`argparse`). Those need to be done elsewhere (see
+        :py:func:`checkArgs`).
+
+    """
+    parser.add_argument("--version", action="version",
+                        version=("%(prog)s part of pgx_dnaseq "
+                                 "version {}".format(__version__)))
+    parser.add_argument("--samtools-exec", type=str, metavar="PATH",
+                        help=("The PATH to the samtools executable if not in "
+                              "the $PATH variable"))
+
+    # The input files
+    group = parser.add_argument_group("Input Files")
+    group.add_argument("-i", "--input", type=str, metavar="FILE",
+                       required=True,
+                       help="The input SAM (or BAM) file ('-' for STDIN)")
+
+    # The BAM options
+    group = parser.add_argument_group("BAM Options")
+    group.add_argument("--bam", type=str, metavar="FILE",
+                       help=("Convert the SAM file to this BAM file while "
+                             "computing the statistics"))
+    group.add_argument("-@", "--threads", type=int, metavar="INT", default=0,
+                       help=("The number of additional threads used to "
+                             "compress the BAM file [%(default)d]"))
+    group.add_argument("-l", "--compression-level", type=int, metavar="INT",
+                       default=6,
+                       help=("The compression level of the BAM file "
+                             "[%(default)d]"))
+
+    # The output
+    group = parser.add_argument_group("Output Options")
+    group.add_argument("-o", "--output", metavar="FILE", required=True,
+                       help="The name of the flag statistics file")
+
+    return parser.parse_args()
+
+
+class ProgramError(Exception):
+    """An :py:class:`Exception` raised in case of a problem.
+
+    :param msg: the message to print to the user before exiting.
+
+    :type msg: string
+
+    """
+    def __init__(self, msg):
+        """Construction of the :py:class:`ProgramError` class.
+
+        :param msg: the message to print to the user.
+
+        :type msg: string
+
+        """
+        self.message = str(msg)
+
+    def __str__(self):
+        return self.message
+
+
+# Calling the main, if necessary
+if __name__ == "__main__":
+    main()
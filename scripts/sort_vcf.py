@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import sys
+import argparse
+
+from pgx_dnaseq import __version__
+from pgx_dnaseq import ProgramError as PGxProgramError
+from pgx_dnaseq.vcf import sort_vcf
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__credits__ = ["Louis-Philippe Lemieux Perreault", "Abdellatif Daghrach",
+               "Michal Blazejczyk"]
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+__maintainer__ = "Louis-Philippe Lemieux Perreault"
+__email__ = "louis-philippe.lemieux.perreault@statgen.org"
+__status__ = "Development"
+
+
+def main():
+    """The main function."""
+    # The parser object
+    desc = ("Sorts a VCF file using the contig order of the reference (part "
+            "of pgx_dnaseq version {}).".format(__version__))
+    parser = argparse.ArgumentParser(description=desc)
+
+    try:
+        # Getting and checking the options
+        args = parse_args(parser)
+        check_args(args)
+
+        # Sorting the file
+        try:
+            sort_vcf(
+                filename=args.input,
+                output=args.output,
+                reference=args.reference,
+                max_records=args.max_records,
+                tmp_dir=args.tmp_dir,
+                bgzip=args.bgzip,
+                compress_level=args.compression_level,
+            )
+        except PGxProgramError as e:
+            raise ProgramError(e.message)
+
+    except KeyboardInterrupt:
+        print("Cancelled by user", sys.stderr)
+        sys.exit(0)
+
+    except ProgramError as e:
+        parser.error(e.message)
+
+
+def check_args(args):
+    """Checks the arguments and options.
+
+    :param args: an object containing the options and arguments of the program.
+
+    :type args: :py:class:`argparse.Namespace`
+
+    :returns: ``True`` if everything was OK.
+
+    If there is a problem with an option, an exception is raised using the
+    :py:class:`ProgramError` class, a message is printed to the
+    :class:`sys.stderr` and the program exits with error code 1.
+
+    """
+    # Checking the input file
+    if (args.input != "-") and (not os.path.isfile(args.input)):
+        m = "{}: no such file".format(args.input)
+        raise ProgramError(m)
+
+    # Checking the reference
+    if args.reference is not None:
+        if not os.path.isfile(args.reference):
+            m = "{}: no such file".format(args.reference)
+            raise ProgramError(m)
+
+    # Checking the output (a BGZF file can't be written to STDOUT)
+    if args.bgzip and (args.output == "-"):
+        m = "cannot write a bgzipped file to STDOUT"
+        raise ProgramError(m)
+
+    # Checking the temporary directory
+    if (args.tmp_dir is not None) and (not os.path.isdir(args.tmp_dir)):
+        m = "{}: no such directory".format(args.tmp_dir)
+        raise ProgramError(m)
+
+    # Checking the number of records and the compression level
+    if args.max_records < 1:
+        m = "{}: invalid number of records".format(args.max_records)
+        raise ProgramError(m)
+    if args.compression_level < 0 or args.compression_level > 9:
+        m = "{}: invalid compression level".format(args.compression_level)
+        raise ProgramError(m)
+
+    return True
+
+
+def parse_args(parser):
+    """Parses the command line options and arguments.
+
+    :returns: A :py:class:`argparse.Namespace` object created by the
+              :py:mod:`argparse` module. It contains the values of the
+              different options.
+
+    =======================   =======  ========================================
+            Options            Type                  Description
+    =======================   =======  ========================================
+    ``--input``               string   The input VCF file ('-' for STDIN)
+    ``--reference``           string   The reference (with its .fai or .dict)
+    ``--max-records``         int      The maximal number of records in memory
+    ``--tmp-dir``             string   The directory of the temporary files
+    ``--output``              string   The sorted VCF file ('-' for STDOUT)
+    ``--bgzip``               bool     Compress the output file (BGZF)
+    ``--compression-level``   int      The compression level of the file
+    =======================   =======  ========================================
+
+    .. note::
+        No option check is done here (except for the one automatically done by
+        :py:mod:`argparse`). Those need to be done elsewhere (see
+        :py:func:`checkArgs`).
+
+    """
+    parser.add_argument("--version", action="version",
+                        version=("%(prog)s part of pgx_dnaseq "
+                                 "version {}".format(__version__)))
+
+    # The input files
+    group = parser.add_argument_group("Input Files")
+    group.add_argument("-i", "--input", type=str, metavar="FILE",
+                       required=True,
+                       help="The input VCF file ('-' for STDIN)")
+    group.add_argument("-r", "--reference", type=str, metavar="FILE",
+                       help=("The reference (with its .fai or .dict) giving "
+                             "the contig order (the VCF header is used "
+                             "otherwise)"))
+
+    # The sort options
+    group = parser.add_argument_group("Sort Options")
+    group.add_argument("--max-records", type=int, metavar="INT",
+                       default=500000,
+                       help=("The maximal number of records kept in memory "
+                             "[%(default)d]"))
+    group.add_argument("--tmp-dir", type=str, metavar="DIR",
+                       help="The directory of the temporary files")
+
+    # The output
+    group = parser.add_argument_group("Output Options")
+    group.add_argument("-o", "--output", metavar="FILE", default="-",
+                       help="The sorted VCF file [STDOUT]")
+    group.add_argument("--bgzip", action="store_true",
+                       help="Compress the output file (BGZF)")
+    group.add_argument("-l", "--compression-level", type=int, metavar="INT",
+                       default=6,
+                       help=("The compression level of the file "
+                             "[%(default)d]"))
+
+    return parser.parse_args()
+
+
+class ProgramError(Exception):
+    """An :py:class:`Exception` raised in case of a problem.
+
+    :param msg: the message to print to the user before exiting.
+
+    :type msg: string
+
+    """
+    def __init__(self, msg):
+        """Construction of the :py:class:`ProgramError` class.
+
+        :param msg: the message to print to the user.
+
+        :type msg: string
+
+        """
+        self.message = str(msg)
+
+    def __str__(self):
+        return self.message
+
+
+# Calling the main, if necessary
+if __name__ == "__main__":
+    main()
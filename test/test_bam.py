@@ -0,0 +1,128 @@
+
+# This file is part of pgx_dnaseq
+#
+# This work is licensed under the Creative Commons Attribution-NonCommercial
+# 4.0 International License. To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc/4.0/ or send a letter to Creative
+# Commons, PO Box 1866, Mountain View, CA 94042, USA.
+
+
+import os
+import random
+import shutil
+import unittest
+from tempfile import TemporaryDirectory
+from subprocess import check_call, check_output
+
+import numpy as np
+
+from pgx_dnaseq.bam import BamFile, find_bai
+
+
+__author__ = "Louis-Philippe Lemieux Perreault"
+__copyright__ = ("Copyright 2015 Beaulieu-Saucier Universite de Montreal "
+                 "Pharmacogenomics Centre. All rights reserved.")
+__license__ = "Attribution-NonCommercial 4.0 International (CC BY-NC 4.0)"
+
+
+# The references of the synthetic BAM file
+_references = (("chr1", 60000), ("chr2", 20000))
+
+# The length of the reads, and their CIGAR strings (matches, clips,
+# insertions, deletions, skipped regions and mismatches)
+_read_length = 100
+_cigars = ("100M", "5S50M10D45M", "30M3I67M", "40M200N60M", "20M30=1X49M")
+
+# The flags of the reads (some of them are skipped by samtools depth)
+_flags = (0, 0, 0, 16, 1024, 256, 4)
+
+
+def _write_sam(filename, nb_reads):
+    """Writes a SAM file containing random reads."""
+    rng = random.Random(42)
+    with open(filename, "w") as o_file:
+        print("@HD", "VN:1.6", "SO:unsorted", sep="\t", file=o_file)
+        for name, length in _references:
+            print("@SQ", "SN:" + name, "LN:{}".format(length), sep="\t",
+                  file=o_file)
+
+        for i in range(nb_reads):
+            name, length = rng.choice(_references)
+            print(
+                "read_{}".format(i + 1), rng.choice(_flags), name,
+                rng.randint(1, length - 400), rng.randint(0, 60),
+                rng.choice(_cigars), "*", 0, 0,
+                "".join(rng.choice("ACGT") for _ in range(_read_length)),
+                "".join(chr(rng.randint(0, 40) + 33)
+                        for _ in range(_read_length)),
+                sep="\t", file=o_file,
+            )
+
+
+def _samtools_depth(bam, region, min_mapq, min_baseq):
+    """Computes the depth of a region using samtools depth (-a)."""
+    output = check_output([
+        "samtools", "depth", "-a", "-r", region, "-Q", str(min_mapq), "-q",
+        str(min_baseq), bam,
+    ])
+    return np.array([int(line.split(b"\t")[2])
+                     for line in output.splitlines()], dtype=np.int64)
+
+
+class TestFindBai(unittest.TestCase):
+
+    def test_find_bai(self):
+        """Finds the samtools (X.bam.bai) and Picard (X.bai) indexes."""
+        with TemporaryDirectory() as tmp_dir:
+            bam = os.path.join(tmp_dir, "sample.bam")
+            self.assertIsNone(find_bai(bam))
+
+            picard_index = os.path.join(tmp_dir, "sample.bai")
+            open(picard_index, "wb").close()
+            self.assertEqual(picard_index, find_bai(bam))
+
+            samtools_index = os.path.join(tmp_dir, "sample.bam.bai")
+            open(samtools_index, "wb").close()
+            self.assertEqual(samtools_index, find_bai(bam))
+
+
+@unittest.skipIf(shutil.which("samtools") is None, "samtools is required")
+class TestBamDepth(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Creates a sorted BAM file (indexed as X.bai)."""
+        cls.tmp_dir = TemporaryDirectory()
+        sam = os.path.join(cls.tmp_dir.name, "sample.sam")
+        cls.bam = os.path.join(cls.tmp_dir.name, "sample.bam")
+        _write_sam(sam, 5000)
+        check_call(["samtools", "sort", "-o", cls.bam, sam])
+        check_call(["samtools", "index", cls.bam,
+                    os.path.join(cls.tmp_dir.name, "sample.bai")])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_depths(self):
+        """Compares the depths with those of samtools depth -a."""
+        thresholds = [(0, 0), (20, 0), (0, 13), (20, 13)]
+        regions = [("chr1", 0, 60000), ("chr1", 12345, 12346),
+                   ("chr1", 16000, 33000), ("chr2", 19500, 20000)]
+
+        bam = BamFile(self.bam, batch_size=500)
+        for contig, start, end in regions:
+            depths = bam.depths(contig, start, end, thresholds)
+            region = "{}:{}-{}".format(contig, start + 1, end)
+            for (min_mapq, min_baseq), depth in zip(thresholds, depths):
+                expected = _samtools_depth(self.bam, region, min_mapq,
+                                           min_baseq)
+                np.testing.assert_array_equal(
+                    expected, depth,
+                    err_msg="{} (mapq {}, baseq {})".format(region, min_mapq,
+                                                            min_baseq),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()